@@ -0,0 +1,102 @@
+# Throughput and peak memory of the streaming subscription export
+#
+# Run from the repository root:
+#     python -m benchmarks.export [--sizes 10000 100000] [--formats csv jsonl parquet]
+#                                 [--page-size 1000] [--repeat 3] [--output export.json]
+#
+# The subscriptions come from the in-memory Supabase stand-in in benchmarks.fakes.
+# Each format is timed over --repeat runs. One more run under tracemalloc records
+# the peak Python memory the export allocated on top of the seeded table, which
+# should depend on the page size and not on the number of rows.
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from benchmarks import fakes
+from benchmarks.report import summarize, build_report, write_report, compare, load_report
+from benchmarks.startup import STAND_IN_ENV
+
+async def export_once(fmt, page_size):
+    from database.export import export_subscriptions
+    with tempfile.TemporaryFile() as output:
+        start = time.perf_counter()
+        rows = await export_subscriptions(output, fmt, page_size)
+        return time.perf_counter() - start, rows, output.tell()
+
+async def run_format(supabase, fmt, page_size, repeat):
+    samples = []
+    for _ in range(repeat):
+        supabase.reset()
+        requests_before = supabase.requests
+        elapsed, rows, size = await export_once(fmt, page_size)
+        samples.append(elapsed)
+        db_requests = supabase.requests - requests_before
+
+    tracemalloc.start()
+    try:
+        await export_once(fmt, page_size)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    stats = summarize(samples)
+    stats.update({
+        'rows': rows,
+        'rows_per_second': round(rows / min(samples)),
+        'file_bytes': size,
+        'peak_memory_mb': round(peak / 1024 / 1024, 2),
+        'db_requests': db_requests
+    })
+    return stats
+
+async def run(args):
+    results = {}
+    servers = fakes.make_servers(args.servers)
+    for size in args.sizes:
+        print(f"Seeding {size} subscriptions...", file=sys.stderr)
+        supabase = fakes.FakeSupabase(servers, fakes.make_subscriptions(size, servers), latency=args.db_latency_ms / 1000)
+        fakes.install(supabase, fakes.FakePlexTv(servers, [], 0))
+        for fmt in args.formats:
+            print(f"  export.{fmt} x{args.repeat}", file=sys.stderr)
+            results.setdefault(f"export.{fmt}", {})[str(size)] = await run_format(supabase, fmt, args.page_size, args.repeat)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the streaming subscription export')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000],
+                        help='Numbers of subscriptions to seed the fake database with')
+    parser.add_argument('--formats', nargs='+', default=['csv', 'jsonl', 'parquet'],
+                        choices=['csv', 'jsonl', 'parquet'])
+    parser.add_argument('--page-size', type=int, default=1000, help='Rows fetched per database page')
+    parser.add_argument('--repeat', type=int, default=3, help='Timed runs per format and size')
+    parser.add_argument('--servers', type=int, default=3, help='Number of Plex servers')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='Simulated Supabase round-trip time')
+    parser.add_argument('--output', help='Optional file to write the JSON report to')
+    parser.add_argument('--compare', help='Earlier report to compare the results against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown of the median that counts as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    os.environ.update(STAND_IN_ENV)
+    results = asyncio.run(run(args))
+    report = build_report(
+        results,
+        sizes=args.sizes,
+        formats=args.formats,
+        page_size=args.page_size,
+        repeat=args.repeat,
+        servers=args.servers,
+        db_latency_ms=args.db_latency_ms
+    )
+    write_report(report, args.output)
+
+    if args.compare:
+        lines, regressed = compare(load_report(args.compare), report, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,647 @@
+# In-memory stand-ins for Supabase, plex.tv and Discord used by the benchmarks
+#
+# The stand-ins copy the parts of each client's interface the bot actually calls,
+# and sleep for a configurable round-trip latency so that the number of requests
+# a code path makes shows up in its timings.
+import asyncio
+import bisect
+import datetime
+import itertools
+import random
+import threading
+import time
+import uuid
+from types import SimpleNamespace
+from utils.date_utils import calculate_end_date
+
+DURATIONS = ['2_days', '1_month', '3_months', '6_months', '12_months']
+PAYMENT_METHODS = ['paypal', 'crypto', 'other']
+
+def make_servers(count):
+    return [
+        {
+            'id': str(uuid.UUID(int=i + 1)),
+            'server_name': f"server-{i + 1}",
+            'plex_url': f"http://plex-{i + 1}.bench.invalid:32400",
+            'plex_token': f"token-{i + 1}"
+        }
+        for i in range(count)
+    ]
+
+def make_subscriptions(count, servers, seed=0):
+    """Deterministic subscription rows spread over servers, with start dates in the last year"""
+    rng = random.Random(seed)
+    today = datetime.date.today()
+    rows = []
+    for i in range(count):
+        start = today - datetime.timedelta(days=rng.randrange(0, 365))
+        duration = rng.choice(DURATIONS)
+        rows.append({
+            'id': str(uuid.UUID(int=rng.getrandbits(128))),
+            'plex_username': f"user{i}",
+            'discord_username': f"member{i}",
+            'discord_user_id': 10 ** 17 + i,
+            'email': f"user{i}@example.com",
+            'server_name': servers[i % len(servers)]['server_name'],
+            'duration': duration,
+            'payment_method': rng.choice(PAYMENT_METHODS),
+            'payment_id': f"pay-{i}",
+            'start_date': start.isoformat(),
+            'end_date': calculate_end_date(start, duration).strftime('%Y-%m-%d')
+        })
+    return rows
+
+# Supabase / PostgREST
+
+class FakeResult:
+    def __init__(self, data, count=None):
+        self.data = data
+        self.count = count
+
+class FakeQuery:
+    """Chainable query builder modelled on postgrest's SyncRequestBuilder"""
+
+    def __init__(self, table):
+        self.table = table
+        self.operation = 'select'
+        self.values = None
+        self.filters = []
+        self.order_by = None
+        self.descending = False
+        self.row_limit = None
+        self.row_offset = 0
+
+    def select(self, *columns, count=None):
+        self.operation = 'select'
+        return self
+
+    def insert(self, values):
+        self.operation = 'insert'
+        self.values = values if isinstance(values, list) else [values]
+        return self
+
+    def upsert(self, values, on_conflict=None, ignore_duplicates=False):
+        self.operation = 'upsert'
+        self.values = values if isinstance(values, list) else [values]
+        self.conflict_columns = on_conflict.split(',') if on_conflict else ['id']
+        self.ignore_duplicates = ignore_duplicates
+        return self
+
+    def update(self, values):
+        self.operation = 'update'
+        self.values = values
+        return self
+
+    def delete(self):
+        self.operation = 'delete'
+        return self
+
+    def _filter(self, column, op, value):
+        self.filters.append((column, op, value))
+        return self
+
+    def eq(self, column, value):
+        return self._filter(column, 'eq', value)
+
+    def is_(self, column, value):
+        return self._filter(column, 'eq', None if value == 'null' else value)
+
+    def in_(self, column, values):
+        return self._filter(column, 'in', set(values))
+
+    def lt(self, column, value):
+        return self._filter(column, 'lt', value)
+
+    def lte(self, column, value):
+        return self._filter(column, 'lte', value)
+
+    def gt(self, column, value):
+        return self._filter(column, 'gt', value)
+
+    def gte(self, column, value):
+        return self._filter(column, 'gte', value)
+
+    def ilike(self, column, pattern):
+        return self._filter(column, 'ilike', pattern.lower().replace('%', ''))
+
+    def order(self, column, desc=False):
+        self.order_by = column
+        self.descending = desc
+        return self
+
+    def limit(self, count):
+        self.row_limit = count
+        return self
+
+    def range(self, start, end):
+        self.row_offset = start
+        self.row_limit = end - start + 1
+        return self
+
+    def execute(self):
+        self.table.client.round_trip()
+        # Database reads run in worker threads, the tables are shared between them
+        with self.table.client.lock:
+            return self._run()
+
+    def _run(self):
+        if self.operation != 'select':
+            self.table.client.dirty = True
+        if self.operation == 'insert':
+            return FakeResult([dict(row) for row in self.table.insert(self.values)])
+        if self.operation == 'upsert':
+            return FakeResult([dict(row) for row in self.table.upsert(self.values, self.conflict_columns,
+                                                                     self.ignore_duplicates)])
+
+        if self.operation == 'select' and self.order_by is not None and not self.descending:
+            page = self.table.ordered_page(self.order_by, self.filters, self.row_offset, self.row_limit)
+            if page is not None:
+                return FakeResult([dict(row) for row in page])
+
+        rows = self.table.find(self.filters)
+        if self.operation == 'delete':
+            self.table.delete(rows)
+            return FakeResult([dict(row) for row in rows])
+        if self.operation == 'update':
+            for row in rows:
+                row.update(self.values)
+            self.table.indexes.clear()
+            return FakeResult([dict(row) for row in rows])
+
+        if self.order_by is not None:
+            rows = sorted(rows, key=lambda row: (row.get(self.order_by) is None, row.get(self.order_by)),
+                          reverse=self.descending)
+        end = None if self.row_limit is None else self.row_offset + self.row_limit
+        # PostgREST returns freshly decoded JSON, so hand back copies
+        return FakeResult([dict(row) for row in rows[self.row_offset:end]])
+
+class FakeTable:
+    """Rows in a list, with hash indexes built on first use like the real table's btree indexes"""
+
+    def __init__(self, client, rows=()):
+        self.client = client
+        self.rows = [dict(row) for row in rows]
+        self.indexes = {}
+
+    def _index(self, column):
+        index = self.indexes.get(column)
+        if index is None:
+            index = self.indexes[column] = {}
+            for row in self.rows:
+                index.setdefault(row.get(column), []).append(row)
+        return index
+
+    def _sorted(self, column):
+        key = ('sorted', column)
+        if key not in self.indexes:
+            rows = sorted((row for row in self.rows if row.get(column) is not None), key=lambda row: row[column])
+            self.indexes[key] = ([row[column] for row in rows], rows)
+        return self.indexes[key]
+
+    def ordered_page(self, column, filters, offset, limit):
+        """
+        Serve 'ORDER BY column' queries whose filters are all ranges on that column
+        from a sorted index, the way keyset pagination uses the primary key.
+        Returns None when the query has other filters.
+        """
+        if any(filter_column != column or op not in ('gt', 'gte', 'lt', 'lte') for filter_column, op, _ in filters):
+            return None
+        keys, rows = self._sorted(column)
+        low, high = 0, len(keys)
+        for _, op, value in filters:
+            if op == 'gt':
+                low = max(low, bisect.bisect_right(keys, value))
+            elif op == 'gte':
+                low = max(low, bisect.bisect_left(keys, value))
+            elif op == 'lt':
+                high = min(high, bisect.bisect_left(keys, value))
+            else:
+                high = min(high, bisect.bisect_right(keys, value))
+        low += offset
+        if limit is not None:
+            high = min(high, low + limit)
+        return rows[low:high]
+
+    def insert(self, values):
+        inserted = []
+        # Sorted indexes are rebuilt on next use, hash indexes are kept up to date
+        for key in [key for key in self.indexes if isinstance(key, tuple)]:
+            del self.indexes[key]
+        for values_row in values:
+            row = {'id': str(uuid.uuid4()), **values_row}
+            self.rows.append(row)
+            for column, index in self.indexes.items():
+                index.setdefault(row.get(column), []).append(row)
+            inserted.append(row)
+        return inserted
+
+    def upsert(self, values, conflict_columns, ignore_duplicates):
+        existing = {tuple(row.get(column) for column in conflict_columns): row for row in self.rows}
+        new_rows, changed = [], []
+        for values_row in values:
+            row = existing.get(tuple(values_row.get(column) for column in conflict_columns))
+            if row is None:
+                new_rows.append(values_row)
+            elif not ignore_duplicates:
+                row.update(values_row)
+                changed.append(row)
+        if changed:
+            self.indexes.clear()
+        return changed + self.insert(new_rows)
+
+    def delete(self, rows):
+        doomed = {id(row) for row in rows}
+        self.rows = [row for row in self.rows if id(row) not in doomed]
+        self.indexes.clear()
+
+    def find(self, filters):
+        candidates = None
+        remaining = []
+        for column, op, value in filters:
+            if candidates is None and op == 'eq':
+                candidates = list(self._index(column).get(value, ()))
+            elif candidates is None and op == 'in':
+                index = self._index(column)
+                candidates = [row for key in value for row in index.get(key, ())]
+            else:
+                remaining.append((column, op, value))
+        if candidates is None:
+            candidates = self.rows
+        return [row for row in candidates if all(_matches(row, *f) for f in remaining)]
+
+def _matches(row, column, op, value):
+    current = row.get(column)
+    if op == 'eq':
+        return current == value
+    if op == 'in':
+        return current in value
+    if op == 'ilike':
+        return current is not None and value in str(current).lower()
+    if current is None:
+        return False
+    if op == 'lt':
+        return current < value
+    if op == 'lte':
+        return current <= value
+    if op == 'gt':
+        return current > value
+    if op == 'gte':
+        return current >= value
+    raise ValueError(f"Unsupported filter {op}")
+
+class FakeRpc:
+    def __init__(self, client, name, params):
+        self.client = client
+        self.name = name
+        self.params = params
+
+    def execute(self):
+        self.client.round_trip()
+        handler = self.client.functions.get(self.name)
+        if handler is None:
+            raise RuntimeError(f"Function {self.name} is not available in the fake database")
+        return FakeResult(handler(self.client, **self.params))
+
+def _extend_subscriptions(client, p_server_name, p_days, p_status='all', p_dry_run=False):
+    today = datetime.date.today().isoformat()
+    rows = client.tables['subscriptions'].find([('server_name', 'eq', p_server_name)])
+    if p_status == 'active':
+        rows = [row for row in rows if row['end_date'] >= today]
+    elif p_status == 'expired':
+        rows = [row for row in rows if row['end_date'] < today]
+    if not p_dry_run:
+        client.dirty = True
+        for row in rows:
+            end = datetime.date.fromisoformat(row['end_date']) + datetime.timedelta(days=p_days)
+            row['end_date'] = end.isoformat()
+    return len(rows)
+
+def _subscription_stats(client, p_expiring_days=7):
+    today = datetime.date.today().isoformat()
+    horizon = (datetime.date.today() + datetime.timedelta(days=p_expiring_days)).isoformat()
+    servers, durations, payment_methods = {}, {}, {}
+    for row in client.tables['subscriptions'].rows:
+        counts = servers.setdefault(row['server_name'], {
+            'server_name': row['server_name'], 'total': 0, 'active': 0, 'expired': 0, 'expiring': 0
+        })
+        counts['total'] += 1
+        if row['end_date'] < today:
+            counts['expired'] += 1
+            continue
+        counts['active'] += 1
+        counts['expiring'] += row['end_date'] <= horizon
+        durations[row['duration']] = durations.get(row['duration'], 0) + 1
+        method = row.get('payment_method') or 'unknown'
+        payment_methods[method] = payment_methods.get(method, 0) + 1
+    return {
+        'servers': [servers[name] for name in sorted(servers)],
+        'durations': durations,
+        'payment_methods': payment_methods,
+        'expiring_days': p_expiring_days
+    }
+
+def _due_reminders(client, p_days):
+    today = datetime.date.today()
+    horizon = (today + datetime.timedelta(days=max(p_days))).isoformat()
+    logged = {
+        (row['subscription_id'], row['end_date'], row['days_before'])
+        for row in client.tables.get('reminder_log', FakeTable(client)).rows
+    }
+    due = []
+    for row in client.tables['subscriptions'].find([('end_date', 'gte', today.isoformat())]):
+        if row.get('discord_user_id') is None or row['end_date'] > horizon:
+            continue
+        remaining = (datetime.date.fromisoformat(row['end_date']) - today).days
+        days_before = min(days for days in p_days if days >= remaining)
+        if (row['id'], row['end_date'], days_before) in logged:
+            continue
+        due.append({
+            'subscription_id': row['id'],
+            'discord_user_id': row['discord_user_id'],
+            'plex_username': row['plex_username'],
+            'server_name': row['server_name'],
+            'end_date': row['end_date'],
+            'days_before': days_before
+        })
+    return sorted(due, key=lambda row: (row['discord_user_id'], row['end_date']))
+
+class FakeSupabase:
+    """Replacement for the supabase Client returned by create_client()"""
+
+    def __init__(self, servers, subscriptions, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.RLock()
+        self._seed = {'plex_servers': servers, 'subscriptions': subscriptions}
+        self.functions = {
+            'extend_subscriptions': _extend_subscriptions,
+            'subscription_stats': _subscription_stats,
+            'due_reminders': _due_reminders
+        }
+        self.tables = None
+        self.reset()
+
+    def reset(self):
+        """Throw away every change made since the fake was created"""
+        if self.tables is None or self.dirty:
+            self.tables = {name: FakeTable(self, rows) for name, rows in self._seed.items()}
+            self.dirty = False
+
+    def round_trip(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def table(self, name):
+        return FakeQuery(self.tables.setdefault(name, FakeTable(self)))
+
+    def rpc(self, name, params=None):
+        return FakeRpc(self, name, params or {})
+
+# plex.tv and Plex Media Server
+
+class FakePlexUser:
+    def __init__(self, username, email, server_names):
+        self.username = username
+        self.email = email
+        self.servers = [SimpleNamespace(name=name) for name in server_names]
+
+class FakePlexAccount:
+    def __init__(self, plex_tv, token):
+        self.plex_tv = plex_tv
+        self.token = token
+        # plexapi stores the token as _token; plex_manager keys coalesced calls by it
+        self._token = token
+
+    def users(self):
+        self.plex_tv.round_trip()
+        return list(self.plex_tv.friends[self.token])
+
+    def inviteFriend(self, user, server, sections=None, **kwargs):
+        self.plex_tv.round_trip()
+        self.plex_tv.dirty = True
+        username, email = (user.split('@')[0], user) if '@' in user else (user, None)
+        self.plex_tv.friends[self.token].append(FakePlexUser(username, email, [server.friendlyName]))
+
+    def updateFriend(self, user, server, removeSections=False, **kwargs):
+        self.plex_tv.round_trip()
+        if removeSections:
+            self.plex_tv.dirty = True
+            for friend in self.plex_tv.friends[self.token]:
+                if friend.username == user:
+                    friend.servers = [share for share in friend.servers if share.name != server.friendlyName]
+
+    def removeFriend(self, user):
+        self.plex_tv.round_trip()
+        self.plex_tv.dirty = True
+        friends = self.plex_tv.friends[self.token]
+        friends[:] = [friend for friend in friends if friend.username != user]
+
+class FakePlexServer:
+    def __init__(self, plex_tv, server):
+        self.friendlyName = server['server_name']
+        sections = [SimpleNamespace(title=title, key=i) for i, title in enumerate(('Movies', 'TV Shows', 'Music'))]
+        self.library = SimpleNamespace(sections=lambda: (plex_tv.round_trip(), sections)[1])
+
+class FakePlexTv:
+    """
+    Friends lists per account token. Each server's friends are the subscriptions on it
+    plus extra_friends users the database doesn't know about yet.
+    """
+
+    def __init__(self, servers, subscriptions, extra_friends=0, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.servers_by_url = {server['plex_url'].strip(): server for server in servers}
+        self._seed = {server['plex_token']: [] for server in servers}
+        token_by_name = {server['server_name']: server['plex_token'] for server in servers}
+        for row in subscriptions:
+            self._seed[token_by_name[row['server_name']]].append((row['plex_username'], row['email'], row['server_name']))
+        counter = itertools.count()
+        for server in servers:
+            for _ in range(extra_friends):
+                n = next(counter)
+                self._seed[server['plex_token']].append((f"newuser{n}", f"newuser{n}@example.com", server['server_name']))
+        self.friends = None
+        self.reset()
+
+    def reset(self):
+        """Undo invitations and removals made since the fake was created"""
+        if self.friends is None or self.dirty:
+            self.friends = {
+                token: [FakePlexUser(username, email, [server_name]) for username, email, server_name in users]
+                for token, users in self._seed.items()
+            }
+            self.dirty = False
+
+    def round_trip(self):
+        self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def connect_account(self, plex_token):
+        self.round_trip()
+        return FakePlexAccount(self, plex_token)
+
+    def connect_server(self, plex_url, plex_token):
+        self.round_trip()
+        return FakePlexServer(self, self.servers_by_url[plex_url.strip()])
+
+    def users_xml(self, account):
+        """The friends list as plex.tv serves it, for the 'process' friends list parser"""
+        self.round_trip()
+        return make_users_xml(
+            (friend.username, friend.email, [share.name for share in friend.servers])
+            for friend in self.friends[account.token]
+        )
+
+def make_users_xml(friends):
+    """plex.tv's /api/users document for (username, email, server_names) tuples"""
+    from xml.sax.saxutils import quoteattr
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<MediaContainer friendlyName="myPlex" identifier="com.plexapp.plugins.myplex">']
+    for i, (username, email, server_names) in enumerate(friends):
+        lines.append(
+            f'<User id="{i + 1}" title={quoteattr(username)} username={quoteattr(username)} '
+            f'email={quoteattr(email or "")} recommendationsPlaylistId="" thumb="https://plex.tv/users/{i + 1}/avatar" '
+            f'protected="0" home="0" allowTuners="0" allowSync="1" allowCameraUpload="0" allowChannels="1" '
+            f'allowSubtitleAdmin="0" filterAll="" filterMovies="" filterMusic="" filterPhotos="" filterTelevision="" restricted="0">'
+        )
+        for j, server_name in enumerate(server_names):
+            lines.append(
+                f'<Server id="{i * 10 + j}" serverId="{j + 1}" machineIdentifier="machine-{j + 1}" name={quoteattr(server_name)} '
+                f'lastSeenAt="1700000000" numLibraries="3" allLibraries="1" owned="0" pending="0"/>'
+            )
+        lines.append('</User>')
+    lines.append('</MediaContainer>')
+    return '\n'.join(lines).encode('utf-8')
+
+def install(supabase=None, plex_tv=None):
+    """Point the Database singleton and plex_manager at the stand-ins"""
+    if supabase is not None:
+        from database.db import db
+        db._supabase = supabase
+    if plex_tv is not None:
+        from plex import plex_manager
+        plex_manager._connect_account = plex_tv.connect_account
+        plex_manager._connect_server = plex_tv.connect_server
+        from plex import friends
+        friends._users_xml = plex_tv.users_xml
+
+# Discord
+
+_snowflakes = itertools.count(1_000_000)
+
+class FakeMessage:
+    def __init__(self, channel, content=None, embed=None, embeds=None, files=None):
+        self.id = next(_snowflakes)
+        self.channel = channel
+        self.content = content
+        self.embeds = embeds or ([embed] if embed is not None else [])
+        self.files = files or []
+        self.edits = 0
+        self.edited_at = None
+        self.edited = asyncio.Event()
+        channel.messages[self.id] = self
+
+    async def edit(self, content=None, embed=None, embeds=None, attachments=None, **kwargs):
+        if content is not None:
+            self.content = content
+        if embed is not None or embeds is not None:
+            self.embeds = embeds or [embed]
+        self.edits += 1
+        self.edited_at = time.perf_counter()
+        self.edited.set()
+        return self
+
+class FakeChannel:
+    def __init__(self):
+        self.id = next(_snowflakes)
+        self.messages = {}
+
+    def get_partial_message(self, message_id):
+        return self.messages[message_id]
+
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(self, content, kwargs.get('embed'), kwargs.get('embeds'), kwargs.get('files'))
+
+class FakeMember:
+    def __init__(self, name):
+        self.id = next(_snowflakes)
+        self.name = name
+        self.display_name = name
+        self.mention = f"<@{self.id}>"
+        self.bot = False
+
+    def __str__(self):
+        return self.name
+
+class FakeInteractionResponse:
+    def __init__(self, interaction):
+        self._interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    async def defer(self, **kwargs):
+        self._done = True
+        self._interaction.acked_at = time.perf_counter()
+
+    async def send_message(self, content=None, **kwargs):
+        self._done = True
+        self._interaction.acked_at = time.perf_counter()
+        self._interaction.original = await self._interaction.channel.send(content, **kwargs)
+        self._interaction.responded_at = time.perf_counter()
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self._interaction = interaction
+
+    async def send(self, content=None, file=None, files=None, **kwargs):
+        files = files or ([file] if file is not None else None)
+        message = await self._interaction.channel.send(content, files=files, **kwargs)
+        self._interaction.responded_at = time.perf_counter()
+        self._interaction.messages.append(message)
+        return message
+
+class FakeInteraction:
+    """
+    Enough of discord.Interaction for the cog handlers. Records when it was
+    acknowledged and when the last response went out.
+    """
+
+    def __init__(self, command_name, channel, user=None, client=None, guild=None):
+        import discord
+        self.id = next(_snowflakes)
+        self.created_at = discord.utils.utcnow()
+        self.created = time.perf_counter()
+        self.acked_at = None
+        self.responded_at = None
+        self.command = SimpleNamespace(qualified_name=command_name, name=command_name)
+        self.data = {'name': command_name}
+        self.type = discord.InteractionType.application_command
+        self.channel = channel
+        self.channel_id = channel.id
+        self.user = user or FakeMember('operator')
+        self.client = client
+        self.guild = guild
+        self.original = None
+        self.messages = []
+        self.response = FakeInteractionResponse(self)
+        self.followup = FakeFollowup(self)
+
+    async def original_response(self):
+        return self.original or self.messages[0]
+
+class FakeBot:
+    """The attributes of commands.Bot the cogs use outside of interactions"""
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def get_channel(self, channel_id):
+        return self.channel if channel_id == self.channel.id else None
+
+    async def fetch_channel(self, channel_id):
+        return self.get_channel(channel_id)
@@ -0,0 +1,129 @@
+# Thread vs process parsing of large Plex friends lists
+#
+# Run from the repository root:
+#     python -m benchmarks.friends [--sizes 5000 20000] [--accounts 3] [--repeat 5]
+#                                  [--parsers thread process] [--output friends.json]
+#
+# Every account serves a synthetic plex.tv users document with the given number of
+# friends. Each run fetches all accounts' lists concurrently through
+# plex.friends.fetch_friends, the way reconciliation does. The 'thread' parser builds
+# plexapi objects (it needs plexapi installed), the 'process' parser hands the XML to the
+# worker processes. Next to the timings, a coroutine that sleeps 1 ms in a loop records
+# how late the event loop wakes it up, which is what commands see while the lists are parsed.
+import argparse
+import asyncio
+import os
+import random
+import sys
+import time
+from benchmarks import fakes
+from benchmarks.report import summarize, percentile, build_report, write_report, compare, load_report
+from benchmarks.startup import STAND_IN_ENV
+
+def make_friends(count, servers, seed=0):
+    rng = random.Random(seed)
+    return [
+        (f"friend{i}", f"friend{i}@example.com", rng.sample(servers, rng.randint(1, len(servers))))
+        for i in range(count)
+    ]
+
+class PayloadAccount:
+    """An account whose friends list is a fixed XML document, parsed like account.users() does"""
+
+    def __init__(self, token, payload):
+        self._token = token
+        self.payload = payload
+
+    def users(self):
+        from plexapi import utils
+        from plexapi.myplex import MyPlexUser
+        elem = utils.parseXMLString(self.payload.decode('utf-8'))
+        return [MyPlexUser(self, child, MyPlexUser.key) for child in elem if child.tag == MyPlexUser.TAG]
+
+async def watch_loop_lag(stop, lags, interval=0.001):
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+async def fetch_all(accounts, parser):
+    from plex.friends import fetch_friends
+    return await asyncio.gather(*(asyncio.to_thread(fetch_friends, account, parser) for account in accounts))
+
+async def run_parser(accounts, parser, repeat):
+    # Start the worker processes (or import plexapi) outside of the measurements
+    await fetch_all(accounts[:1], parser)
+
+    samples, lags = [], []
+    for _ in range(repeat):
+        stop = asyncio.Event()
+        watcher = asyncio.create_task(watch_loop_lag(stop, lags))
+        start = time.perf_counter()
+        lists = await fetch_all(accounts, parser)
+        samples.append(time.perf_counter() - start)
+        stop.set()
+        await watcher
+
+    stats = summarize(samples)
+    stats.update({
+        'friends': sum(len(friends) for friends in lists),
+        'loop_lag_p99_ms': round(percentile(lags, 0.99) * 1000, 3),
+        'loop_lag_max_ms': round(max(lags) * 1000, 3)
+    })
+    return stats
+
+async def run(args):
+    from plex import friends
+
+    results = {}
+    server_names = [f"server-{i + 1}" for i in range(args.servers)]
+    for size in args.sizes:
+        print(f"Building {args.accounts} friends lists of {size} friends...", file=sys.stderr)
+        payloads = {
+            f"token-{i + 1}": fakes.make_users_xml(make_friends(size, server_names, seed=i))
+            for i in range(args.accounts)
+        }
+        accounts = [PayloadAccount(token, payload) for token, payload in payloads.items()]
+        friends._users_xml = lambda account: account.payload
+        for parser in args.parsers:
+            print(f"  friends.{parser} x{args.repeat}", file=sys.stderr)
+            stats = await run_parser(accounts, parser, args.repeat)
+            stats['payload_bytes'] = sum(len(payload) for payload in payloads.values())
+            results.setdefault(f"friends.{parser}", {})[str(size)] = stats
+    friends.shutdown()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark thread vs process parsing of Plex friends lists')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[5000, 20000],
+                        help='Friends per account')
+    parser.add_argument('--accounts', type=int, default=3, help='Plex accounts fetched concurrently')
+    parser.add_argument('--servers', type=int, default=3, help='Servers that can be shared with a friend')
+    parser.add_argument('--parsers', nargs='+', default=['thread', 'process'], choices=['thread', 'process'])
+    parser.add_argument('--repeat', type=int, default=5, help='Timed runs per parser and size')
+    parser.add_argument('--output', help='Optional file to write the JSON report to')
+    parser.add_argument('--compare', help='Earlier report to compare the results against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown of the median that counts as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    os.environ.update(STAND_IN_ENV)
+    results = asyncio.run(run(args))
+    report = build_report(
+        results,
+        sizes=args.sizes,
+        accounts=args.accounts,
+        servers=args.servers,
+        parsers=args.parsers,
+        repeat=args.repeat,
+        processes=int(os.getenv('PLEX_PARSER_PROCESSES', '2'))
+    )
+    write_report(report, args.output)
+
+    if args.compare:
+        lines, regressed = compare(load_report(args.compare), report, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
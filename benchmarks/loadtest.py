@@ -0,0 +1,473 @@
+# Load test: fires bursts of simulated slash-command interactions at an in-process PlexBot
+#
+# Run from the repository root:
+#     python -m benchmarks.loadtest [--concurrency 25 50 100 200 400]
+#                                   [--mix fetch_subscription=4,invite=2,remove=1,renew=1,due_subscription=1]
+#                                   [--size 10000] [--output loadtest.json]
+#
+# The bot loads its real cogs and command tree. Interactions arrive as raw
+# INTERACTION_CREATE gateway payloads, and Discord's REST API is answered by an
+# in-process stand-in that records when each interaction was acknowledged and
+# last written to. Like Discord, the stand-in rejects acknowledgements that come
+# later than three seconds. Supabase and plex.tv are the stand-ins from
+# benchmarks.fakes with simulated latency.
+#
+# For every concurrency level the report gives time-to-ack, time-to-final-response
+# and event-loop lag percentiles, and how many interactions missed the deadline.
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import logging
+import os
+import sys
+import tempfile
+import time
+from urllib.parse import urlsplit
+from benchmarks.report import summarize, build_report, write_report
+from benchmarks.startup import STAND_IN_ENV
+
+APPLICATION_ID = 100000000000000001
+GUILD_ID = 100000000000000002
+CHANNEL_ID = 100000000000000003
+OPERATOR_ID = 100000000000000004
+
+# Discord forgets interactions that weren't acknowledged within three seconds
+ACK_DEADLINE = 3.0
+
+CHANNEL = {
+    'id': str(CHANNEL_ID),
+    'type': 0,
+    'guild_id': str(GUILD_ID),
+    'name': 'load-test',
+    'position': 0,
+    'permission_overwrites': [],
+    'nsfw': False,
+    'parent_id': None
+}
+
+DEFAULT_MIX = 'fetch_subscription=4,invite=2,remove=1,renew=1,due_subscription=1'
+
+def _user(user_id, name):
+    return {'id': str(user_id), 'username': name, 'discriminator': '0', 'global_name': name, 'avatar': None}
+
+def _member():
+    return {
+        'roles': [],
+        'joined_at': '2024-01-01T00:00:00+00:00',
+        'deaf': False,
+        'mute': False,
+        'flags': 0,
+        'permissions': '8'
+    }
+
+class _PendingResponse:
+    """What aiohttp's session.request() returns: an async context manager around the response"""
+
+    def __init__(self, coro):
+        self._coro = coro
+
+    async def __aenter__(self):
+        return await self._coro
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+class FakeHttpResponse:
+    def __init__(self, status, body=None):
+        self.status = status
+        self.reason = 'OK' if status < 300 else 'Not Found'
+        self.headers = {'content-type': 'application/json'} if body is not None else {}
+        self._text = json.dumps(body) if body is not None else ''
+
+    async def text(self, encoding='utf-8'):
+        return self._text
+
+    async def json(self):
+        return json.loads(self._text)
+
+    async def read(self):
+        return self._text.encode('utf-8')
+
+class FakeDiscordApi:
+    """
+    Discord's REST API as the bot sees it. Interaction callbacks and webhook
+    followups arrive through the aiohttp session interface, everything else
+    through HTTPClient.request.
+    """
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.requests = 0
+        self.interactions = {}
+        self.messages = {}
+        self.message_tokens = {}
+        self.originals = {}
+        self.last_activity = time.perf_counter()
+        self._message_ids = itertools.count(200000000000000000)
+
+    def reset(self):
+        self.interactions.clear()
+        self.messages.clear()
+        self.message_tokens.clear()
+        self.originals.clear()
+
+    def track(self, payload, command):
+        self.interactions[payload['token']] = {
+            'id': payload['id'],
+            'command': command,
+            'dispatched_at': time.perf_counter(),
+            'acked_at': None,
+            'last_write_at': None,
+            'rejected': False
+        }
+
+    async def _round_trip(self):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.last_activity = time.perf_counter()
+
+    def _write(self, token):
+        record = self.interactions.get(token)
+        if record is not None:
+            record['last_write_at'] = time.perf_counter()
+
+    def _store_message(self, channel_id, body, message_id=None, token=None):
+        message_id = message_id or next(self._message_ids)
+        message = self.messages.get(message_id) or {
+            'id': str(message_id),
+            'channel_id': str(channel_id),
+            'type': 0,
+            'content': '',
+            'embeds': [],
+            'attachments': [],
+            'components': [],
+            'author': {**_user(APPLICATION_ID, 'plex-bot'), 'bot': True},
+            'webhook_id': str(APPLICATION_ID),
+            'mentions': [],
+            'mention_roles': [],
+            'mention_everyone': False,
+            'pinned': False,
+            'tts': False,
+            'timestamp': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            'edited_timestamp': None,
+            'flags': 0
+        }
+        for key in ('content', 'embeds', 'components', 'flags'):
+            if body.get(key) is not None:
+                message[key] = body[key]
+        self.messages[message_id] = message
+        if token is not None:
+            self.message_tokens[message_id] = token
+        self._write(token or self.message_tokens.get(message_id))
+        return message
+
+    # aiohttp.ClientSession interface, used by interaction responses and followups
+
+    def request(self, method, url, data=None, **kwargs):
+        return _PendingResponse(self._webhook_request(method, url, data))
+
+    async def close(self):
+        pass
+
+    async def _webhook_request(self, method, url, data):
+        await self._round_trip()
+        parts = urlsplit(url).path.split('/')
+        body = json.loads(data) if isinstance(data, (str, bytes)) else {}
+
+        if 'interactions' in parts:
+            interaction_id, token = parts[parts.index('interactions') + 1:parts.index('interactions') + 3]
+            record = self.interactions.get(token)
+            now = time.perf_counter()
+            if record is not None and record['acked_at'] is None:
+                if now - record['dispatched_at'] > ACK_DEADLINE:
+                    record['rejected'] = True
+                    return FakeHttpResponse(404, {'message': 'Unknown interaction', 'code': 10062})
+                record['acked_at'] = now
+            callback_type = body.get('type')
+            resource = {'type': callback_type}
+            message_id = None
+            if callback_type in (4, 7):
+                message = self._store_message(CHANNEL_ID, body.get('data') or {}, token=token)
+                self.originals[token] = message_id = int(message['id'])
+                resource['message'] = message
+            else:
+                self._write(token)
+            return FakeHttpResponse(200, {
+                'interaction': {
+                    'id': interaction_id,
+                    'type': 2,
+                    'response_message_id': str(message_id) if message_id else None,
+                    'response_message_loading': callback_type == 5,
+                    'response_message_ephemeral': False
+                },
+                'resource': resource
+            })
+
+        if 'webhooks' in parts:
+            token = parts[parts.index('webhooks') + 2]
+            message_id = None
+            if 'messages' in parts:
+                target = parts[parts.index('messages') + 1]
+                message_id = self.originals.get(token) if target == '@original' else int(target)
+            if method == 'GET':
+                return FakeHttpResponse(200, self.messages.get(message_id) or self._store_message(CHANNEL_ID, {}, token=token))
+            if method == 'DELETE':
+                self.messages.pop(message_id, None)
+                self._write(token)
+                return FakeHttpResponse(204)
+            message = self._store_message(CHANNEL_ID, body, message_id=message_id, token=token)
+            if 'messages' in parts and parts[parts.index('messages') + 1] == '@original':
+                self.originals[token] = int(message['id'])
+            return FakeHttpResponse(200, message)
+
+        return FakeHttpResponse(404, {'message': 'Unknown route', 'code': 0})
+
+    # discord.http.HTTPClient.request, used by everything outside interactions
+
+    async def rest_request(self, route, *, files=None, form=None, **kwargs):
+        await self._round_trip()
+        parts = urlsplit(route.url).path.split('/')
+        body = kwargs.get('json') or {}
+        if 'channels' in parts:
+            channel_id = int(parts[parts.index('channels') + 1])
+            if 'messages' in parts:
+                index = parts.index('messages')
+                if route.method == 'POST':
+                    return self._store_message(channel_id, body)
+                message_id = int(parts[index + 1])
+                if route.method == 'PATCH':
+                    return self._store_message(channel_id, body, message_id=message_id)
+                return self.messages.get(message_id) or self._store_message(channel_id, {}, message_id=message_id)
+            return dict(CHANNEL, id=str(channel_id))
+        if 'users' in parts:
+            user_id = parts[parts.index('users') + 1]
+            return _user(user_id, f"member{user_id[-6:]}")
+        return {}
+
+# Scenarios: build the options of one interaction for a command
+
+def _option(name, value, option_type=3):
+    return {'name': name, 'type': option_type, 'value': value}
+
+def scenario_fetch_subscription(ctx, level, i):
+    return [_option('user_identifier', ctx.existing_user(i)['plex_username'])], None
+
+def scenario_invite(ctx, level, i):
+    member_id = 300000000000000000 + level * 100000 + i
+    resolved = {
+        'users': {str(member_id): _user(member_id, f"loadmember{i}")},
+        'members': {str(member_id): _member()}
+    }
+    options = [
+        _option('discord_user', str(member_id), option_type=6),
+        _option('plex_username', f"loadtest-{level}-{i}@example.com"),
+        _option('server_name', ctx.server(i)['server_name']),
+        _option('duration', '1_month'),
+        _option('payment_method', 'paypal'),
+        _option('payment_id', f"load-{level}-{i}"),
+        _option('start_date', datetime.date.today().strftime('%d-%m-%Y'))
+    ]
+    return options, resolved
+
+def scenario_remove(ctx, level, i):
+    return [_option('plex_username', ctx.existing_user(i)['plex_username'])], None
+
+def scenario_renew(ctx, level, i):
+    return [_option('user_identifier', ctx.existing_user(i)['plex_username']), _option('duration', '1_month')], None
+
+def scenario_due_subscription(ctx, level, i):
+    return [], None
+
+SCENARIOS = {
+    'fetch_subscription': scenario_fetch_subscription,
+    'invite': scenario_invite,
+    'remove': scenario_remove,
+    'renew': scenario_renew,
+    'due_subscription': scenario_due_subscription,
+}
+
+_interaction_counter = itertools.count()
+
+def interaction_payload(command, options, resolved=None):
+    """A raw INTERACTION_CREATE payload for a slash command run in the test guild"""
+    import discord
+    # Real snowflakes, so Interaction.created_at (used by the ack metrics) is meaningful
+    interaction_id = discord.utils.time_snowflake(discord.utils.utcnow()) + next(_interaction_counter) % (1 << 22)
+    return {
+        'id': str(interaction_id),
+        'application_id': str(APPLICATION_ID),
+        'type': 2,
+        'token': f"token-{interaction_id}",
+        'version': 1,
+        'guild_id': str(GUILD_ID),
+        'channel_id': str(CHANNEL_ID),
+        'channel': CHANNEL,
+        'member': {**_member(), 'user': _user(OPERATOR_ID, 'operator')},
+        'locale': 'en-US',
+        'guild_locale': 'en-US',
+        'app_permissions': '8',
+        'entitlements': [],
+        # Required since discord.py 2.6
+        'attachment_size_limit': 10 * 1024 * 1024,
+        'data': {
+            'id': str(interaction_id - 1),
+            'name': command,
+            'type': 1,
+            'options': options,
+            'resolved': resolved or {}
+        }
+    }
+
+def parse_mix(spec):
+    """Parse 'invite=2,remove=1' into a weighted, repeating list of command names"""
+    weights = []
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, weight = item.partition('=')
+        if name not in SCENARIOS:
+            raise SystemExit(f"Unknown command '{name}' in --mix, choose from {', '.join(SCENARIOS)}")
+        weights.append((name, int(weight or 1)))
+    # Interleave the commands instead of sending each kind in one block
+    sequence = []
+    for round_number in range(max(weight for _, weight in weights)):
+        sequence.extend(name for name, weight in weights if round_number < weight)
+    return sequence
+
+async def sample_loop_lag(samples, interval=0.01):
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+async def run_level(plex_bot, api, ctx, sequence, level, args):
+    """Fire one burst of interactions and wait for the bot to go quiet"""
+    api.reset()
+    ctx.reset()
+    lag_samples = []
+    sampler = asyncio.create_task(sample_loop_lag(lag_samples))
+
+    started = time.perf_counter()
+    for i in range(level):
+        command = sequence[i % len(sequence)]
+        options, resolved = SCENARIOS[command](ctx, level, i)
+        payload = interaction_payload(command, options, resolved)
+        api.track(payload, command)
+        plex_bot._connection.parse_interaction_create(payload)
+        if args.ramp:
+            await asyncio.sleep(args.ramp / level)
+
+    # Done once nothing was sent to Discord for a while and every interaction was
+    # either answered or is too old to be answered any more
+    deadline = started + args.timeout
+    while time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+        now = time.perf_counter()
+        waiting = any(
+            record['last_write_at'] is None and not record['rejected']
+            and now - record['dispatched_at'] < ACK_DEADLINE + args.settle
+            for record in api.interactions.values()
+        )
+        if now - api.last_activity > args.settle and not waiting:
+            break
+    sampler.cancel()
+
+    records = list(api.interactions.values())
+    result = {
+        'interactions': level,
+        'wall_seconds': round(time.perf_counter() - started, 3),
+        'missed_ack_deadline': sum(1 for r in records if r['acked_at'] is None),
+        'time_to_ack': summarize([r['acked_at'] - r['dispatched_at'] for r in records if r['acked_at']]),
+        'time_to_final': summarize([r['last_write_at'] - r['dispatched_at'] for r in records if r['last_write_at']]),
+        'loop_lag': summarize(lag_samples),
+        'by_command': {}
+    }
+    result['missed_ack_ratio'] = round(result['missed_ack_deadline'] / level, 4)
+    for command in sorted(set(sequence)):
+        command_records = [r for r in records if r['command'] == command]
+        result['by_command'][command] = {
+            'interactions': len(command_records),
+            'missed_ack_deadline': sum(1 for r in command_records if r['acked_at'] is None),
+            'time_to_ack': summarize([r['acked_at'] - r['dispatched_at'] for r in command_records if r['acked_at']]),
+            'time_to_final': summarize([r['last_write_at'] - r['dispatched_at'] for r in command_records if r['last_write_at']])
+        }
+    return result
+
+async def run_loadtest(args):
+    import discord
+    import bot as bot_module
+    from benchmarks.suite import BenchContext
+
+    sequence = parse_mix(args.mix)
+    ctx = BenchContext(args.size, args.servers, 0, args.db_latency_ms / 1000, args.plex_latency_ms / 1000)
+    api = FakeDiscordApi(args.discord_latency_ms / 1000)
+
+    async def stand_in_sync(*args, **kwargs):
+        return []
+
+    plex_bot = bot_module.PlexBot()
+    plex_bot.tree.sync = stand_in_sync
+    results = {}
+    async with plex_bot:
+        # Stand in for the gateway handshake and Discord's REST API
+        plex_bot._connection.application_id = APPLICATION_ID
+        # guild.me and permission checks need the bot's own user, set by READY on a real connection
+        plex_bot._connection.user = discord.ClientUser(state=plex_bot._connection, data=_user(APPLICATION_ID, 'plex-bot'))
+        plex_bot.http._HTTPClient__session = api
+        plex_bot.http.request = api.rest_request
+        await plex_bot.setup_hook()
+
+        for level in args.concurrency:
+            print(f"Firing {level} concurrent interactions...", file=sys.stderr)
+            results[str(level)] = result = await run_level(plex_bot, api, ctx, sequence, level, args)
+            print(
+                f"  ack p50/p95/p99 {result['time_to_ack'].get('median_ms')}/{result['time_to_ack'].get('p95_ms')}/"
+                f"{result['time_to_ack'].get('p99_ms')}ms, missed deadline {result['missed_ack_deadline']}, "
+                f"final p95 {result['time_to_final'].get('p95_ms')}ms, loop lag p99 {result['loop_lag'].get('p99_ms')}ms",
+                file=sys.stderr
+            )
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test the bot with concurrent simulated interactions')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[25, 50, 100, 200, 400],
+                        help='Sizes of the interaction bursts to fire, one level after the other')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help='Commands and their weights, e.g. invite=2,remove=1')
+    parser.add_argument('--ramp', type=float, default=0.0, help='Seconds to spread each burst over')
+    parser.add_argument('--size', type=int, default=10000, help='Number of subscriptions in the fake database')
+    parser.add_argument('--servers', type=int, default=3, help='Number of Plex servers')
+    parser.add_argument('--db-latency-ms', type=float, default=15.0, help='Simulated Supabase round-trip time')
+    parser.add_argument('--plex-latency-ms', type=float, default=100.0, help='Simulated plex.tv round-trip time')
+    parser.add_argument('--discord-latency-ms', type=float, default=50.0, help='Simulated Discord REST round-trip time')
+    parser.add_argument('--settle', type=float, default=2.0,
+                        help='Seconds without Discord API calls before a level counts as finished')
+    parser.add_argument('--timeout', type=float, default=300.0, help='Longest time to wait for one level')
+    parser.add_argument('--output', help='Optional file to write the JSON report to')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ.update(STAND_IN_ENV)
+        os.environ['JOB_QUEUE_PATH'] = os.path.join(tmp_dir, 'jobs.sqlite3')
+        os.environ['COMMAND_TREE_HASH_FILE'] = os.path.join(tmp_dir, 'command_tree_hash')
+        os.environ['METRICS_PORT'] = '0'
+        results = asyncio.run(run_loadtest(args))
+
+    report = build_report(
+        results,
+        mix=args.mix,
+        ramp=args.ramp,
+        size=args.size,
+        servers=args.servers,
+        db_latency_ms=args.db_latency_ms,
+        plex_latency_ms=args.plex_latency_ms,
+        discord_latency_ms=args.discord_latency_ms,
+        ack_deadline_seconds=ACK_DEADLINE
+    )
+    write_report(report, args.output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,80 @@
+# Summary statistics, JSON reports and baseline comparison shared by the benchmarks
+import datetime
+import json
+import math
+import platform
+import statistics
+import sys
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of a list of numbers"""
+    ordered = sorted(samples)
+    if not ordered:
+        return None
+    rank = max(1, math.ceil(fraction * len(ordered)))
+    return ordered[rank - 1]
+
+def summarize(samples):
+    """Milliseconds summary of a list of durations in seconds"""
+    if not samples:
+        return {'runs': 0}
+    return {
+        'runs': len(samples),
+        'median_ms': round(statistics.median(samples) * 1000, 3),
+        'p95_ms': round(percentile(samples, 0.95) * 1000, 3),
+        'p99_ms': round(percentile(samples, 0.99) * 1000, 3),
+        'min_ms': round(min(samples) * 1000, 3),
+        'max_ms': round(max(samples) * 1000, 3)
+    }
+
+def build_report(results, **settings):
+    """Wrap results with the settings and environment they were measured with"""
+    return {
+        'created_at': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'python': sys.version.split()[0],
+        'platform': platform.platform(),
+        'settings': settings,
+        'results': results
+    }
+
+def write_report(report, path=None):
+    output = json.dumps(report, indent=2)
+    print(output)
+    if path:
+        with open(path, 'w') as f:
+            f.write(output + '\n')
+
+# Request counts are deterministic, so any increase is reported
+COUNT_KEYS = ('db_requests', 'plex_requests')
+
+def compare(baseline, current, threshold=0.2, key='median_ms'):
+    """
+    Compare two reports benchmark by benchmark. Returns the printable lines and
+    whether any benchmark got slower than threshold (0.2 = 20%) or started making
+    more database or Plex requests.
+    """
+    lines = [f"{'benchmark':<44} {'baseline':>12} {'current':>12} {'change':>8}"]
+    regressed = False
+    for name, cases in current['results'].items():
+        for case, stats in cases.items():
+            old_stats = baseline['results'].get(name, {}).get(case, {})
+            before = old_stats.get(key)
+            after = stats.get(key)
+            if before is None or after is None:
+                lines.append(f"{name + ' ' + case:<44} {'-':>12} {after if after is not None else '-':>12} {'new':>8}")
+                continue
+            change = (after - before) / before if before else 0.0
+            flag = ''
+            if change > threshold:
+                regressed = True
+                flag = '  REGRESSION'
+            for count_key in COUNT_KEYS:
+                if stats.get(count_key, 0) > old_stats.get(count_key, float('inf')):
+                    regressed = True
+                    flag += f"  {count_key} {old_stats[count_key]} -> {stats[count_key]}"
+            lines.append(f"{name + ' ' + case:<44} {before:>12.3f} {after:>12.3f} {change:>+7.1%}{flag}")
+    return lines, regressed
+
+def load_report(path):
+    with open(path) as f:
+        return json.load(f)
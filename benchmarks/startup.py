@@ -0,0 +1,106 @@
+# Measures bot cold-start latency: module import time and time until setup_hook finishes
+#
+# Run from the repository root:
+#     python -m benchmarks.startup [--runs 5] [--servers 3] [--output startup.json]
+#
+# Discord, Supabase and Plex are replaced with stand-ins, so no network access or
+# credentials are needed. setup_hook includes the warm-up of the database and Plex
+# connections, whose per-step timings are reported as well. The numbers are printed as JSON so they can be tracked over time.
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Dummy values so config.py has something to read; nothing connects with them
+STAND_IN_ENV = {
+    'DISCORD_BOT_TOKEN': 'stand-in-token',
+    'SUPABASE_URL': 'http://127.0.0.1:1',
+    'SUPABASE_KEY': 'stand-in-key',
+}
+
+IMPORT_SNIPPET = (
+    "import time; start = time.perf_counter(); import bot; "
+    "print(time.perf_counter() - start)"
+)
+
+def measure_import(env):
+    """Import bot.py in a fresh interpreter and return the import time in seconds"""
+    result = subprocess.run(
+        [sys.executable, '-c', IMPORT_SNIPPET],
+        env=env,
+        capture_output=True,
+        text=True,
+        check=True
+    )
+    return float(result.stdout.strip().splitlines()[-1])
+
+async def measure_setup(servers, subscriptions, db_latency, plex_latency):
+    """
+    Build PlexBot and run setup_hook against stand-ins, returning elapsed seconds
+    and the warm-up step timings.
+    """
+    import bot as bot_module
+    from benchmarks import fakes
+
+    async def stand_in_sync(*args, **kwargs):
+        return []
+
+    # Skip real client construction and Discord sync, everything else runs as in production
+    server_rows = fakes.make_servers(servers)
+    subscription_rows = fakes.make_subscriptions(subscriptions, server_rows)
+    fakes.install(
+        fakes.FakeSupabase(server_rows, subscription_rows, latency=db_latency),
+        fakes.FakePlexTv(server_rows, subscription_rows, latency=plex_latency)
+    )
+    start = time.perf_counter()
+    plex_bot = bot_module.PlexBot()
+    plex_bot.tree.sync = stand_in_sync
+    try:
+        await plex_bot.setup_hook()
+        return time.perf_counter() - start, dict(plex_bot.warmup_timings)
+    finally:
+        await plex_bot.close()
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure bot cold-start latency')
+    parser.add_argument('--runs', type=int, default=5, help='Number of import measurements')
+    parser.add_argument('--servers', type=int, default=3, help='Number of Plex servers to warm up')
+    parser.add_argument('--subscriptions', type=int, default=1000, help='Subscriptions (and Plex friends) to seed')
+    parser.add_argument('--db-latency-ms', type=float, default=20.0, help='Simulated Supabase round-trip time')
+    parser.add_argument('--plex-latency-ms', type=float, default=100.0, help='Simulated plex.tv round-trip time')
+    parser.add_argument('--output', help='Optional file to write the JSON result to')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        env = dict(os.environ, **STAND_IN_ENV)
+        env['COMMAND_TREE_HASH_FILE'] = os.path.join(tmp_dir, 'command_tree_hash')
+        os.environ.update(env)
+
+        import_times = [measure_import(env) for _ in range(args.runs)]
+        setup_time, warmup_timings = asyncio.run(measure_setup(
+            args.servers, args.subscriptions, args.db_latency_ms / 1000, args.plex_latency_ms / 1000
+        ))
+
+    import_median = statistics.median(import_times)
+    result = {
+        'import_seconds': round(import_median, 4),
+        'import_seconds_min': round(min(import_times), 4),
+        'setup_seconds': round(setup_time, 4),
+        'cold_start_seconds': round(import_median + setup_time, 4),
+        'warmup_seconds': {name: round(seconds, 4) for name, seconds in warmup_timings.items()},
+        'runs': args.runs,
+    }
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,312 @@
+# Benchmarks for Database methods, plex_manager functions and full cog handlers
+#
+# Run from the repository root:
+#     python -m benchmarks.suite [--sizes 1000 10000 100000] [--repeat 20]
+#                                [--only db. cog.invite] [--output bench.json]
+#                                [--compare baseline.json --threshold 0.2]
+#
+# Supabase, plex.tv and Discord are replaced with the in-memory stand-ins from
+# benchmarks.fakes, seeded with the given numbers of subscriptions. Besides timings,
+# every benchmark reports how many database and Plex requests one run makes, which
+# catches N+1 regressions even when the simulated latency is zero. With --compare
+# the exit status is 1 if any median got slower than the threshold.
+import argparse
+import asyncio
+import datetime
+import logging
+import os
+import statistics
+import sys
+import tempfile
+import time
+from benchmarks import fakes
+from benchmarks.report import summarize, build_report, write_report, compare, load_report
+from benchmarks.startup import STAND_IN_ENV
+
+class BenchContext:
+    """Seeded stand-ins and cog instances for one table size"""
+
+    def __init__(self, size, servers, extra_friends, db_latency, plex_latency):
+        self.size = size
+        self.servers = fakes.make_servers(servers)
+        self.subscriptions = fakes.make_subscriptions(size, self.servers)
+        self.supabase = fakes.FakeSupabase(self.servers, self.subscriptions, latency=db_latency)
+        self.plex_tv = fakes.FakePlexTv(self.servers, self.subscriptions, extra_friends, latency=plex_latency)
+        self.channel = fakes.FakeChannel()
+        self.bot = fakes.FakeBot(self.channel)
+        self.cogs = {}
+        fakes.install(self.supabase, self.plex_tv)
+
+    def reset(self):
+        from plex import plex_manager
+        from database.db import invalidate_subscriptions, invalidate_plex_servers
+        self.supabase.reset()
+        self.plex_tv.reset()
+        # Every run starts cold, as the first command after a restart without warm-up would
+        plex_manager.clear_caches()
+        invalidate_subscriptions()
+        invalidate_plex_servers()
+
+    def interaction(self, command_name):
+        return fakes.FakeInteraction(command_name, self.channel, client=self.bot)
+
+    def server(self, i):
+        return self.servers[i % len(self.servers)]
+
+    def existing_user(self, i):
+        """A subscriber spread across the table, so lookups don't always hit the same row"""
+        return self.subscriptions[(i * 7919) % self.size]
+
+async def load_cogs(ctx):
+    from cogs.invite import Invite
+    from cogs.remove import Remove
+    from cogs.due_subscription import DueSubscription
+    from cogs.import_users import ImportUsers
+
+    ctx.cogs = {
+        'invite': Invite(ctx.bot),
+        'remove': Remove(ctx.bot),
+        'due_subscription': DueSubscription(ctx.bot),
+        'import_users': ImportUsers(ctx.bot)
+    }
+    # Registers the invite and remove job handlers with this size's bot
+    await ctx.cogs['invite'].cog_load()
+    await ctx.cogs['remove'].cog_load()
+
+async def wait_for_job_message(interaction, timeout=120):
+    """Time from interaction creation until the queued job edited the reply"""
+    message = await interaction.original_response()
+    await asyncio.wait_for(message.edited.wait(), timeout)
+    return {
+        'ack': interaction.acked_at - interaction.created,
+        'final': message.edited_at - interaction.created
+    }
+
+# Database
+
+async def bench_db_get_subscription(ctx, i):
+    from database.db import db
+    await db.get_subscription(ctx.existing_user(i)['plex_username'])
+
+async def bench_db_get_subscriptions_for_users(ctx, i):
+    from database.db import db
+    await db.get_subscriptions_for_users([ctx.existing_user(i + n)['email'] for n in range(200)])
+
+async def bench_db_get_all_subscriptions(ctx, i):
+    from database.db import db
+    await db.get_all_subscriptions()
+
+async def bench_db_get_subscriptions_by_server(ctx, i):
+    from database.db import db
+    await db.get_subscriptions_by_server(ctx.server(i)['server_name'], status='active', limit=10)
+
+async def bench_db_add_subscriptions(ctx, i):
+    from database.db import db
+    today = datetime.date.today().isoformat()
+    await db.add_subscriptions([
+        {
+            'plex_username': f"bench-{i}-{n}",
+            'server_name': ctx.server(n)['server_name'],
+            'duration': '1_month',
+            'start_date': today
+        }
+        for n in range(100)
+    ])
+
+async def bench_db_extend_subscriptions(ctx, i):
+    from database.db import db
+    await db.extend_subscriptions(ctx.server(i)['server_name'], 30, status='active', dry_run=True)
+
+async def bench_db_get_subscription_stats(ctx, i):
+    from database.db import db, stats_cache
+    # Measure the aggregation itself, not the result cache
+    stats_cache.invalidate()
+    await db.get_subscription_stats()
+
+async def bench_db_get_due_reminders(ctx, i):
+    from database.db import db
+    await db.get_due_reminders([7, 2, 0])
+
+# plex_manager
+
+async def bench_plex_get_friends_snapshot(ctx, i):
+    from plex.plex_manager import get_friends_snapshot, _connect_account
+    get_friends_snapshot(_connect_account(ctx.server(i)['plex_token']))
+
+async def bench_plex_get_all_users_from_server(ctx, i):
+    from plex.plex_manager import get_all_users_from_server
+    server = ctx.server(i)
+    get_all_users_from_server(server['plex_url'], server['plex_token'])
+
+async def bench_plex_get_user_details(ctx, i):
+    from plex.plex_manager import get_user_details
+    user = ctx.existing_user(i)
+    token = next(s['plex_token'] for s in ctx.servers if s['server_name'] == user['server_name'])
+    get_user_details(token, user['email'])
+
+async def bench_plex_invite_user_to_plex(ctx, i):
+    from plex.plex_manager import invite_user_to_plex
+    server = ctx.server(i)
+    invite_user_to_plex(server['plex_url'], server['plex_token'], f"invitee{i}@example.com")
+
+async def bench_plex_remove_user_from_plex(ctx, i):
+    from plex.plex_manager import remove_user_from_plex
+    user = ctx.existing_user(i)
+    server = next(s for s in ctx.servers if s['server_name'] == user['server_name'])
+    remove_user_from_plex(server['plex_url'], server['plex_token'], user['plex_username'])
+
+async def bench_reconcile(ctx, i):
+    from plex.reconcile import reconcile
+    await reconcile()
+
+async def bench_expiry_table(ctx, i):
+    from utils.expiry import ExpiryTable, CRITICAL, WARNING, NOTICE
+    ExpiryTable(ctx.subscriptions).indices(CRITICAL, WARNING, NOTICE)
+
+# Cog handlers, driven end to end with fake interactions
+
+async def bench_cog_invite(ctx, i):
+    from cogs.invite import duration_choices, payment_choices
+    cog = ctx.cogs['invite']
+    interaction = ctx.interaction('invite')
+    await cog.invite.callback(
+        cog, interaction,
+        discord_user=fakes.FakeMember(f"newmember{i}"),
+        plex_username=f"invitee-{ctx.size}-{i}-{time.time_ns()}@example.com",
+        server_name=ctx.server(i)['server_name'],
+        duration=duration_choices[1],
+        payment_method=payment_choices[0],
+        payment_id=f"bench-{i}",
+        start_date=datetime.date.today().strftime('%d-%m-%Y')
+    )
+    return await wait_for_job_message(interaction)
+
+async def bench_cog_remove(ctx, i):
+    cog = ctx.cogs['remove']
+    interaction = ctx.interaction('remove')
+    await cog.remove.callback(cog, interaction, plex_username=ctx.existing_user(i)['plex_username'])
+    return await wait_for_job_message(interaction)
+
+async def bench_cog_due_subscription(ctx, i):
+    cog = ctx.cogs['due_subscription']
+    await cog.due_subscription.callback(cog, ctx.interaction('due_subscription'))
+
+async def bench_cog_import_all(ctx, i):
+    cog = ctx.cogs['import_users']
+    await cog.import_all.callback(cog, ctx.interaction('import_all'))
+
+BENCHMARKS = [
+    ('db.get_subscription', bench_db_get_subscription),
+    ('db.get_subscriptions_for_users', bench_db_get_subscriptions_for_users),
+    ('db.get_all_subscriptions', bench_db_get_all_subscriptions),
+    ('db.get_subscriptions_by_server', bench_db_get_subscriptions_by_server),
+    ('db.add_subscriptions', bench_db_add_subscriptions),
+    ('db.extend_subscriptions', bench_db_extend_subscriptions),
+    ('db.get_subscription_stats', bench_db_get_subscription_stats),
+    ('db.get_due_reminders', bench_db_get_due_reminders),
+    ('plex.get_friends_snapshot', bench_plex_get_friends_snapshot),
+    ('plex.get_all_users_from_server', bench_plex_get_all_users_from_server),
+    ('plex.get_user_details', bench_plex_get_user_details),
+    ('plex.invite_user_to_plex', bench_plex_invite_user_to_plex),
+    ('plex.remove_user_from_plex', bench_plex_remove_user_from_plex),
+    ('reconcile', bench_reconcile),
+    ('expiry.table', bench_expiry_table),
+    ('cog.invite', bench_cog_invite),
+    ('cog.remove', bench_cog_remove),
+    ('cog.due_subscription', bench_cog_due_subscription),
+    ('cog.import_all', bench_cog_import_all),
+]
+
+async def run_benchmark(ctx, func, repeat):
+    """Run one benchmark repeat times, resetting the stand-ins in between"""
+    samples = {}
+    db_requests = []
+    plex_requests = []
+    for i in range(repeat):
+        ctx.reset()
+        db_before, plex_before = ctx.supabase.requests, ctx.plex_tv.requests
+        start = time.perf_counter()
+        timings = await func(ctx, i)
+        elapsed = time.perf_counter() - start
+        db_requests.append(ctx.supabase.requests - db_before)
+        plex_requests.append(ctx.plex_tv.requests - plex_before)
+        for suffix, value in (timings or {None: elapsed}).items():
+            samples.setdefault(suffix, []).append(value)
+
+    results = {}
+    for suffix, values in samples.items():
+        stats = summarize(values)
+        stats['db_requests'] = statistics.median(db_requests)
+        stats['plex_requests'] = statistics.median(plex_requests)
+        results[suffix] = stats
+    return results
+
+async def run_suite(args):
+    from plex.job_queue import job_queue
+
+    selected = [(name, func) for name, func in BENCHMARKS
+                if not args.only or any(name.startswith(prefix) for prefix in args.only)]
+    results = {}
+    await job_queue.start(2)
+    try:
+        for size in args.sizes:
+            print(f"Seeding {size} subscriptions...", file=sys.stderr)
+            ctx = BenchContext(size, args.servers, args.extra_friends,
+                               args.db_latency_ms / 1000, args.plex_latency_ms / 1000)
+            if any(name.startswith('cog.') for name, _ in selected):
+                await load_cogs(ctx)
+            for name, func in selected:
+                repeat = args.cog_repeat if name.startswith('cog.') else args.repeat
+                print(f"  {name} x{repeat}", file=sys.stderr)
+                for suffix, stats in (await run_benchmark(ctx, func, repeat)).items():
+                    full_name = f"{name}.{suffix}" if suffix else name
+                    results.setdefault(full_name, {})[str(size)] = stats
+    finally:
+        await job_queue.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Database, plex_manager and cog hot paths')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Numbers of subscriptions to seed the fake database with')
+    parser.add_argument('--repeat', type=int, default=20, help='Runs per Database and Plex benchmark')
+    parser.add_argument('--cog-repeat', type=int, default=3, help='Runs per cog handler benchmark')
+    parser.add_argument('--servers', type=int, default=3, help='Number of Plex servers')
+    parser.add_argument('--extra-friends', type=int, default=50,
+                        help='Plex friends per server that are not in the database yet')
+    parser.add_argument('--db-latency-ms', type=float, default=0.0, help='Simulated Supabase round-trip time')
+    parser.add_argument('--plex-latency-ms', type=float, default=0.0, help='Simulated plex.tv round-trip time')
+    parser.add_argument('--only', nargs='+', help='Only run benchmarks whose name starts with one of these')
+    parser.add_argument('--output', help='Optional file to write the JSON report to')
+    parser.add_argument('--compare', help='Earlier report to compare the results against')
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help='Slowdown of the median that counts as a regression (0.2 = 20%%)')
+    args = parser.parse_args()
+
+    # Keep the per-user logging of the cogs out of the measurements
+    logging.basicConfig(level=logging.CRITICAL)
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        os.environ.update(STAND_IN_ENV)
+        os.environ['JOB_QUEUE_PATH'] = os.path.join(tmp_dir, 'jobs.sqlite3')
+        results = asyncio.run(run_suite(args))
+
+    report = build_report(
+        results,
+        sizes=args.sizes,
+        repeat=args.repeat,
+        cog_repeat=args.cog_repeat,
+        servers=args.servers,
+        extra_friends=args.extra_friends,
+        db_latency_ms=args.db_latency_ms,
+        plex_latency_ms=args.plex_latency_ms
+    )
+    write_report(report, args.output)
+
+    if args.compare:
+        lines, regressed = compare(load_report(args.compare), report, args.threshold)
+        print('\n'.join(lines), file=sys.stderr)
+        sys.exit(1 if regressed else 0)
+
+if __name__ == '__main__':
+    main()
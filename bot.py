@@ -1,20 +1,35 @@
 # Main entry point for the Discord bot
 import discord
+from discord import app_commands
 from discord.ext import commands
 import asyncio
+import hashlib
+import json
 import logging
-from config import DISCORD_BOT_TOKEN, DEBUG_MODE
-from database.db import db
-
-# Set up logging
-logging.basicConfig(
-    level=logging.DEBUG if DEBUG_MODE else logging.INFO,
-    format='%(asctime)s [%(levelname)s] %(message)s',
-    handlers=[
-        logging.FileHandler('discord-bot.log'),
-        logging.StreamHandler()
-    ]
+import os
+import time
+from config import (
+    DISCORD_BOT_TOKEN,
+    COMMAND_TREE_HASH_FILE,
+    JOB_QUEUE_WORKERS,
+    METRICS_HOST,
+    METRICS_PORT,
+    LOOP_STALL_THRESHOLD_MS,
+    LOOP_STALL_REPORT_INTERVAL,
+    PLEX_HEALTH_INTERVAL,
+    WARMUP_BUDGET_SECONDS,
+    DATABASE_URL,
+    validate_config
 )
+from database.db import db
+from database.listener import ChangeListener
+from plex.job_queue import job_queue
+from plex.health import health_monitor
+from plex import plex_manager, friends
+from utils.metrics import start_metrics_server, monitor_event_loop_lag, observe_command
+from utils.tracing import start_trace, finish_trace
+from utils.loop_monitor import LoopStallDetector
+from utils.logger import setup_logging
 
 logger = logging.getLogger(__name__)
 
@@ -24,57 +39,213 @@ intents.message_content = True
 intents.guilds = True
 intents.messages = True
 
+class PlexCommandTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        # Every slash command gets a trace; autocomplete requests are too small to bother
+        if interaction.type == discord.InteractionType.application_command:
+            start_trace(f"/{interaction.data.get('name', 'unknown')}")
+        return True
+
+    async def on_error(self, interaction: discord.Interaction, error: app_commands.AppCommandError):
+        finish_trace()
+        await super().on_error(interaction, error)
+
 # Initialize the bot with intents
 class PlexBot(commands.Bot):
     def __init__(self):
-        super().__init__(command_prefix='/', intents=intents)
+        super().__init__(command_prefix='/', intents=intents, tree_cls=PlexCommandTree)
         self.initial_extensions = [
             'cogs.invite',
+            'cogs.invite_bulk',
             'cogs.remove',
             'cogs.subscription',
             'cogs.due_subscription',
-            'cogs.import_users'
+            'cogs.import_users',
+            'cogs.reconcile',
+            'cogs.export',
+            'cogs.stats',
+            'cogs.reminders',
+            'cogs.owner'
         ]
-    
+        self.start_time = time.perf_counter()
+        self.startup_reported = False
+        self.metrics_server = None
+        self.loop_lag_task = None
+        self.stall_detector = None
+        self.warmup_task = None
+        self.change_listener = None
+        # Seconds each warm-up step took, see warm_up()
+        self.warmup_timings = {}
+
+    def _serialize_command(self, command):
+        try:
+            return command.to_dict(self.tree)
+        except TypeError:
+            # discord.py < 2.4 does not take the tree argument
+            return command.to_dict()
+
+    def command_tree_fingerprint(self):
+        """Hash the serialized command tree so unchanged trees can skip syncing"""
+        commands_payload = sorted(
+            (self._serialize_command(command) for command in self.tree.get_commands()),
+            key=lambda command: command['name']
+        )
+        # Include the application so switching bot tokens still triggers a sync
+        payload = {'application_id': self.application_id, 'commands': commands_payload}
+        serialized = json.dumps(payload, sort_keys=True, default=str)
+        return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+    def _read_stored_fingerprint(self):
+        try:
+            with open(COMMAND_TREE_HASH_FILE, 'r') as f:
+                return f.read().strip()
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning("Could not read command tree fingerprint: %s", e)
+            return None
+
+    def _store_fingerprint(self, fingerprint):
+        try:
+            # Write to a temp file first so a crash never leaves a truncated hash behind
+            tmp_path = f"{COMMAND_TREE_HASH_FILE}.tmp"
+            with open(tmp_path, 'w') as f:
+                f.write(fingerprint)
+            os.replace(tmp_path, COMMAND_TREE_HASH_FILE)
+        except OSError as e:
+            logger.warning("Could not store command tree fingerprint: %s", e)
+
+    async def sync_command_tree(self, force=False):
+        """Sync slash commands with Discord when the tree changed since the last sync"""
+        fingerprint = self.command_tree_fingerprint()
+        if not force and fingerprint == self._read_stored_fingerprint():
+            logger.info("Command tree unchanged since last sync, skipping sync")
+            return None
+
+        synced = await self.tree.sync()
+        self._store_fingerprint(fingerprint)
+        return synced
+
+    async def _load_extension(self, extension):
+        try:
+            logger.info("Loading extension: %s", extension)
+            await self.load_extension(extension)
+            logger.info("Successfully loaded extension: %s", extension)
+        except Exception as extension_error:
+            logger.error("Failed to load extension %s: %s", extension, extension_error, exc_info=True)
+            raise
+
+    async def _timed_step(self, name, coro):
+        start = time.perf_counter()
+        try:
+            return await coro
+        except Exception as e:
+            logger.warning("Warm-up step %s failed: %s", name, e)
+            return None
+        finally:
+            self.warmup_timings[name] = time.perf_counter() - start
+
+    async def warm_up(self, connect_task):
+        """
+        Open the database and Plex connections and fill the caches the first commands
+        use, so they don't pay for cold connections. Every Plex server is warmed up
+        concurrently; failures are logged and leave the cache cold.
+        """
+        start = time.perf_counter()
+        await self._timed_step('database', connect_task)
+        servers = await self._timed_step('server_registry', db.get_all_plex_servers())
+        await asyncio.gather(*(
+            self._timed_step(
+                f"plex:{server['server_name']}",
+                asyncio.to_thread(plex_manager.warm_up, server['plex_url'], server['plex_token'])
+            )
+            for server in servers or ()
+        ))
+        timings = ', '.join(f"{name} {seconds:.2f}s" for name, seconds in self.warmup_timings.items())
+        logger.info("Warm-up finished in %.2fs: %s", time.perf_counter() - start, timings)
+
     async def setup_hook(self):
         try:
-            # Load cogs
-            for extension in self.initial_extensions:
-                try:
-                    logger.info(f"Loading extension: {extension}")
-                    await self.load_extension(extension)
-                    logger.info(f"Successfully loaded extension: {extension}")
-                except Exception as extension_error:
-                    logger.error(f"Failed to load extension {extension}: {str(extension_error)}", exc_info=True)
-                    raise
+            # Create the database client in a worker thread while the cogs load
+            connect_task = asyncio.create_task(asyncio.to_thread(db.connect))
+            if WARMUP_BUDGET_SECONDS > 0:
+                warmup_started = time.perf_counter()
+                self.warmup_task = asyncio.create_task(self.warm_up(connect_task))
+
+            # Cogs are independent of each other, so load them concurrently
+            await asyncio.gather(*(self._load_extension(extension) for extension in self.initial_extensions))
             logger.info("Finished loading extensions")
+
+            await connect_task
+            logger.info("Database client ready")
+            if DATABASE_URL:
+                self.change_listener = ChangeListener(DATABASE_URL)
+                await self.change_listener.start()
+
+            # Cogs register their job handlers on load, so start the workers afterwards
+            await job_queue.start(JOB_QUEUE_WORKERS)
+            if PLEX_HEALTH_INTERVAL > 0:
+                await health_monitor.start(PLEX_HEALTH_INTERVAL)
+
+            if METRICS_PORT:
+                try:
+                    self.metrics_server = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+                except OSError as e:
+                    # Usually another instance on this host already serves the port
+                    logger.warning("Could not start the metrics endpoint on %s:%s, continuing without it: %s", METRICS_HOST, METRICS_PORT, e)
+            self.loop_lag_task = asyncio.create_task(monitor_event_loop_lag())
+            if LOOP_STALL_THRESHOLD_MS > 0:
+                self.stall_detector = LoopStallDetector(LOOP_STALL_THRESHOLD_MS / 1000, LOOP_STALL_REPORT_INTERVAL)
+                await self.stall_detector.start()
             
             # Sync commands with Discord
-            logger.info("Syncing commands with Discord...")
-            await self.tree.sync()
-            logger.info("Successfully synced commands with Discord")
+            logger.info("Checking command tree for changes...")
+            synced = await self.sync_command_tree()
+            if synced is not None:
+                logger.info("Successfully synced %d commands with Discord", len(synced))
+
+            if self.warmup_task is not None:
+                remaining = WARMUP_BUDGET_SECONDS - (time.perf_counter() - warmup_started)
+                done, _ = await asyncio.wait({self.warmup_task}, timeout=max(remaining, 0))
+                if not done:
+                    logger.warning("Warm-up still running after %.0fs, finishing it in the background", WARMUP_BUDGET_SECONDS)
+            logger.info("Setup finished in %.2fs", time.perf_counter() - self.start_time)
         except Exception as e:
             logger.error(f"Error in setup_hook: {str(e)}", exc_info=True)
     
+    async def close(self):
+        if self.warmup_task is not None:
+            self.warmup_task.cancel()
+        await job_queue.stop()
+        await health_monitor.stop()
+        friends.shutdown()
+        if self.change_listener is not None:
+            await self.change_listener.stop()
+        if self.loop_lag_task is not None:
+            self.loop_lag_task.cancel()
+        if self.stall_detector is not None:
+            await self.stall_detector.stop()
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+        await super().close()
+
+    async def on_app_command_completion(self, interaction, command):
+        observe_command(interaction, command)
+        finish_trace()
+
     async def on_ready(self):
         logger.info(f'Logged in as {self.user} (ID: {self.user.id})')
+        # on_ready fires again after reconnects, only report the first one
+        if not self.startup_reported:
+            logger.info("Startup took %.2fs", time.perf_counter() - self.start_time)
+            self.startup_reported = True
         logger.info('------')
 
-    @commands.command(name='sync')
-    @commands.is_owner()
-    async def sync_commands(self, ctx):
-        """Sync slash commands with Discord"""
-        try:
-            logger.info("Manually syncing commands...")
-            synced = await self.tree.sync()
-            logger.info(f"Synced {len(synced)} commands")
-            await ctx.send(f"Synced {len(synced)} commands")
-        except Exception as e:
-            logger.error(f"Error syncing commands: {str(e)}", exc_info=True)
-            await ctx.send(f"Error syncing commands: {str(e)}")
-
 async def main():
+    setup_logging()
     try:
+        validate_config()
         bot = PlexBot()
         async with bot:
             logger.info("Starting bot...")
@@ -0,0 +1,204 @@
+# Admin command line for batch jobs, run without starting the Discord bot
+#
+#     python -m cli import [--dry-run] [--concurrency 3]
+#     python -m cli reconcile [--apply] [--concurrency 5] [--page-size 1000] [--csv reconcile.csv]
+#     python -m cli renew (--duration 1_month | --days 7) [--server NAME ...] [--status all] [--dry-run]
+#     python -m cli export [--format csv] [--output FILE] [--page-size 1000]
+#
+# Jobs use the same database and Plex code as the bot's commands. Progress is written to
+# stderr and a JSON summary of the job to stdout. The exit status is 1 if the job or any
+# part of it failed, so cron can report it.
+import argparse
+import asyncio
+import json
+import logging
+import os
+import sys
+import time
+from config import (
+    IMPORT_CONCURRENCY,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_PAGE_SIZE,
+    EXPORT_PAGE_SIZE,
+    validate_config
+)
+from database.db import db
+from database.export import export_subscriptions, export_filename, EXPORT_FORMATS
+from plex import friends
+from plex.importer import import_users
+from plex.reconcile import reconcile, apply_report
+from utils.date_utils import duration_to_days
+from utils.logger import setup_logging
+from utils.tracing import start_trace, finish_trace
+
+logger = logging.getLogger(__name__)
+
+# Servers renewed at the same time; each renewal is a single UPDATE in the database
+RENEW_CONCURRENCY = 4
+
+class Progress:
+    """Progress lines on stderr with the time since the job started"""
+
+    def __init__(self, quiet=False, interval=1.0):
+        self.quiet = quiet
+        self.interval = interval
+        self.start = time.perf_counter()
+        self._last = 0.0
+
+    def __call__(self, message, throttle=False):
+        """Print message; with throttle, only if nothing was printed for interval seconds"""
+        now = time.perf_counter()
+        if self.quiet or (throttle and now - self._last < self.interval):
+            return
+        self._last = now
+        print(f"[{now - self.start:7.1f}s] {message}", file=sys.stderr, flush=True)
+
+async def run_import(args, progress):
+    async def server_done(server):
+        if server.error:
+            progress(f"{server.server_name}: failed: {server.error}")
+            return
+        action = "to import" if args.dry_run else "imported"
+        progress(
+            f"{server.server_name}: {server.imported} {action}, {server.skipped} already subscribed, "
+            f"{server.no_access} without library access ({server.duration:.1f}s)"
+        )
+
+    result = await import_users(args.concurrency, args.dry_run, progress=server_done)
+    return result.to_dict(), not result.errors
+
+async def run_reconcile(args, progress):
+    progress("Comparing subscriptions with the Plex friends lists...")
+    report = await reconcile(args.page_size)
+    progress(f"Scanned {report.rows_scanned} subscriptions: {report.drift} differences, "
+             f"{report.expired_shared} expired users still shared")
+    if args.apply and report.expired_shared:
+        progress(f"Stopping shares of {report.expired_shared} expired users...")
+        await apply_report(report, args.concurrency)
+
+    summary = report.to_dict()
+    if args.csv:
+        with open(args.csv, 'w', encoding='utf-8', newline='') as output:
+            output.write(report.to_csv())
+        summary['csv'] = args.csv
+    ok = not any(diff.error or diff.remove_failed for diff in report.servers.values())
+    return summary, ok
+
+async def run_renew(args, progress):
+    days = duration_to_days(args.duration) if args.duration else args.days
+    if days == 0:
+        raise ValueError("The number of days cannot be zero")
+    server_names = args.server or [server['server_name'] for server in await db.get_all_plex_servers()]
+    semaphore = asyncio.Semaphore(args.concurrency)
+    servers = {}
+
+    async def renew_server(server_name):
+        async with semaphore:
+            try:
+                if args.server and not await db.get_plex_server(server_name):
+                    raise ValueError(f"Server '{server_name}' not found")
+                affected = await db.extend_subscriptions(server_name, days, args.status, dry_run=args.dry_run)
+                servers[server_name] = {'affected': affected, 'error': None}
+                progress(f"{server_name}: {affected} subscriptions {'to move' if args.dry_run else 'moved'} by {days:+d} days")
+            except Exception as e:
+                servers[server_name] = {'affected': 0, 'error': str(e)}
+                progress(f"{server_name}: failed: {str(e)}")
+
+    await asyncio.gather(*(renew_server(server_name) for server_name in server_names))
+    summary = {
+        'days': days,
+        'status': args.status,
+        'dry_run': args.dry_run,
+        'affected': sum(server['affected'] for server in servers.values()),
+        'servers': servers
+    }
+    return summary, not any(server['error'] for server in servers.values())
+
+async def run_export(args, progress):
+    output = args.output or export_filename(args.format)
+    # Written under a temporary name, so a file at output is always a complete export
+    partial = f"{output}.partial"
+
+    async def page_written(rows):
+        progress(f"Exported {rows} subscriptions", throttle=True)
+
+    try:
+        with open(partial, 'wb') as fileobj:
+            rows = await export_subscriptions(fileobj, args.format, args.page_size, progress=page_written)
+        os.replace(partial, output)
+    except BaseException:
+        if os.path.exists(partial):
+            os.remove(partial)
+        raise
+    progress(f"Exported {rows} subscriptions to {output}")
+    return {'format': args.format, 'file': output, 'rows': rows, 'bytes': os.path.getsize(output)}, True
+
+COMMANDS = {
+    'import': run_import,
+    'reconcile': run_reconcile,
+    'renew': run_renew,
+    'export': run_export
+}
+
+def _duration(value):
+    try:
+        duration_to_days(value)
+    except ValueError as e:
+        raise argparse.ArgumentTypeError(str(e))
+    return value
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog='python -m cli', description='Run subscription batch jobs without the Discord bot')
+    parser.add_argument('-q', '--quiet', action='store_true', help='Only print the JSON summary')
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    command = commands.add_parser('import', help='Import the users Plex servers are shared with')
+    command.add_argument('--dry-run', action='store_true', help='Count the users that would be imported')
+    command.add_argument('--concurrency', type=int, default=IMPORT_CONCURRENCY, help='Servers imported at the same time')
+
+    command = commands.add_parser('reconcile', help='Compare subscriptions with the Plex friends lists')
+    command.add_argument('--apply', action='store_true', help='Stop sharing servers with users whose subscription has expired')
+    command.add_argument('--concurrency', type=int, default=RECONCILE_CONCURRENCY, help='Shares removed at the same time')
+    command.add_argument('--page-size', type=int, default=RECONCILE_PAGE_SIZE, help='Subscriptions fetched per database page')
+    command.add_argument('--csv', help='File to write every difference to')
+
+    command = commands.add_parser('renew', help='Move the end date of every subscription on some or all servers')
+    change = command.add_mutually_exclusive_group(required=True)
+    change.add_argument('--duration', type=_duration, help='Extend by a subscription duration, e.g. 1_month')
+    change.add_argument('--days', type=int, help='Extend by a number of days (negative to shorten)')
+    command.add_argument('--server', action='append', help='Server to renew (repeatable, default: all servers)')
+    command.add_argument('--status', choices=['all', 'active', 'expired'], default='all', help='Which subscriptions to extend')
+    command.add_argument('--dry-run', action='store_true', help='Count the subscriptions that would be changed')
+    command.add_argument('--concurrency', type=int, default=RENEW_CONCURRENCY, help='Servers renewed at the same time')
+
+    command = commands.add_parser('export', help='Export all subscriptions to a file')
+    command.add_argument('--format', choices=list(EXPORT_FORMATS), default='csv', help='File format of the export')
+    command.add_argument('--output', help='File to write (default: subscriptions-<date>.<extension>)')
+    command.add_argument('--page-size', type=int, default=EXPORT_PAGE_SIZE, help='Subscriptions fetched per database page')
+    return parser
+
+async def run(args):
+    progress = Progress(args.quiet)
+    trace = start_trace(f"cli.{args.command}")
+    try:
+        await asyncio.to_thread(db.connect)
+        summary, ok = await COMMANDS[args.command](args, progress)
+    finally:
+        finish_trace(trace)
+        friends.shutdown()
+    return {'command': args.command, 'ok': ok, **summary, 'elapsed_seconds': round(time.perf_counter() - progress.start, 3)}
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    setup_logging()
+    try:
+        validate_config(require_discord=False)
+        summary = asyncio.run(run(args))
+    except Exception as e:
+        logger.error("Error in %s command: %s", args.command, e, exc_info=True)
+        summary = {'command': args.command, 'ok': False, 'error': str(e)}
+    print(json.dumps(summary, indent=2, default=str))
+    return 0 if summary['ok'] else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
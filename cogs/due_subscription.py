@@ -4,8 +4,8 @@ from discord import app_commands
 from discord.ext import commands
 import logging
 from database.db import db
-from datetime import datetime, timedelta
-from utils.date_utils import calculate_end_date
+from utils.metrics import timed_defer
+from utils.expiry import ExpiryTable, CRITICAL, WARNING, NOTICE
 
 logger = logging.getLogger(__name__)
 
@@ -56,7 +56,7 @@ class DueSubscription(commands.Cog):
     )
     async def due_subscription(self, interaction: discord.Interaction):
         try:
-            await interaction.response.defer()
+            await timed_defer(interaction)
 
             # Get all active subscriptions
             subscriptions = await db.get_all_subscriptions()
@@ -64,44 +64,24 @@ class DueSubscription(commands.Cog):
                 await interaction.followup.send("No active subscriptions found.")
                 return
 
-            # Current date for comparison
-            current_date = datetime.now()
-            due_subscriptions = []
+            # Days remaining and urgency of every subscription in one vectorized pass
+            table = ExpiryTable(subscriptions)
+            critical, warning, notice = [], [], []
+            groups = {CRITICAL: critical, WARNING: warning, NOTICE: notice}
+            for i in table.indices(CRITICAL, WARNING, NOTICE):
+                sub, days_remaining, end_date, bucket = table.row(i)
+                groups[bucket].append({
+                    'username': sub['plex_username'],
+                    'email': sub.get('email', 'Not provided'),
+                    'server': sub['server_name'],
+                    'days_remaining': days_remaining,
+                    'end_date': end_date.strftime('%d-%m-%Y')
+                })
 
-            # Check each subscription
-            for sub in subscriptions:
-                # Try both date formats - first try DD-MM-YYYY, then YYYY-MM-DD
-                try:
-                    # Try DD-MM-YYYY format first
-                    start_date = datetime.strptime(sub['start_date'], '%d-%m-%Y')
-                except ValueError:
-                    # If that fails, try YYYY-MM-DD format
-                    start_date = datetime.strptime(sub['start_date'], '%Y-%m-%d')
-                    
-                end_date = calculate_end_date(start_date, sub['duration'])
-                days_remaining = (end_date - current_date).days
-
-                if 0 <= days_remaining <= 30:
-                    due_subscriptions.append({
-                        'username': sub['plex_username'],
-                        'email': sub.get('email', 'Not provided'),
-                        'server': sub['server_name'],
-                        'days_remaining': days_remaining,
-                        'end_date': end_date.strftime('%d-%m-%Y')
-                    })
-
-            if not due_subscriptions:
+            if not (critical or warning or notice):
                 await interaction.followup.send("No subscriptions are due within the next 30 days.")
                 return
 
-            # Sort by days remaining
-            due_subscriptions.sort(key=lambda x: x['days_remaining'])
-
-            # Group subscriptions by urgency
-            critical = [sub for sub in due_subscriptions if sub['days_remaining'] <= 2]
-            warning = [sub for sub in due_subscriptions if 2 < sub['days_remaining'] <= 7]
-            notice = [sub for sub in due_subscriptions if sub['days_remaining'] > 7]
-            
             # Create and send embeds
             await self.send_subscription_embeds(interaction, critical, warning, notice)
 
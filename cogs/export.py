@@ -0,0 +1,57 @@
+# Exports the subscriptions table as a compressed file attachment
+import discord
+from discord import app_commands
+from discord.ext import commands
+import logging
+import tempfile
+from config import EXPORT_PAGE_SIZE
+from database.export import export_subscriptions, export_filename
+from utils.metrics import timed_defer
+
+logger = logging.getLogger(__name__)
+
+# Upload limit outside of boosted guilds
+DEFAULT_UPLOAD_LIMIT = 10 * 1024 * 1024
+
+format_choices = [
+    app_commands.Choice(name="CSV (gzip)", value="csv"),
+    app_commands.Choice(name="JSON Lines (gzip)", value="jsonl"),
+    app_commands.Choice(name="Parquet", value="parquet")
+]
+
+class Export(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @app_commands.command(name='export_subscriptions', description='Export all subscriptions as a compressed file')
+    @app_commands.describe(format='File format of the export')
+    @app_commands.choices(format=format_choices)
+    async def export_subscriptions(self, interaction: discord.Interaction,
+                                   format: app_commands.Choice[str] = None):
+        try:
+            await timed_defer(interaction)
+            fmt = format.value if format else 'csv'
+
+            # The export is spooled to a temporary file on disk, never held in memory as a whole
+            with tempfile.TemporaryFile() as output:
+                rows = await export_subscriptions(output, fmt, EXPORT_PAGE_SIZE)
+                size = output.tell()
+                limit = interaction.guild.filesize_limit if interaction.guild else DEFAULT_UPLOAD_LIMIT
+                if size > limit:
+                    await interaction.followup.send(
+                        f"The export of {rows} subscriptions is {size / 1024 / 1024:.1f} MB, which is over "
+                        f"this server's upload limit of {limit / 1024 / 1024:.0f} MB. Try the Parquet format.",
+                        ephemeral=True
+                    )
+                    return
+                output.seek(0)
+                await interaction.followup.send(
+                    f"📦 Exported {rows} subscriptions ({size / 1024:.0f} KB).",
+                    file=discord.File(output, filename=export_filename(fmt))
+                )
+        except Exception as e:
+            logger.error("Error in export_subscriptions command: %s", e, exc_info=True)
+            await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(Export(bot))
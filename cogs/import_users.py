@@ -3,9 +3,10 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import logging
+from config import IMPORT_CONCURRENCY
 from database.db import db
-from plex.plex_manager import get_all_users_from_server
-from datetime import datetime
+from utils.metrics import timed_defer
+from plex.importer import import_users
 from cogs.due_subscription import chunk_embed_field
 
 logger = logging.getLogger(__name__)
@@ -16,8 +17,9 @@ class ImportUsers(commands.Cog):
 
     @app_commands.command(name='import_all', description='Import users with library access from all Plex servers')
     async def import_all(self, interaction: discord.Interaction):
+        status_message = None
         try:
-            await interaction.response.defer()
+            await timed_defer(interaction)
 
             status_embed = discord.Embed(
                 title="🔄 Importing Users",
@@ -29,68 +31,18 @@ class ImportUsers(commands.Cog):
             servers = await db.get_all_plex_servers()
             if not servers:
                 raise ValueError("No Plex servers found in database")
+            finished = []
 
-            total_imported = 0
-            total_skipped = 0
-            no_access_skipped = 0
-            errors = []
-
-            for server in servers:
+            async def show_progress(server_result):
+                finished.append(server_result.server_name)
+                status_embed.description = f"Processed {len(finished)} of {len(servers)} servers (last: {server_result.server_name})"
                 try:
-                    status_embed.description = f"Processing server: {server['server_name']}"
                     await status_message.edit(embed=status_embed)
+                except discord.HTTPException as e:
+                    logger.warning("Could not update import progress: %s", e)
 
-                    users = get_all_users_from_server(server['plex_url'], server['plex_token'])
-                    
-                    for user in users:
-                        try:
-                            # Skip users without library access
-                            if not user.get('library_access', False):
-                                no_access_skipped += 1
-                                continue
-
-                            # Check if user exists by email and server name
-                            existing_sub_by_email = await db.get_subscription(user['email'])
-                            existing_sub_by_username = await db.get_subscription(user['username'])
-                            
-                            # Check if user exists in this specific server
-                            exists_in_server = False
-                            if existing_sub_by_email:
-                                for sub in existing_sub_by_email:
-                                    if sub['server_name'] == server['server_name']:
-                                        exists_in_server = True
-                                        break
-                            
-                            if not exists_in_server and existing_sub_by_username:
-                                for sub in existing_sub_by_username:
-                                    if sub['server_name'] == server['server_name']:
-                                        exists_in_server = True
-                                        break
-                            
-                            # If user doesn't exist in this specific server
-                            if not exists_in_server:
-                                subscription_data = {
-                                    'plex_username': user['username'],
-                                    'email': user['email'],
-                                    'server_name': server['server_name'],
-                                    'duration': '1_month',
-                                    'start_date': datetime.now().strftime('%Y-%m-%d')
-                                }
-                                
-                                await db.add_subscription(subscription_data)
-                                total_imported += 1
-                                logger.info(f"Imported user: {user['username']} ({user['email']}) to server: {server['server_name']}")
-                            else:
-                                total_skipped += 1
-                                logger.info(f"Skipped existing user: {user['username']} ({user['email']}) on server: {server['server_name']}")
-                                
-                        except Exception as user_error:
-                            errors.append(f"Error processing user {user['username']}: {str(user_error)}")
-                            logger.error(f"Error processing user: {str(user_error)}", exc_info=True)
-
-                except Exception as server_error:
-                    errors.append(f"Error processing server {server['server_name']}: {str(server_error)}")
-                    logger.error(f"Error processing server: {str(server_error)}", exc_info=True)
+            result = await import_users(IMPORT_CONCURRENCY, progress=show_progress)
+            errors = result.errors
 
             final_embed = discord.Embed(
                 title="✅ Import Complete",
@@ -99,7 +51,7 @@ class ImportUsers(commands.Cog):
 
             final_embed.add_field(
                 name="📊 Statistics",
-                value=f"Users Imported: {total_imported}\nUsers Skipped (Existing): {total_skipped}\nUsers Skipped (No Access): {no_access_skipped}",
+                value=f"Users Imported: {result.imported}\nUsers Skipped (Existing): {result.skipped}\nUsers Skipped (No Access): {result.no_access}",
                 inline=False
             )
 
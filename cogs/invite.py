@@ -3,7 +3,11 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import logging
+import asyncio
 from database.db import db
+from utils.metrics import timed_defer, CACHE_REQUESTS
+from plex.job_queue import job_queue, PermanentJobError
+from plex.plex_manager import invite_user_to_plex, get_user_details, is_permanent_error
 from typing import List
 from datetime import datetime
 
@@ -24,17 +28,31 @@ payment_choices = [
     app_commands.Choice(name="Other", value="other")
 ]
 
+# Discord rejects autocomplete responses with more than 25 choices
+MAX_AUTOCOMPLETE_CHOICES = 25
+
+async def edit_job_message(bot, payload, **kwargs):
+    """Edit the message a queued job reports to; jobs can outlive the interaction token"""
+    channel = bot.get_channel(payload['channel_id'])
+    if channel is None:
+        channel = await bot.fetch_channel(payload['channel_id'])
+    await channel.get_partial_message(payload['message_id']).edit(**kwargs)
+
 class Invite(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.duration_choices = duration_choices
         self.payment_choices = payment_choices
         self.server_choices = []
+        # Lowercased names paired with their choices, rebuilt on every refresh
+        self._server_index = []
+        self._refresh_task = None
         self.last_refresh_time = datetime.min
         # Cache refresh interval in seconds (5 minutes)
         self.refresh_interval = 300
         
-    def _format_plex_error(self, error_str):
+    @staticmethod
+    def _format_plex_error(error_str):
         """Format Plex error messages to be more user-friendly"""
         # Remove technical details and API endpoints
         if 'http' in error_str and '/api/' in error_str:
@@ -54,33 +72,199 @@ class Invite(commands.Cog):
         # Return cleaned error or original if no specific handling
         return error_str
 
+    def _server_choices_stale(self):
+        """Return True when the cached server snapshot is older than the refresh interval"""
+        age = (datetime.now() - self.last_refresh_time).total_seconds()
+        return age >= self.refresh_interval or not self.server_choices
+
+    def _schedule_server_refresh(self):
+        """Start a background refresh unless one is already running"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self.refresh_server_choices())
+
     async def refresh_server_choices(self):
-        # Only refresh if it's been more than refresh_interval since last refresh
-        current_time = datetime.now()
-        if (current_time - self.last_refresh_time).total_seconds() < self.refresh_interval and self.server_choices:
-            return
-            
         try:
             servers = await db.get_all_plex_servers()
-            self.server_choices = [app_commands.Choice(name=server['server_name'], value=server['server_name']) for server in servers]
-            self.last_refresh_time = current_time
+            choices = [app_commands.Choice(name=server['server_name'], value=server['server_name']) for server in servers]
+            # Swap the snapshot and its lowercase index together so readers never see a mismatch
+            self.server_choices = choices
+            self._server_index = [(choice.name.lower(), choice) for choice in choices]
+            self.last_refresh_time = datetime.now()
         except Exception as e:
             logger.error(f"Error fetching server choices: {str(e)}")
-            # Don't clear existing choices if there's an error
-            if not self.server_choices:
-                self.server_choices = []
+            # Keep serving the existing snapshot if the refresh fails
+
+    async def cog_load(self):
+        # Prime the snapshot so the first autocomplete has something to show
+        self._schedule_server_refresh()
+        job_queue.register('invite', self._run_invite_job, self._on_invite_job_done)
+
+    async def cog_unload(self):
+        if self._refresh_task is not None:
+            self._refresh_task.cancel()
 
     async def server_name_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
         try:
-            await self.refresh_server_choices()
-            # Filter choices based on current input if provided
-            if current:
-                return [choice for choice in self.server_choices if current.lower() in choice.name.lower()]
-            return self.server_choices
+            # Answer from the last snapshot and revalidate in the background
+            if self._server_choices_stale():
+                CACHE_REQUESTS.inc(cache='server_choices', result='stale' if self.server_choices else 'miss')
+                self._schedule_server_refresh()
+            else:
+                CACHE_REQUESTS.inc(cache='server_choices', result='hit')
+
+            if not current:
+                return self.server_choices[:MAX_AUTOCOMPLETE_CHOICES]
+
+            needle = current.lower()
+            matches = []
+            for name, choice in self._server_index:
+                if needle in name:
+                    matches.append(choice)
+                    if len(matches) >= MAX_AUTOCOMPLETE_CHOICES:
+                        break
+            return matches
         except Exception as e:
             logger.error(f"Error in server_name_autocomplete: {str(e)}")
             return []
 
+    def _build_invite_embed(self, payload, plex_username, invite_link=None):
+        # Create success embed
+        embed = discord.Embed(
+            title="✨ Plex Server Invitation",
+            color=discord.Color.green()
+        )
+        
+        # Add user info
+        embed.add_field(
+            name="👤 Discord User",
+            value=payload['discord_mention'],
+            inline=False
+        )
+        
+        embed.add_field(
+            name="📧 Plex Username",
+            value=plex_username,
+            inline=False
+        )
+        
+        # Add server info
+        embed.add_field(
+            name="🖥️ Server",
+            value=payload['server_name'],
+            inline=True
+        )
+        
+        # Add duration info
+        embed.add_field(
+            name="⏱️ Duration",
+            value=payload['duration_name'],
+            inline=True
+        )
+        
+        # Add payment info
+        embed.add_field(
+            name="💳 Payment Details",
+            value=f"Method: {payload['payment_method_name']}\nID: {payload['payment_id']}",
+            inline=False
+        )
+        
+        # Add start date
+        embed.add_field(
+            name="📅 Start Date",
+            value=payload['start_date'],
+            inline=True
+        )
+
+        # Add invitation link if available
+        if invite_link:
+            embed.add_field(
+                name="🔗 Invitation Link",
+                value=invite_link,
+                inline=False
+            )
+        
+        embed.set_footer(text="Use /fetch_subscription to view subscription details")
+        return embed
+
+    async def _run_invite_job(self, job):
+        """Invite the user on Plex and save the subscription (runs on the job queue)"""
+        payload = job['payload']
+        server = await db.get_plex_server(payload['server_name'])
+        if not server:
+            raise PermanentJobError(f"Server '{payload['server_name']}' not found or is currently unavailable")
+
+        plex_username = payload['plex_username']
+        invite_link = payload.get('invite_link')
+        if payload['already_subscribed']:
+            # Don't invite again if the user already has a subscription
+            invite_link = "User already invited to Plex server"
+        elif not payload.get('invited'):
+            try:
+                invite_result = await asyncio.to_thread(
+                    invite_user_to_plex, server['plex_url'], server['plex_token'], plex_username
+                )
+                if not invite_result:
+                    raise PermanentJobError(f"Failed to invite {plex_username} to Plex server. Please verify the username/email")
+                # Update plex_username with the actual username from Plex API
+                if isinstance(invite_result, dict):
+                    plex_username = invite_result.get('username', plex_username)
+            except PermanentJobError:
+                raise
+            except Exception as plex_error:
+                error_str = str(plex_error)
+                logger.error("Plex invitation error: %s", error_str)
+                
+                # Check if this is the "already sharing" error
+                if "You're already sharing this server with" in error_str:
+                    logger.info("User %s is already invited to Plex server", plex_username)
+                    invite_link = "User already invited to Plex server"
+                elif is_permanent_error(plex_error):
+                    # Format the error message to be more user-friendly
+                    clean_error = self._format_plex_error(error_str)
+                    raise PermanentJobError(f"Plex invitation failed: {clean_error}")
+                else:
+                    # Network or plex.tv trouble, let the queue retry with backoff
+                    raise
+
+            # Record the invitation so a retry after a database error doesn't invite again
+            payload.update({'invited': True, 'plex_username': plex_username, 'invite_link': invite_link})
+            await job_queue.checkpoint(job['id'], payload)
+
+        # Get complete user details from Plex API
+        username, email = await asyncio.to_thread(get_user_details, server['plex_token'], plex_username)
+        subscription_data = {
+            'plex_username': username if username else plex_username,  # Use API username if available
+            'discord_username': payload['discord_username'],
+            # Jobs queued before the ID was recorded don't carry it
+            'discord_user_id': payload.get('discord_user_id'),
+            'server_name': payload['server_name'],
+            'duration': payload['duration'],
+            'payment_method': payload['payment_method'],
+            'payment_id': payload['payment_id'],
+            'start_date': payload['start_date'],
+            'email': email if email else None  # Add email from API if available
+        }
+        try:
+            await db.add_subscription(subscription_data)
+        except Exception as db_error:
+            logger.error("Database error while adding subscription: %s", db_error)
+            raise RuntimeError(f"Failed to save subscription details: {str(db_error)}")
+
+        return {'plex_username': plex_username, 'invite_link': invite_link}
+
+    async def _on_invite_job_done(self, job):
+        payload = job['payload']
+        if job['status'] == 'done':
+            embed = self._build_invite_embed(payload, job['result']['plex_username'], job['result']['invite_link'])
+        else:
+            embed = discord.Embed(
+                title="❌ Invitation Error",
+                description=job['last_error'],
+                color=discord.Color.red()
+            )
+            embed.set_footer(text="Please check the details and try again")
+        await edit_job_message(self.bot, payload, embed=embed)
+
     async def start_date_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
         try:
             today = datetime.now().strftime('%d-%m-%Y')
@@ -136,7 +320,7 @@ class Invite(commands.Cog):
 
             # Try to defer the response, but handle potential network issues
             try:
-                await interaction.response.defer()
+                await timed_defer(interaction)
                 response_method = interaction.followup.send
             except (discord.errors.NotFound, discord.errors.HTTPException) as e:
                 logger.warning(f"Could not defer response: {str(e)}")
@@ -152,150 +336,49 @@ class Invite(commands.Cog):
                 raise ValueError(f"Failed to access server information: {str(db_error)}")
             
             # Check if user already has a subscription
-            invite_link = None
             try:
                 existing_subscription = await db.get_subscription(plex_username)
-                if existing_subscription:
-                    logger.info(f"User {plex_username} already has a subscription, keeping existing invitation")
-                    # Don't remove the existing subscription from database
-                    invite_link = "User already invited to Plex server"
-                else:
-                    # Only invite if not already subscribed
-                    try:
-                        from plex.plex_manager import invite_user_to_plex
-                        invite_result = invite_user_to_plex(server['plex_url'], server['plex_token'], plex_username)
-                        if not invite_result:
-                            raise ValueError(f"Failed to invite {plex_username} to Plex server. Please verify the username/email")
-                        
-                        # Get the invitation link and user details
-                        invite_link = None
-                        # Update plex_username with the actual username from Plex API
-                        if isinstance(invite_result, dict):
-                            plex_username = invite_result.get('username', plex_username)
-                            plex_email = invite_result.get('email')
-                    except Exception as plex_error:
-                        error_str = str(plex_error)
-                        logger.error(f"Plex invitation error: {error_str}")
-                        
-                        # Check if this is the "already sharing" error
-                        if "You're already sharing this server with" in error_str:
-                            logger.info(f"User {plex_username} is already invited to Plex server")
-                            invite_link = "User already invited to Plex server"
-                        else:
-                            # Format the error message to be more user-friendly
-                            clean_error = self._format_plex_error(error_str)
-                            raise ValueError(f"Plex invitation failed: {clean_error}")
-            except ValueError as ve:
-                # Re-raise ValueError to be caught by the outer try/except
-                raise ve
             except Exception as e:
                 logger.warning(f"Error checking existing subscription: {str(e)}")
                 # Continue with invitation if we couldn't check subscription status
-                try:
-                    from plex.plex_manager import invite_user_to_plex
-                    invite_result = invite_user_to_plex(server['plex_url'], server['plex_token'], plex_username)
-                    if not invite_result:
-                        raise ValueError(f"Failed to invite {plex_username} to Plex server. Please verify the username/email")
-                    
-                    # Get the invitation link and user details
-                    invite_link = None
-                    # Update plex_username with the actual username from Plex API
-                    if isinstance(invite_result, dict):
-                        plex_username = invite_result.get('username', plex_username)
-                        plex_email = invite_result.get('email')
-                except Exception as plex_error:
-                    error_str = str(plex_error)
-                    logger.error(f"Plex invitation error: {error_str}")
-                    
-                    # Check if this is the "already sharing" error
-                    if "You're already sharing this server with" in error_str:
-                        logger.info(f"User {plex_username} is already invited to Plex server")
-                        invite_link = "User already invited to Plex server"
-                    else:
-                        # Format the error message to be more user-friendly
-                        clean_error = self._format_plex_error(error_str)
-                        raise ValueError(f"Plex invitation failed: {clean_error}")
+                existing_subscription = None
+            if existing_subscription:
+                logger.info("User %s already has a subscription, keeping existing invitation", plex_username)
 
-            # Add subscription with error handling
-            try:
-                # Get complete user details from Plex API
-                from plex.plex_manager import get_user_details
-                username, email = get_user_details(server['plex_token'], plex_username)
-                
-                subscription_data = {
-                    'plex_username': username if username else plex_username,  # Use API username if available
-                    'discord_username': str(discord_user),
-                    'server_name': server_name,
-                    'duration': duration.value,
-                    'payment_method': payment_method.value,
-                    'payment_id': payment_id,
-                    'start_date': start_date,
-                    'email': email if email else None  # Add email from API if available
-                }
-                
-                await db.add_subscription(subscription_data)
-            except Exception as db_error:
-                logger.error(f"Database error while adding subscription: {str(db_error)}")
-                raise ValueError(f"Failed to save subscription details: {str(db_error)}")
-            
-            # Create success embed
-            embed = discord.Embed(
-                title="✨ Plex Server Invitation",
-                color=discord.Color.green()
-            )
-            
-            # Add user info
-            embed.add_field(
-                name="👤 Discord User",
-                value=discord_user.mention,
-                inline=False
-            )
-            
-            embed.add_field(
-                name="📧 Plex Username",
-                value=plex_username,
-                inline=False
-            )
-            
-            # Add server info
-            embed.add_field(
-                name="🖥️ Server",
-                value=server_name,
-                inline=True
-            )
-            
-            # Add duration info
-            embed.add_field(
-                name="⏱️ Duration",
-                value=duration.name,
-                inline=True
-            )
-            
-            # Add payment info
-            embed.add_field(
-                name="💳 Payment Details",
-                value=f"Method: {payment_method.name}\nID: {payment_id}",
-                inline=False
-            )
-            
-            # Add start date
-            embed.add_field(
-                name="📅 Start Date",
-                value=start_date,
-                inline=True
-            )
+            payload = {
+                'plex_username': plex_username,
+                'server_name': server_name,
+                'discord_username': str(discord_user),
+                'discord_user_id': discord_user.id,
+                'discord_mention': discord_user.mention,
+                'duration': duration.value,
+                'duration_name': duration.name,
+                'payment_method': payment_method.value,
+                'payment_method_name': payment_method.name,
+                'payment_id': payment_id,
+                'start_date': start_date,
+                'already_subscribed': bool(existing_subscription)
+            }
 
-            # Add invitation link if available
-            if invite_link:
-                embed.add_field(
-                    name="🔗 Invitation Link",
-                    value=invite_link,
-                    inline=False
-                )
-            
-            embed.set_footer(text="Use /fetch_subscription to view subscription details")
-            
-            await response_method(embed=embed)
+            # Acknowledge right away, the Plex work runs on the job queue
+            embed = self._build_invite_embed(payload, plex_username)
+            embed.title = "⏳ Plex Server Invitation Queued"
+            embed.color = discord.Color.blue()
+            embed.set_footer(text="This message will be updated once the invitation has been processed")
+            message = await response_method(embed=embed)
+            if not isinstance(message, discord.Message):
+                # send_message doesn't hand back the message, so look it up
+                message = await interaction.original_response()
+
+            payload['channel_id'] = message.channel.id
+            payload['message_id'] = message.id
+            job, created = await job_queue.enqueue(
+                'invite', payload, idempotency_key=f"invite:{server_name}:{plex_username.lower()}"
+            )
+            if not created:
+                embed.title = "⏳ Plex Server Invitation Already Queued"
+                embed.set_footer(text="An invitation for this user and server is already being processed")
+                await message.edit(embed=embed)
         except ValueError as ve:
             # Handle expected errors with user-friendly messages
             error_embed = discord.Embed(
@@ -0,0 +1,365 @@
+# Handles bulk invitations to Plex servers from a CSV attachment
+import discord
+from discord import app_commands
+from discord.ext import commands
+import asyncio
+import csv
+import io
+import logging
+import re
+import time
+from datetime import datetime
+from database.db import db
+from utils.metrics import timed_defer
+from plex.plex_manager import connect_to_plex, get_friends_snapshot, invite_user_with_session
+from cogs.invite import Invite, duration_choices, payment_choices
+from cogs.due_subscription import chunk_embed_field
+from utils.date_utils import DURATION_PATTERN
+from config import BULK_INVITE_MAX_ROWS, BULK_INVITE_CONCURRENCY
+
+logger = logging.getLogger(__name__)
+
+CSV_COLUMNS = ['plex_identifier', 'discord_user', 'server', 'duration', 'payment_method', 'payment_id', 'start_date']
+
+# Minimum number of seconds between progress edits of the status message
+PROGRESS_EDIT_INTERVAL = 2.0
+
+MENTION_PATTERN = re.compile(r'^<@!?(\d+)>$')
+
+STATUS_LABELS = {
+    'invited': '✅ Invited',
+    'existing': '☑️ Already on Plex',
+    'skipped': '⏭️ Skipped (existing subscription)',
+    'failed': '❌ Failed',
+    'invalid': '⚠️ Invalid'
+}
+
+class BulkInviteProgress:
+    """Keeps a single status message up to date while rows are processed"""
+
+    def __init__(self, message, total):
+        self.message = message
+        self.total = total
+        self.done = 0
+        self.last_edit = 0.0
+        self.lock = asyncio.Lock()
+
+    async def advance(self, count=1):
+        self.done += count
+        now = time.monotonic()
+        # Throttle edits so large batches don't hit Discord's rate limits
+        if now - self.last_edit < PROGRESS_EDIT_INTERVAL and self.done < self.total:
+            return
+        async with self.lock:
+            self.last_edit = now
+            embed = discord.Embed(
+                title="🔄 Bulk Invitation",
+                description=f"Processed {self.done}/{self.total} rows...",
+                color=discord.Color.blue()
+            )
+            try:
+                await self.message.edit(embed=embed)
+            except discord.HTTPException as e:
+                logger.warning("Could not update bulk invite progress: %s", e)
+
+class InviteBulk(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # Accept either the choice value or its display name, case-insensitively
+        self.durations = {}
+        for choice in duration_choices:
+            self.durations[choice.value.lower()] = choice.value
+            self.durations[choice.name.lower()] = choice.value
+        self.payment_methods = {}
+        for choice in payment_choices:
+            self.payment_methods[choice.value.lower()] = choice.value
+            self.payment_methods[choice.name.lower()] = choice.value
+
+    def _parse_duration(self, value):
+        """A duration choice by value or name, or any <count>_<unit> duration such as 2_weeks"""
+        duration = self.durations.get(value.lower())
+        if duration is None and DURATION_PATTERN.match(value.lower()):
+            duration = value.lower()
+        return duration
+
+    def _parse_csv(self, content):
+        """Parse the uploaded CSV into row dicts, raising ValueError if the file is unusable"""
+        try:
+            text = content.decode('utf-8-sig')
+        except UnicodeDecodeError:
+            raise ValueError("The CSV file must be UTF-8 encoded")
+
+        reader = csv.DictReader(io.StringIO(text))
+        if not reader.fieldnames:
+            raise ValueError("The CSV file is empty")
+
+        header = [name.strip().lower() for name in reader.fieldnames]
+        missing = [column for column in CSV_COLUMNS if column not in header]
+        if missing:
+            raise ValueError(f"Missing CSV columns: {', '.join(missing)}")
+        reader.fieldnames = header
+
+        rows = []
+        # Line 1 is the header, so data starts on line 2
+        for line, record in enumerate(reader, 2):
+            if not any((value or '').strip() for value in record.values()):
+                continue
+            row = {column: (record.get(column) or '').strip() for column in CSV_COLUMNS}
+            row['line'] = line
+            rows.append(row)
+
+        if not rows:
+            raise ValueError("The CSV file has no rows")
+        if len(rows) > BULK_INVITE_MAX_ROWS:
+            raise ValueError(f"The CSV file has {len(rows)} rows, the limit is {BULK_INVITE_MAX_ROWS}")
+        return rows
+
+    async def _resolve_member(self, guild, value):
+        """Resolve a mention, user ID or username to a guild member"""
+        match = MENTION_PATTERN.match(value)
+        if match or value.isdigit():
+            member_id = int(match.group(1) if match else value)
+            member = guild.get_member(member_id)
+            if member is None:
+                try:
+                    member = await guild.fetch_member(member_id)
+                except discord.HTTPException:
+                    return None
+            return member
+        return guild.get_member_named(value)
+
+    def _mark(self, row, status, message=''):
+        row['status'] = status
+        row['message'] = message
+
+    async def _validate_rows(self, guild, rows, servers):
+        """Check every row before any Plex call is made, marking bad rows as invalid"""
+        servers_by_name = {server['server_name'].lower(): server for server in servers}
+        seen = set()
+
+        for row in rows:
+            server = servers_by_name.get(row['server'].lower())
+            duration = self._parse_duration(row['duration'])
+            payment_method = self.payment_methods.get(row['payment_method'].lower())
+
+            if not row['plex_identifier']:
+                self._mark(row, 'invalid', "Missing Plex username or email")
+            elif server is None:
+                self._mark(row, 'invalid', f"Unknown server '{row['server']}'")
+            elif duration is None:
+                self._mark(row, 'invalid', f"Unknown duration '{row['duration']}'")
+            elif payment_method is None:
+                self._mark(row, 'invalid', f"Unknown payment method '{row['payment_method']}'")
+            elif not row['payment_id']:
+                self._mark(row, 'invalid', "Payment ID cannot be empty")
+            elif not row['discord_user']:
+                self._mark(row, 'invalid', "Missing Discord user")
+            else:
+                # Blank start dates default to today, like the /invite autocomplete
+                start_date = row['start_date'] or datetime.now().strftime('%d-%m-%Y')
+                try:
+                    datetime.strptime(start_date, '%d-%m-%Y')
+                except ValueError:
+                    self._mark(row, 'invalid', "Invalid date format. Please use DD-MM-YYYY format")
+                    continue
+
+                key = (row['plex_identifier'].lower(), server['server_name'])
+                if key in seen:
+                    self._mark(row, 'invalid', "Duplicate of an earlier row")
+                    continue
+                seen.add(key)
+
+                row.update({
+                    'server': server['server_name'],
+                    'server_details': server,
+                    'duration': duration,
+                    'payment_method': payment_method,
+                    'start_date': start_date
+                })
+
+        # Resolve Discord users last, since it may need API calls
+        for row in rows:
+            if row.get('status'):
+                continue
+            member = await self._resolve_member(guild, row['discord_user'])
+            if member is None:
+                self._mark(row, 'invalid', f"Discord user '{row['discord_user']}' not found in this server")
+            else:
+                row['member'] = member
+
+        return [row for row in rows if not row.get('status')]
+
+    def _open_session(self, server):
+        """Connect to a Plex server and snapshot its friends list (runs in a worker thread)"""
+        account, plex, sections = connect_to_plex(server['plex_url'], server['plex_token'])
+        friends = get_friends_snapshot(account)
+        return account, plex, sections, friends
+
+    async def _process_server(self, server, rows, semaphore, progress):
+        """Invite all rows for one server over a single connection and friends snapshot"""
+        try:
+            async with semaphore:
+                account, plex, sections, friends = await asyncio.to_thread(self._open_session, server)
+        except Exception as e:
+            logger.error("Could not connect to server %s: %s", server['server_name'], e, exc_info=True)
+            for row in rows:
+                self._mark(row, 'failed', f"Could not connect to server: {Invite._format_plex_error(str(e))}")
+            await progress.advance(len(rows))
+            return
+
+        async def invite_row(row):
+            async with semaphore:
+                try:
+                    result = await asyncio.to_thread(
+                        invite_user_with_session, account, plex, sections, friends, row['plex_identifier']
+                    )
+                    row['plex_username'] = result['username']
+                    row['email'] = result['email']
+                    self._mark(row, 'invited' if result['invited'] else 'existing')
+                except Exception as plex_error:
+                    error_str = str(plex_error)
+                    if "You're already sharing this server with" in error_str:
+                        row['plex_username'] = row['plex_identifier']
+                        row['email'] = row['plex_identifier'] if '@' in row['plex_identifier'] else None
+                        self._mark(row, 'existing')
+                    else:
+                        logger.error("Plex invitation error for %s: %s", row['plex_identifier'], error_str)
+                        self._mark(row, 'failed', Invite._format_plex_error(error_str))
+            await progress.advance()
+
+        await asyncio.gather(*(invite_row(row) for row in rows))
+
+    def _build_results_file(self, rows):
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['line', 'plex_identifier', 'server', 'status', 'message'])
+        for row in rows:
+            writer.writerow([row['line'], row['plex_identifier'], row['server'], row['status'], row['message']])
+        return discord.File(io.BytesIO(output.getvalue().encode('utf-8')), filename='invite_bulk_results.csv')
+
+    def _build_summary_embed(self, rows, elapsed):
+        counts = {status: 0 for status in STATUS_LABELS}
+        for row in rows:
+            counts[row['status']] += 1
+
+        has_errors = counts['failed'] or counts['invalid']
+        embed = discord.Embed(
+            title="✨ Bulk Invitation Complete" if not has_errors else "⚠️ Bulk Invitation Finished With Errors",
+            description=f"Processed {len(rows)} rows in {elapsed:.1f}s",
+            color=discord.Color.green() if not has_errors else discord.Color.orange()
+        )
+        embed.add_field(
+            name="📊 Summary",
+            value="\n".join(f"{STATUS_LABELS[status]}: {count}" for status, count in counts.items()),
+            inline=False
+        )
+
+        problems = [row for row in rows if row['status'] in ('failed', 'invalid')]
+        if problems:
+            error_text = "\n".join(f"Line {row['line']} ({row['plex_identifier'] or '-'}): {row['message']}" for row in problems[:10])
+            if len(problems) > 10:
+                error_text += f"\n... and {len(problems) - 10} more, see the attached results"
+            for name, value, inline in chunk_embed_field("❌ Problems", error_text, False):
+                embed.add_field(name=name, value=value, inline=inline)
+
+        embed.set_footer(text="Per-row results are attached as a CSV file")
+        return embed
+
+    @app_commands.command(name='invite_bulk', description='Invite users to Plex servers from a CSV file')
+    @app_commands.describe(
+        file='CSV with columns: plex_identifier, discord_user, server, duration, payment_method, payment_id, start_date'
+    )
+    @app_commands.guild_only()
+    async def invite_bulk(self, interaction: discord.Interaction, file: discord.Attachment):
+        status_message = None
+        try:
+            await timed_defer(interaction)
+            started = time.monotonic()
+
+            rows = self._parse_csv(await file.read())
+
+            status_embed = discord.Embed(
+                title="🔄 Bulk Invitation",
+                description=f"Validating {len(rows)} rows...",
+                color=discord.Color.blue()
+            )
+            status_message = await interaction.followup.send(embed=status_embed)
+
+            servers = await db.get_all_plex_servers()
+            if not servers:
+                raise ValueError("No Plex servers found in database")
+
+            valid_rows = await self._validate_rows(interaction.guild, rows, servers)
+
+            # One lookup for every identifier instead of a query per row
+            existing = await db.get_subscriptions_for_users([row['plex_identifier'] for row in valid_rows])
+            subscribed = set()
+            for subscription in existing:
+                for identifier in (subscription.get('plex_username'), subscription.get('email')):
+                    if identifier:
+                        subscribed.add((identifier.lower(), subscription['server_name']))
+
+            rows_by_server = {}
+            for row in valid_rows:
+                if (row['plex_identifier'].lower(), row['server']) in subscribed:
+                    self._mark(row, 'skipped', "User already has a subscription on this server")
+                else:
+                    rows_by_server.setdefault(row['server'], []).append(row)
+
+            pending = sum(len(server_rows) for server_rows in rows_by_server.values())
+            progress = BulkInviteProgress(status_message, pending)
+            semaphore = asyncio.Semaphore(BULK_INVITE_CONCURRENCY)
+            await asyncio.gather(*(
+                self._process_server(server_rows[0]['server_details'], server_rows, semaphore, progress)
+                for server_rows in rows_by_server.values()
+            ))
+
+            # Save every successful row with a single insert
+            to_save = [row for row in valid_rows if row['status'] in ('invited', 'existing')]
+            subscriptions = [{
+                'plex_username': row['plex_username'] or row['plex_identifier'],
+                'discord_username': str(row['member']),
+                'discord_user_id': row['member'].id,
+                'server_name': row['server'],
+                'duration': row['duration'],
+                'payment_method': row['payment_method'],
+                'payment_id': row['payment_id'],
+                'start_date': row['start_date'],
+                'email': row['email'] if row['email'] else None
+            } for row in to_save]
+            try:
+                await db.add_subscriptions(subscriptions)
+            except Exception as db_error:
+                logger.error("Database error while adding bulk subscriptions: %s", db_error)
+                for row in to_save:
+                    self._mark(row, 'failed', f"Invited but failed to save subscription: {str(db_error)}")
+
+            embed = self._build_summary_embed(rows, time.monotonic() - started)
+            await status_message.edit(embed=embed, attachments=[self._build_results_file(rows)])
+            logger.info("Bulk invite processed %d rows, saved %d subscriptions", len(rows), len(subscriptions))
+        except ValueError as ve:
+            logger.warning("Validation error in invite_bulk command: %s", ve)
+            error_embed = discord.Embed(
+                title="❌ Bulk Invitation Error",
+                description=str(ve),
+                color=discord.Color.red()
+            )
+            error_embed.set_footer(text="Please check the file and try again")
+            if status_message:
+                await status_message.edit(embed=error_embed)
+            else:
+                await interaction.followup.send(embed=error_embed, ephemeral=True)
+        except Exception as e:
+            logger.error("Error in invite_bulk command: %s", e, exc_info=True)
+            error_embed = discord.Embed(
+                title="⚠️ Unexpected Error",
+                description=f"Error: {str(e)}",
+                color=discord.Color.dark_red()
+            )
+            if status_message:
+                await status_message.edit(embed=error_embed)
+            else:
+                await interaction.followup.send(embed=error_embed, ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(InviteBulk(bot))
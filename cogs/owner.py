@@ -0,0 +1,74 @@
+# Owner-only prefix commands for maintaining the running bot
+import discord
+from discord.ext import commands
+import asyncio
+import io
+import logging
+import threading
+from config import PROFILE_MAX_SECONDS
+from database.backfill import backfill_discord_user_ids, guild_member_resolver
+from utils.profiler import SamplingProfiler
+
+logger = logging.getLogger(__name__)
+
+class Owner(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        self.profiling = False
+
+    async def cog_check(self, ctx):
+        return await self.bot.is_owner(ctx.author)
+
+    @commands.command(name='sync')
+    async def sync_commands(self, ctx):
+        """Sync slash commands with Discord"""
+        try:
+            logger.info("Manually syncing commands...")
+            # Always sync here, even if the fingerprint matches
+            synced = await self.bot.sync_command_tree(force=True)
+            logger.info("Synced %d commands", len(synced))
+            await ctx.send(f"Synced {len(synced)} commands")
+        except Exception as e:
+            logger.error("Error syncing commands: %s", e, exc_info=True)
+            await ctx.send(f"Error syncing commands: {str(e)}")
+
+    @commands.command(name='backfill_discord_ids')
+    async def backfill_discord_ids(self, ctx, dry_run: bool = False):
+        """Store Discord user IDs on subscriptions that only have a username"""
+        try:
+            await ctx.send("Resolving Discord usernames...")
+            result = await backfill_discord_user_ids(guild_member_resolver(self.bot.guilds), dry_run=dry_run)
+            files = []
+            if result.unresolved:
+                files.append(discord.File(io.BytesIO("\n".join(result.unresolved).encode('utf-8')), filename='unresolved.txt'))
+            await ctx.send(result.summary(), files=files)
+        except Exception as e:
+            logger.error("Error backfilling Discord user IDs: %s", e, exc_info=True)
+            await ctx.send(f"Error backfilling Discord user IDs: {str(e)}")
+
+    @commands.command(name='profile')
+    async def profile(self, ctx, seconds: int = 30, flamegraph: bool = False):
+        """Sample the running bot for a number of seconds and upload the stats"""
+        if self.profiling:
+            await ctx.send("A profiling session is already running")
+            return
+        seconds = max(1, min(seconds, PROFILE_MAX_SECONDS))
+        self.profiling = True
+        try:
+            logger.info("Profiling for %ds...", seconds)
+            await ctx.send(f"Profiling for {seconds}s...")
+            # The sampler runs in a worker thread so it can observe the loop while it's busy
+            result = await asyncio.to_thread(SamplingProfiler().run, seconds, threading.get_ident())
+
+            files = [discord.File(io.BytesIO(result.format_report().encode('utf-8')), filename='profile.txt')]
+            if flamegraph:
+                files.append(discord.File(io.BytesIO(result.format_collapsed().encode('utf-8')), filename='profile.collapsed'))
+            await ctx.send(f"Profile finished ({result.samples} samples)", files=files)
+        except Exception as e:
+            logger.error("Error profiling: %s", e, exc_info=True)
+            await ctx.send(f"Error profiling: {str(e)}")
+        finally:
+            self.profiling = False
+
+async def setup(bot):
+    await bot.add_cog(Owner(bot))
@@ -0,0 +1,131 @@
+# Reports (and optionally repairs) drift between subscriptions and Plex shares
+import discord
+from discord import app_commands
+from discord.ext import commands, tasks
+import asyncio
+import io
+import logging
+from config import (
+    RECONCILE_INTERVAL_MINUTES,
+    RECONCILE_CHANNEL_ID,
+    RECONCILE_AUTO_APPLY,
+    RECONCILE_CONCURRENCY,
+    RECONCILE_PAGE_SIZE
+)
+from utils.metrics import timed_defer
+from utils.tracing import start_trace, finish_trace
+from plex.reconcile import reconcile, apply_report
+from cogs.subscription import ConfirmView
+
+logger = logging.getLogger(__name__)
+
+# Discord allows 25 fields per embed; keep one for the totals
+MAX_SERVER_FIELDS = 24
+
+def build_report_embed(report):
+    embed = discord.Embed(
+        title="🔍 Plex Reconciliation Report",
+        description=f"Compared **{report.rows_scanned}** subscription rows with the Plex friends lists "
+                    f"of **{len(report.servers)}** server(s) in {report.duration:.1f}s.",
+        color=discord.Color.green() if not report.drift else discord.Color.orange()
+    )
+    for diff in list(report.servers.values())[:MAX_SERVER_FIELDS]:
+        if diff.error:
+            value = f"❌ Could not read Plex shares: {diff.error[:200]}"
+        else:
+            lines = [
+                f"✅ In sync: {diff.in_sync}",
+                f"⌛ Expired but still shared: {len(diff.expired_shared)}",
+                f"➕ Shared without subscription: {len(diff.untracked)}",
+                f"➖ Active but not shared: {len(diff.missing_on_plex)}"
+            ]
+            if report.applied:
+                lines.append(f"🧹 Removed: {len(diff.removed)}, failed: {len(diff.remove_failed)}")
+            value = "\n".join(lines)
+        embed.add_field(name=f"🖥️ {diff.server_name}", value=value, inline=True)
+    if report.unknown_server_rows:
+        embed.add_field(
+            name="⚠️ Unknown servers",
+            value=f"{report.unknown_server_rows} subscription(s) belong to servers that are not configured",
+            inline=False
+        )
+    embed.set_footer(text="The full list of differences is attached as reconcile.csv")
+    return embed
+
+def report_file(report):
+    return discord.File(io.BytesIO(report.to_csv().encode('utf-8')), filename='reconcile.csv')
+
+class Reconcile(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+        # One reconciliation at a time, whether started by a command or the timer
+        self._lock = asyncio.Lock()
+
+    async def cog_load(self):
+        if RECONCILE_INTERVAL_MINUTES > 0:
+            self.periodic_reconcile.change_interval(minutes=RECONCILE_INTERVAL_MINUTES)
+            self.periodic_reconcile.start()
+
+    async def cog_unload(self):
+        self.periodic_reconcile.cancel()
+
+    @tasks.loop(minutes=60)
+    async def periodic_reconcile(self):
+        if self._lock.locked():
+            return
+        trace = start_trace('reconcile')
+        try:
+            async with self._lock:
+                report = await reconcile(RECONCILE_PAGE_SIZE)
+                if RECONCILE_AUTO_APPLY and report.expired_shared:
+                    await apply_report(report, RECONCILE_CONCURRENCY)
+            if RECONCILE_CHANNEL_ID and report.drift:
+                channel = self.bot.get_channel(RECONCILE_CHANNEL_ID) or await self.bot.fetch_channel(RECONCILE_CHANNEL_ID)
+                await channel.send(embed=build_report_embed(report), file=report_file(report))
+        except Exception as e:
+            logger.error("Error in periodic reconciliation: %s", e, exc_info=True)
+        finally:
+            finish_trace(trace)
+
+    @periodic_reconcile.before_loop
+    async def before_periodic_reconcile(self):
+        await self.bot.wait_until_ready()
+
+    @app_commands.command(name='reconcile', description='Compare subscriptions with the Plex friends lists')
+    @app_commands.describe(apply='Stop sharing servers with users whose subscription has expired')
+    async def reconcile_command(self, interaction: discord.Interaction, apply: bool = False):
+        try:
+            await timed_defer(interaction)
+            if self._lock.locked():
+                await interaction.followup.send("A reconciliation is already running, please try again later.", ephemeral=True)
+                return
+
+            async with self._lock:
+                report = await reconcile(RECONCILE_PAGE_SIZE)
+            embed = build_report_embed(report)
+            if not apply or not report.expired_shared:
+                await interaction.followup.send(embed=embed, file=report_file(report))
+                return
+
+            embed.add_field(
+                name="🧹 Apply",
+                value=f"Stop sharing with **{report.expired_shared}** user(s) whose subscription has expired?",
+                inline=False
+            )
+            view = ConfirmView(interaction.user.id)
+            message = await interaction.followup.send(embed=embed, file=report_file(report), view=view)
+            await view.wait()
+            if not view.confirmed:
+                embed.set_footer(text="Timed out, nothing was changed" if view.confirmed is None else "Cancelled, nothing was changed")
+                await message.edit(embed=embed, view=None)
+                return
+
+            async with self._lock:
+                await apply_report(report, RECONCILE_CONCURRENCY)
+            await message.edit(embed=build_report_embed(report), attachments=[report_file(report)], view=None)
+        except Exception as e:
+            logger.error("Error in reconcile command: %s", e, exc_info=True)
+            await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(Reconcile(bot))
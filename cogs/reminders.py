@@ -0,0 +1,143 @@
+# Sends subscribers a DM before their subscription ends
+import discord
+from discord.ext import commands, tasks
+import asyncio
+import logging
+import time
+from datetime import date
+from config import REMINDER_INTERVAL_MINUTES, REMINDER_DAYS, REMINDER_RATE, REMINDER_BURST
+from database.db import db
+from utils.metrics import REMINDERS_SENT
+from utils.rate_limit import TokenBucket
+from utils.tracing import start_trace, finish_trace
+
+logger = logging.getLogger(__name__)
+
+# Discord allows 25 fields per embed
+MAX_SUBSCRIPTION_FIELDS = 25
+
+def build_reminder_embed(subscriptions, today=None):
+    today = today or date.today()
+    days_left = {
+        row['subscription_id']: (date.fromisoformat(row['end_date']) - today).days
+        for row in subscriptions
+    }
+    ends_today = min(days_left.values()) <= 0
+    embed = discord.Embed(
+        title="⏰ Your Plex subscription ends today" if ends_today else "⏰ Your Plex subscription is ending soon",
+        description="Contact an admin to renew it and keep your access.",
+        color=discord.Color.red() if ends_today else discord.Color.gold()
+    )
+    for row in subscriptions[:MAX_SUBSCRIPTION_FIELDS]:
+        days = days_left[row['subscription_id']]
+        end_date = date.fromisoformat(row['end_date']).strftime('%d-%m-%Y')
+        embed.add_field(
+            name=f"🖥️ {row['server_name']}",
+            value=(
+                f"Plex user: {row['plex_username']}\n"
+                f"Ends: {end_date} ({'today' if days <= 0 else f'in {days} day' + ('s' if days != 1 else '')})"
+            ),
+            inline=False
+        )
+    return embed
+
+class Reminders(commands.Cog):
+    """
+    Every REMINDER_INTERVAL_MINUTES, fetches the due reminders in one query and DMs each
+    user once about all of their subscriptions. Requests are paced by a token bucket so
+    hundreds of DMs don't run into Discord's rate limits, and the loop runs as its own
+    task, so commands are handled while it waits. Sent reminders are written to
+    reminder_log right away, a restart never sends them twice.
+    """
+
+    def __init__(self, bot):
+        self.bot = bot
+        self.bucket = TokenBucket(REMINDER_RATE, REMINDER_BURST)
+        self._lock = asyncio.Lock()
+
+    async def cog_load(self):
+        if REMINDER_INTERVAL_MINUTES > 0 and REMINDER_DAYS:
+            self.send_reminders.change_interval(minutes=REMINDER_INTERVAL_MINUTES)
+            self.send_reminders.start()
+
+    async def cog_unload(self):
+        self.send_reminders.cancel()
+
+    @tasks.loop(minutes=60)
+    async def send_reminders(self):
+        if self._lock.locked():
+            return
+        trace = start_trace('reminders')
+        try:
+            async with self._lock:
+                await self.dispatch()
+        except Exception as e:
+            logger.error("Error sending reminders: %s", e, exc_info=True)
+        finally:
+            finish_trace(trace)
+
+    @send_reminders.before_loop
+    async def before_send_reminders(self):
+        await self.bot.wait_until_ready()
+
+    async def dispatch(self):
+        """Send every due reminder; returns the number of users that got a DM"""
+        start = time.perf_counter()
+        rows = await db.get_due_reminders(REMINDER_DAYS)
+        by_user = {}
+        for row in rows:
+            by_user.setdefault(row['discord_user_id'], []).append(row)
+
+        sent = 0
+        for discord_user_id, subscriptions in by_user.items():
+            status = await self._send(discord_user_id, subscriptions)
+            REMINDERS_SENT.inc(result=status)
+            if status == 'error':
+                # Not logged, so the next run tries again
+                continue
+            sent += status == 'sent'
+            await db.log_reminders([
+                {
+                    'subscription_id': row['subscription_id'],
+                    'end_date': row['end_date'],
+                    'days_before': row['days_before'],
+                    'discord_user_id': discord_user_id,
+                    'status': status
+                }
+                for row in subscriptions
+            ])
+
+        if by_user:
+            logger.info(
+                "Sent expiry reminders to %d of %d users (%d subscriptions) in %.1fs",
+                sent, len(by_user), len(rows), time.perf_counter() - start
+            )
+        return sent
+
+    async def _dm_channel(self, discord_user_id):
+        user = self.bot.get_user(discord_user_id)
+        if user is not None and user.dm_channel is not None:
+            return user.dm_channel
+        # Opening a DM channel is a request of its own
+        await self.bucket.acquire()
+        return await self.bot.create_dm(user or discord.Object(id=discord_user_id))
+
+    async def _send(self, discord_user_id, subscriptions):
+        """DM one user; returns 'sent', 'undeliverable' (DMs closed, unknown user) or 'error'"""
+        try:
+            channel = await self._dm_channel(discord_user_id)
+            await self.bucket.acquire()
+            await channel.send(embed=build_reminder_embed(subscriptions))
+            return 'sent'
+        except (discord.Forbidden, discord.NotFound) as e:
+            logger.info("Cannot DM Discord user %s: %s", discord_user_id, e)
+            return 'undeliverable'
+        except discord.HTTPException as e:
+            if e.status == 429:
+                # discord.py already retried; back off before the next DM
+                self.bucket.pause(getattr(e, 'retry_after', None) or 60)
+            logger.warning("Failed to DM Discord user %s: %s", discord_user_id, e)
+            return 'error'
+
+async def setup(bot):
+    await bot.add_cog(Reminders(bot))
@@ -2,9 +2,14 @@
 import discord
 from discord import app_commands
 from discord.ext import commands
+import asyncio
 import logging
 from database.db import db
-from plex.plex_manager import remove_user_from_plex
+from utils.metrics import timed_defer
+from plex.job_queue import job_queue, PermanentJobError
+from plex.plex_manager import remove_user_from_plex, is_permanent_error
+from plex.health import ServerDegradedError
+from cogs.invite import edit_job_message
 
 logger = logging.getLogger(__name__)
 
@@ -12,96 +17,161 @@ class Remove(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
 
+    async def cog_load(self):
+        job_queue.register('remove', self._run_remove_job, self._on_remove_job_done)
+
+    async def _run_remove_job(self, job):
+        """Remove the user from every Plex server (runs on the job queue)"""
+        payload = job['payload']
+        plex_username = payload['plex_username']
+
+        # Get all Plex servers
+        servers = await db.get_all_plex_servers()
+        if not servers:
+            raise PermanentJobError("No Plex servers found in the database.")
+
+        # Servers finished on an earlier attempt are skipped on retries
+        results = payload.setdefault('results', {})
+        payload['servers'] = [server['server_name'] for server in servers]
+        pending = [server for server in servers if server['server_name'] not in results]
+
+        async def remove_from(server):
+            try:
+                # Attempt to remove user from each server
+                removed = await asyncio.to_thread(
+                    remove_user_from_plex, server['plex_url'], server['plex_token'], plex_username
+                )
+                return server['server_name'], removed
+            except ServerDegradedError as degraded:
+                # Skipped without waiting for a timeout; the retry may find it back up
+                logger.warning(str(degraded))
+                return server['server_name'], None
+            except Exception as server_error:
+                logger.error("Error removing user from server %s: %s", server['server_name'], server_error, exc_info=True)
+                # None marks a temporary failure that is worth retrying
+                return server['server_name'], False if is_permanent_error(server_error) else None
+
+        retry_servers = []
+        for server_name, removed in await asyncio.gather(*(remove_from(server) for server in pending)):
+            if removed is None:
+                retry_servers.append(server_name)
+            else:
+                results[server_name] = removed
+
+        await job_queue.checkpoint(job['id'], payload)
+        if retry_servers:
+            raise RuntimeError(f"Could not reach {', '.join(retry_servers)}")
+        return {'results': results}
+
+    async def _on_remove_job_done(self, job):
+        payload = job['payload']
+        if not payload.get('servers'):
+            await edit_job_message(self.bot, payload, content=f"Error: {job['last_error']}", embed=None)
+            return
+
+        results = payload.get('results', {})
+        removal_results = [(server_name, results.get(server_name, False)) for server_name in payload['servers']]
+        await edit_job_message(self.bot, payload, embed=self._build_removal_embed(payload['plex_username'], removal_results))
+
+    def _build_removal_embed(self, plex_username, removal_results):
+        # Format results message with enhanced error handling
+        embed = discord.Embed(
+            title="🔄 Plex Server Removal Status",
+            color=discord.Color.orange()
+        )
+
+        # Add user info with more details
+        embed.add_field(
+            name="👤 User Information",
+            value=f"**Username:** {plex_username}",
+            inline=False
+        )
+
+        # Add removal status for each server with detailed information
+        success_servers = []
+        failed_servers = []
+
+        for server_name, success in removal_results:
+            if success:
+                success_servers.append(server_name)
+                embed.add_field(
+                    name=f"✅ {server_name}",
+                    value="Successfully removed user from server",
+                    inline=True
+                )
+            else:
+                failed_servers.append(server_name)
+                embed.add_field(
+                    name=f"❌ {server_name}",
+                    value="Failed to remove user - Please check server logs",
+                    inline=True
+                )
+
+        # Add summary section
+        summary = []
+        if success_servers:
+            summary.append(f"✅ Successfully removed from {len(success_servers)} server(s)")
+        if failed_servers:
+            summary.append(f"❌ Failed to remove from {len(failed_servers)} server(s)")
+
+        if summary:
+            embed.add_field(
+                name="📊 Summary",
+                value="\n".join(summary),
+                inline=False
+            )
+
+        # Add detailed footer with next steps
+        if failed_servers:
+            footer_text = "Some removals failed. Please check server logs or try again later."
+        else:
+            footer_text = "User access has been successfully revoked from all specified servers."
+
+        embed.set_footer(text=footer_text)
+        return embed
+
     @app_commands.command(name='remove', description='Remove a user from all Plex servers')
     @app_commands.describe(plex_username='Plex username or email to remove')
     async def remove(self, interaction: discord.Interaction, plex_username: str):
         try:
             # Try to defer the response, but handle potential network issues
             try:
-                await interaction.response.defer()
+                await timed_defer(interaction)
                 response_method = interaction.followup.send
-            except (discord.errors.NotFound, aiohttp.client_exceptions.ClientOSError):
+            except (discord.errors.NotFound, discord.errors.HTTPException):
                 # If defer fails due to network issues, we'll try to use the original response
                 logger.warning("Could not defer response, attempting to use original response")
                 response_method = interaction.response.send_message
-            
-            try:
-                # Get all Plex servers
-                servers = await db.get_all_plex_servers()
-                if not servers:
-                    await response_method("No Plex servers found in the database.", ephemeral=True)
-                    return
-
-                removal_results = []
-                for server in servers:
-                    try:
-                        # Attempt to remove user from each server
-                        remove_result = remove_user_from_plex(server['plex_url'], server['plex_token'], plex_username)
-                        removal_results.append((server['server_name'], remove_result))
-                    except Exception as server_error:
-                        logger.error(f"Error removing user from server {server['server_name']}: {str(server_error)}", exc_info=True)
-                        removal_results.append((server['server_name'], False))
-                # Format results message with enhanced error handling
-                embed = discord.Embed(
-                    title="🔄 Plex Server Removal Status",
-                    color=discord.Color.orange()
-                )
-                
-                # Add user info with more details
-                embed.add_field(
-                    name="👤 User Information",
-                    value=f"**Username:** {plex_username}",
-                    inline=False
-                )
-                
-                # Add removal status for each server with detailed information
-                success_servers = []
-                failed_servers = []
-                
-                for server_name, success in removal_results:
-                    if success:
-                        success_servers.append(server_name)
-                        embed.add_field(
-                            name=f"✅ {server_name}",
-                            value="Successfully removed user from server",
-                            inline=True
-                        )
-                    else:
-                        failed_servers.append(server_name)
-                        embed.add_field(
-                            name=f"❌ {server_name}",
-                            value="Failed to remove user - Please check server logs",
-                            inline=True
-                        )
-                
-                # Add summary section
-                summary = []
-                if success_servers:
-                    summary.append(f"✅ Successfully removed from {len(success_servers)} server(s)")
-                if failed_servers:
-                    summary.append(f"❌ Failed to remove from {len(failed_servers)} server(s)")
-                
-                if summary:
-                    embed.add_field(
-                        name="📊 Summary",
-                        value="\n".join(summary),
-                        inline=False
-                    )
-                
-                # Add detailed footer with next steps
-                if failed_servers:
-                    footer_text = "Some removals failed. Please check server logs or try again later."
-                else:
-                    footer_text = "User access has been successfully revoked from all specified servers."
-                
-                embed.set_footer(text=footer_text)
-                
-                await response_method(embed=embed)
-
-            except Exception as db_error:
-                logger.error(f"Database error: {str(db_error)}", exc_info=True)
-                await response_method(f"Error: {str(db_error)}", ephemeral=True)
-                    
+
+            # Acknowledge right away, the Plex work runs on the job queue
+            embed = discord.Embed(
+                title="⏳ Plex Server Removal Queued",
+                color=discord.Color.blue()
+            )
+            embed.add_field(
+                name="👤 User Information",
+                value=f"**Username:** {plex_username}",
+                inline=False
+            )
+            embed.set_footer(text="This message will be updated once the user has been removed")
+            message = await response_method(embed=embed)
+            if not isinstance(message, discord.Message):
+                # send_message doesn't hand back the message, so look it up
+                message = await interaction.original_response()
+
+            payload = {
+                'plex_username': plex_username,
+                'channel_id': message.channel.id,
+                'message_id': message.id
+            }
+            job, created = await job_queue.enqueue(
+                'remove', payload, idempotency_key=f"remove:{plex_username.lower()}"
+            )
+            if not created:
+                embed.title = "⏳ Plex Server Removal Already Queued"
+                embed.set_footer(text="A removal for this user is already being processed")
+                await message.edit(embed=embed)
+
         except Exception as e:
             logger.error(f"Error in remove command: {str(e)}", exc_info=True)
             # Try to respond if possible, but this might fail if the connection is completely lost
@@ -112,6 +182,6 @@ class Remove(commands.Cog):
                     await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
             except Exception:
                 logger.error("Could not send error response to user", exc_info=True)
-                    
+
 async def setup(bot):
-    await bot.add_cog(Remove(bot))
\ No newline at end of file
+    await bot.add_cog(Remove(bot))
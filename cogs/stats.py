@@ -0,0 +1,85 @@
+# Summarizes the subscriptions table with numbers aggregated in the database
+import discord
+from discord import app_commands
+from discord.ext import commands
+import logging
+from database.db import db, stats_cache
+from utils.metrics import timed_defer
+
+logger = logging.getLogger(__name__)
+
+# Discord allows 25 fields per embed; the totals and mix fields take three
+MAX_SERVER_FIELDS = 22
+
+def format_mix(counts, total):
+    """One line per value, largest first, with its share of total"""
+    if not counts:
+        return "None"
+    lines = [
+        f"**{name}**: {count} ({count / total:.0%})"
+        for name, count in sorted(counts.items(), key=lambda item: item[1], reverse=True)
+    ]
+    return '\n'.join(lines)[:1024]
+
+class Stats(commands.Cog):
+    def __init__(self, bot):
+        self.bot = bot
+
+    @app_commands.command(name='stats', description='Show subscriber counts per server and the subscription mix')
+    @app_commands.describe(expiring_days='Count subscriptions ending within this many days as expiring (default 7)')
+    async def stats(self, interaction: discord.Interaction,
+                    expiring_days: app_commands.Range[int, 0, 365] = 7):
+        try:
+            await timed_defer(interaction)
+            stats = await db.get_subscription_stats(expiring_days)
+            servers = stats.get('servers') or []
+
+            if not servers:
+                await interaction.followup.send("No subscriptions found.")
+                return
+
+            total = sum(server['total'] for server in servers)
+            active = sum(server['active'] for server in servers)
+            expired = sum(server['expired'] for server in servers)
+            expiring = sum(server['expiring'] for server in servers)
+
+            embed = discord.Embed(
+                title="📊 Subscription Statistics",
+                color=discord.Color.blue()
+            )
+            embed.add_field(
+                name="Totals",
+                value=(
+                    f"**Subscriptions:** {total}\n"
+                    f"**Active:** {active}\n"
+                    f"**Expired:** {expired}\n"
+                    f"**Expiring within {expiring_days} days:** {expiring}"
+                ),
+                inline=False
+            )
+
+            for server in servers[:MAX_SERVER_FIELDS]:
+                embed.add_field(
+                    name=f"🖥️ {server['server_name']}",
+                    value=(
+                        f"Active: {server['active']}\n"
+                        f"Expired: {server['expired']}\n"
+                        f"Expiring: {server['expiring']}"
+                    ),
+                    inline=True
+                )
+            if len(servers) > MAX_SERVER_FIELDS:
+                embed.description = f"Showing {MAX_SERVER_FIELDS} of {len(servers)} servers."
+
+            embed.add_field(name="Durations (active)", value=format_mix(stats.get('durations'), active), inline=True)
+            embed.add_field(name="Payment Methods (active)", value=format_mix(stats.get('payment_methods'), active), inline=True)
+
+            age = stats_cache.age(expiring_days) or 0
+            embed.set_footer(text=f"Updated {age:.0f}s ago")
+            await interaction.followup.send(embed=embed)
+        except Exception as e:
+            logger.error("Error in stats command: %s", e, exc_info=True)
+            await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(Stats(bot))
@@ -3,12 +3,48 @@ import discord
 from discord import app_commands
 from discord.ext import commands
 import logging
+import re
 from database.db import db
-from datetime import datetime
-from utils.date_utils import calculate_end_date
+from utils.metrics import timed_defer
+from datetime import datetime, timedelta
+from typing import List, Optional
+from utils.date_utils import calculate_end_date, get_end_date, duration_to_days
+from utils.expiry import ExpiryTable, STATUS_EMOJI
+from cogs.invite import duration_choices
 
 logger = logging.getLogger(__name__)
 
+MENTION_PATTERN = re.compile(r'^<@!?(\d+)>$')
+
+# Number of subscriptions listed in the /renew_bulk preview
+PREVIEW_LIMIT = 10
+
+class ConfirmView(discord.ui.View):
+    """Confirm/Cancel buttons that only the invoking user can press"""
+
+    def __init__(self, author_id, timeout=120):
+        super().__init__(timeout=timeout)
+        self.author_id = author_id
+        self.confirmed = None
+
+    async def interaction_check(self, interaction: discord.Interaction) -> bool:
+        if interaction.user.id != self.author_id:
+            await interaction.response.send_message("Only the user who ran this command can confirm it.", ephemeral=True)
+            return False
+        return True
+
+    @discord.ui.button(label='Confirm', style=discord.ButtonStyle.danger)
+    async def confirm(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.confirmed = True
+        await interaction.response.defer()
+        self.stop()
+
+    @discord.ui.button(label='Cancel', style=discord.ButtonStyle.secondary)
+    async def cancel(self, interaction: discord.Interaction, button: discord.ui.Button):
+        self.confirmed = False
+        await interaction.response.defer()
+        self.stop()
+
 class Subscription(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
@@ -20,21 +56,24 @@ class Subscription(commands.Cog):
     async def fetch_subscription(self, interaction: discord.Interaction, user_identifier: str):
             try:
                 # Defer the response since this might take a while
-                await interaction.response.defer()
+                await timed_defer(interaction)
                 
-                # Check if the input is a Discord mention (<@id>) and convert it to username
-                if user_identifier.startswith('<@') and user_identifier.endswith('>'):
-                    user_id = user_identifier.strip('<@!>')
-                    try:
-                        user = await self.bot.fetch_user(int(user_id))
-                        user_identifier = f"{user.name}#{user.discriminator}" if user.discriminator != '0' else user.name
-                    except:
-                        # If we can't fetch the user, continue with the original identifier
-                        pass
-                    
-                # Get subscription details from database
-                # Try to find by discord username first
-                subscriptions = await db.get_subscription_by_discord(user_identifier)
+                subscriptions = None
+                # A Discord mention (<@id>) is looked up by the stored user ID
+                match = MENTION_PATTERN.match(user_identifier)
+                if match:
+                    user_id = int(match.group(1))
+                    subscriptions = await db.get_subscription_by_discord_id(user_id)
+                    if not subscriptions:
+                        # Rows from before IDs were stored only have the username; use it
+                        # if the user is cached, without asking Discord
+                        user = self.bot.get_user(user_id)
+                        if user is not None:
+                            user_identifier = str(user)
+
+                if not subscriptions:
+                    # Try to find by discord username first
+                    subscriptions = await db.get_subscription_by_discord(user_identifier)
                 if not subscriptions:
                     # If not found, try by plex username/email
                     subscriptions = await db.get_subscription(user_identifier)
@@ -51,24 +90,14 @@ class Subscription(commands.Cog):
                         color=discord.Color.blue()
                     )
                     
-                    for i, details in enumerate(subscriptions, 1):
-                        # Calculate end date - try both date formats
-                        try:
-                            # Try DD-MM-YYYY format first
-                            start_date = datetime.strptime(details['start_date'], '%d-%m-%Y')
-                        except ValueError:
-                            # If that fails, try YYYY-MM-DD format
-                            start_date = datetime.strptime(details['start_date'], '%Y-%m-%d')
-                            
-                        end_date = calculate_end_date(start_date, details['duration'])
-                        days_remaining = (end_date - datetime.now()).days
-                        
-                        # Add status emoji
-                        status = "🟢" if days_remaining > 7 else "🟡" if days_remaining > 2 else "🔴"
+                    table = ExpiryTable(subscriptions)
+                    for i in range(len(table)):
+                        details, days_remaining, end_date, bucket = table.row(i)
+                        status = STATUS_EMOJI[bucket]
                         
                         # Add field for each subscription
                         embed.add_field(
-                            name=f"Subscription #{i}: {details['plex_username']}",
+                            name=f"Subscription #{i + 1}: {details['plex_username']}",
                             value=f"Server: {details['server_name']}\n"
                                   f"Duration: {details['duration'].replace('_', ' ').title()}\n"
                                   f"End Date: {end_date.strftime('%Y-%m-%d')}\n"
@@ -80,18 +109,7 @@ class Subscription(commands.Cog):
                     return
                 
                 # Format subscription details for a single subscription
-                details = subscriptions[0]
-                
-                # Calculate end date - try both date formats
-                try:
-                    # Try DD-MM-YYYY format first
-                    start_date = datetime.strptime(details['start_date'], '%d-%m-%Y')
-                except ValueError:
-                    # If that fails, try YYYY-MM-DD format
-                    start_date = datetime.strptime(details['start_date'], '%Y-%m-%d')
-                    
-                end_date = calculate_end_date(start_date, details['duration'])
-                days_remaining = (end_date - datetime.now()).days
+                details, days_remaining, end_date, bucket = ExpiryTable(subscriptions).row(0)
                 
                 # Rest of the code remains the same
                 # Create embed
@@ -108,10 +126,11 @@ class Subscription(commands.Cog):
                 )
 
                 # Add Discord user info if available
-                if 'discord_username' in details and details['discord_username']:
+                if details.get('discord_user_id') or details.get('discord_username'):
+                    # A mention always shows the user's current name
                     embed.add_field(
                         name="👥 Discord User",
-                        value=details['discord_username'],
+                        value=f"<@{details['discord_user_id']}>" if details.get('discord_user_id') else details['discord_username'],
                         inline=False
                     )
                 
@@ -142,7 +161,7 @@ class Subscription(commands.Cog):
                 )
                 
                 # Add days remaining with appropriate color indicator
-                status = "🟢" if days_remaining > 7 else "🟡" if days_remaining > 2 else "🔴"
+                status = STATUS_EMOJI[bucket]
                 embed.add_field(
                     name="⏳ Time Remaining",
                     value=f"{status} {days_remaining} days",
@@ -178,7 +197,7 @@ class Subscription(commands.Cog):
     ])
     async def renew(self, interaction: discord.Interaction, user_identifier: str, duration: app_commands.Choice[str]):
         try:
-            await interaction.response.defer()
+            await timed_defer(interaction)
             
             # Get current subscription details
             current_subscription = await db.get_subscription(user_identifier)
@@ -192,19 +211,13 @@ class Subscription(commands.Cog):
             details = current_subscription[0]
             server_name = details['server_name']
             discord_username = details.get('discord_username')  # Preserve Discord username
+            discord_user_id = details.get('discord_user_id')  # Preserve Discord user ID
             plex_username = details['plex_username']  # Get the actual Plex username
             payment_method = details.get('payment_method')  # Preserve payment method
             payment_id = details.get('payment_id')  # Preserve payment ID
             
-            # Calculate the current subscription's end date to use as new start date
-            try:
-                # Try DD-MM-YYYY format first
-                current_start_date = datetime.strptime(details['start_date'], '%d-%m-%Y')
-            except ValueError:
-                # If that fails, try YYYY-MM-DD format
-                current_start_date = datetime.strptime(details['start_date'], '%Y-%m-%d')
-                
-            current_end_date = calculate_end_date(current_start_date, details['duration'])
+            # The current subscription's end date becomes the new start date
+            current_end_date = get_end_date(details)
             
             # Use the current end date as the new start date
             start_date = current_end_date.strftime('%d-%m-%Y')
@@ -225,6 +238,8 @@ class Subscription(commands.Cog):
             # Add Discord username if it exists
             if discord_username:
                 subscription_data['discord_username'] = discord_username
+            if discord_user_id:
+                subscription_data['discord_user_id'] = discord_user_id
             
             # Add the new subscription (end_date will be calculated automatically)
             await db.add_subscription(subscription_data)
@@ -291,5 +306,94 @@ class Subscription(commands.Cog):
             logger.error(f"Error in renew command: {str(e)}", exc_info=True)
             await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
 
+    async def server_name_autocomplete(self, interaction: discord.Interaction, current: str) -> List[app_commands.Choice[str]]:
+        # Reuse the server snapshot kept by the invite cog
+        invite_cog = self.bot.get_cog('Invite')
+        if invite_cog is None:
+            return []
+        return await invite_cog.server_name_autocomplete(interaction, current)
+
+    @app_commands.command(name='renew_bulk', description='Extend every subscription on a server')
+    @app_commands.describe(
+        server_name='Name of the Plex server',
+        status='Which subscriptions to extend',
+        duration='Extend by a subscription duration',
+        days='Extend by a number of days (negative to shorten)'
+    )
+    @app_commands.autocomplete(server_name=server_name_autocomplete)
+    @app_commands.choices(
+        status=[
+            app_commands.Choice(name="All", value="all"),
+            app_commands.Choice(name="Active only", value="active"),
+            app_commands.Choice(name="Expired only", value="expired")
+        ],
+        duration=duration_choices
+    )
+    async def renew_bulk(self, interaction: discord.Interaction,
+                         server_name: str,
+                         status: app_commands.Choice[str],
+                         duration: Optional[app_commands.Choice[str]] = None,
+                         days: Optional[app_commands.Range[int, -3650, 3650]] = None):
+        try:
+            await timed_defer(interaction)
+
+            if (duration is None) == (days is None):
+                raise ValueError("Provide exactly one of duration or days")
+            offset = duration_to_days(duration.value) if duration else days
+            if offset == 0:
+                raise ValueError("The number of days cannot be zero")
+
+            server = await db.get_plex_server(server_name)
+            if not server:
+                raise ValueError(f"Server '{server_name}' not found")
+
+            # Count and sample the affected rows before anything is changed
+            count = await db.extend_subscriptions(server_name, offset, status.value, dry_run=True)
+            if not count:
+                await interaction.followup.send(f"No {status.name.lower()} subscriptions found on {server_name}.")
+                return
+            sample = await db.get_subscriptions_by_server(server_name, status.value, limit=PREVIEW_LIMIT)
+
+            change = f"+{offset}" if offset > 0 else str(offset)
+            embed = discord.Embed(
+                title="🔄 Bulk Renewal Preview",
+                description=f"**{count}** subscription(s) on **{server_name}** ({status.name.lower()}) "
+                            f"will have their end date moved by **{change} days**.",
+                color=discord.Color.orange()
+            )
+            preview_lines = []
+            for details in sample:
+                end_date = get_end_date(details)
+                new_end_date = end_date + timedelta(days=offset)
+                preview_lines.append(f"{details['plex_username']}: {end_date.strftime('%d-%m-%Y')} → {new_end_date.strftime('%d-%m-%Y')}")
+            if count > len(sample):
+                preview_lines.append(f"... and {count - len(sample)} more")
+            embed.add_field(name="📋 Preview", value="\n".join(preview_lines), inline=False)
+            embed.set_footer(text="Confirm within 2 minutes to apply the change")
+
+            view = ConfirmView(interaction.user.id)
+            message = await interaction.followup.send(embed=embed, view=view)
+            await view.wait()
+
+            if not view.confirmed:
+                embed.title = "❎ Bulk Renewal Cancelled"
+                embed.color = discord.Color.light_grey()
+                embed.set_footer(text="Timed out" if view.confirmed is None else "Cancelled by user")
+                await message.edit(embed=embed, view=None)
+                return
+
+            affected = await db.extend_subscriptions(server_name, offset, status.value)
+
+            result_embed = discord.Embed(
+                title="✅ Bulk Renewal Complete",
+                description=f"Moved the end date of **{affected}** subscription(s) on **{server_name}** by **{change} days**.",
+                color=discord.Color.green()
+            )
+            result_embed.set_footer(text="Use /due_subscription to see all upcoming renewals")
+            await message.edit(embed=result_embed, view=None)
+        except Exception as e:
+            logger.error("Error in renew_bulk command: %s", e, exc_info=True)
+            await interaction.followup.send(f"Error: {str(e)}", ephemeral=True)
+
 async def setup(bot):
     await bot.add_cog(Subscription(bot))
\ No newline at end of file
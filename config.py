@@ -17,22 +17,120 @@ SUPABASE_KEY = os.getenv('SUPABASE_KEY')
 # Supabase table names
 SUBSCRIPTIONS_TABLE = 'subscriptions'
 PLEX_SERVERS_TABLE = 'plex_servers'
+REMINDER_LOG_TABLE = 'reminder_log'
+
+# Where the hash of the last synced slash-command tree is stored
+COMMAND_TREE_HASH_FILE = os.getenv('COMMAND_TREE_HASH_FILE', '.command_tree_hash')
+
+# Bulk invitations: maximum CSV rows per upload and concurrent Plex invitations
+BULK_INVITE_MAX_ROWS = int(os.getenv('BULK_INVITE_MAX_ROWS', '500'))
+BULK_INVITE_CONCURRENCY = int(os.getenv('BULK_INVITE_CONCURRENCY', '5'))
+
+# Durable queue for Plex invite/remove jobs
+JOB_QUEUE_PATH = os.getenv('JOB_QUEUE_PATH', 'jobs.sqlite3')
+JOB_QUEUE_WORKERS = int(os.getenv('JOB_QUEUE_WORKERS', '4'))
+JOB_QUEUE_MAX_ATTEMPTS = int(os.getenv('JOB_QUEUE_MAX_ATTEMPTS', '5'))
+
+# Prometheus-style /metrics endpoint; set METRICS_PORT=0 to disable it
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))
+
+# Request tracing: traces slower than the threshold are logged, and appended
+# as JSON lines to TRACE_EXPORT_FILE when it is set
+TRACE_SLOW_THRESHOLD_MS = float(os.getenv('TRACE_SLOW_THRESHOLD_MS', '2000'))
+TRACE_EXPORT_FILE = os.getenv('TRACE_EXPORT_FILE', '')
+
+# Longest session the owner-only profile command will run, in seconds
+PROFILE_MAX_SECONDS = int(os.getenv('PROFILE_MAX_SECONDS', '300'))
+
+# Logging: records are written to a rotating JSON file from a background thread.
+# LOG_LEVELS overrides levels per module, e.g. "discord=WARNING,database=DEBUG"
+LOG_FILE = os.getenv('LOG_FILE', 'discord-bot.log')
+LOG_MAX_BYTES = int(os.getenv('LOG_MAX_BYTES', str(10 * 1024 * 1024)))
+LOG_BACKUP_COUNT = int(os.getenv('LOG_BACKUP_COUNT', '5'))
+LOG_LEVELS = os.getenv('LOG_LEVELS', 'discord=INFO')
+
+# Event loop stall detector: blocking calls longer than the threshold are logged
+# with the loop thread's stack, at most once per interval for each location
+LOOP_STALL_THRESHOLD_MS = float(os.getenv('LOOP_STALL_THRESHOLD_MS', '250'))
+LOOP_STALL_REPORT_INTERVAL = float(os.getenv('LOOP_STALL_REPORT_INTERVAL', '60'))
+
+# Reconciliation of subscriptions against Plex shares. RECONCILE_INTERVAL_MINUTES=0
+# turns off the periodic run; reports with differences go to RECONCILE_CHANNEL_ID
+RECONCILE_INTERVAL_MINUTES = int(os.getenv('RECONCILE_INTERVAL_MINUTES', '0'))
+RECONCILE_CHANNEL_ID = int(os.getenv('RECONCILE_CHANNEL_ID') or '0')
+RECONCILE_AUTO_APPLY = os.getenv('RECONCILE_AUTO_APPLY', 'False').lower() == 'true'
+RECONCILE_CONCURRENCY = int(os.getenv('RECONCILE_CONCURRENCY', '5'))
+RECONCILE_PAGE_SIZE = int(os.getenv('RECONCILE_PAGE_SIZE', '1000'))
+
+# Plex servers imported at the same time by /import_all and the CLI's import command
+IMPORT_CONCURRENCY = int(os.getenv('IMPORT_CONCURRENCY', '3'))
+
+# Rows fetched per database page by /export_subscriptions
+EXPORT_PAGE_SIZE = int(os.getenv('EXPORT_PAGE_SIZE', '1000'))
+
+# Plex server health checks (PLEX_HEALTH_INTERVAL=0 turns them off). Servers failing
+# PLEX_HEALTH_FAILURE_THRESHOLD checks in a row are skipped until they recover; call
+# timeouts are PLEX_TIMEOUT_MULTIPLIER x the p99 of the last PLEX_HEALTH_WINDOW probes
+PLEX_HEALTH_INTERVAL = float(os.getenv('PLEX_HEALTH_INTERVAL', '60'))
+PLEX_HEALTH_WINDOW = int(os.getenv('PLEX_HEALTH_WINDOW', '50'))
+PLEX_HEALTH_FAILURE_THRESHOLD = int(os.getenv('PLEX_HEALTH_FAILURE_THRESHOLD', '3'))
+PLEX_HEALTH_PROBE_TIMEOUT = float(os.getenv('PLEX_HEALTH_PROBE_TIMEOUT', '10'))
+PLEX_TIMEOUT_MIN = float(os.getenv('PLEX_TIMEOUT_MIN', '2'))
+PLEX_TIMEOUT_MAX = float(os.getenv('PLEX_TIMEOUT_MAX', '30'))
+PLEX_TIMEOUT_MULTIPLIER = float(os.getenv('PLEX_TIMEOUT_MULTIPLIER', '4'))
+
+# Direct Postgres connection string (not the transaction pooler) for the change listener
+# that keeps cached subscriptions and servers in sync between bot instances and the CLI
+DATABASE_URL = os.getenv('DATABASE_URL', '')
+
+# Cached subscription and Plex server lookups. Without DATABASE_URL, changes made by other
+# instances only show once the entries expire, so the defaults are short (0 = no caching)
+SUBSCRIPTION_CACHE_SECONDS = float(os.getenv('SUBSCRIPTION_CACHE_SECONDS') or ('3600' if DATABASE_URL else '0'))
+SERVER_CACHE_SECONDS = float(os.getenv('SERVER_CACHE_SECONDS') or ('3600' if DATABASE_URL else '60'))
+
+# How long /stats results are reused before the database is asked again, in seconds
+STATS_CACHE_SECONDS = float(os.getenv('STATS_CACHE_SECONDS', '60'))
+
+# Expiry reminder DMs: sent at each of REMINDER_DAYS days before end_date, checked every
+# REMINDER_INTERVAL_MINUTES (0 turns reminders off). REMINDER_RATE is the number of Discord
+# requests per second the dispatcher makes on average, with bursts of up to REMINDER_BURST
+REMINDER_INTERVAL_MINUTES = int(os.getenv('REMINDER_INTERVAL_MINUTES', '0'))
+REMINDER_DAYS = [int(days) for days in os.getenv('REMINDER_DAYS', '7,2,0').split(',') if days.strip()]
+REMINDER_RATE = float(os.getenv('REMINDER_RATE', '1'))
+REMINDER_BURST = int(os.getenv('REMINDER_BURST', '5'))
+
+# Cached Plex data: account and server connections and library sections, and friends
+# lists (which are also dropped whenever the bot invites or removes someone)
+PLEX_CONNECTION_CACHE_SECONDS = float(os.getenv('PLEX_CONNECTION_CACHE_SECONDS', '3600'))
+PLEX_FRIENDS_CACHE_SECONDS = float(os.getenv('PLEX_FRIENDS_CACHE_SECONDS', '300'))
+
+# Where Plex friends lists are parsed: 'thread' (plexapi, in the calling worker thread) or
+# 'process' (a pool of PLEX_PARSER_PROCESSES processes, for accounts with thousands of friends)
+PLEX_FRIENDS_PARSER = os.getenv('PLEX_FRIENDS_PARSER', 'thread').lower()
+PLEX_PARSER_PROCESSES = int(os.getenv('PLEX_PARSER_PROCESSES', '2'))
+
+# Startup warm-up of the database and Plex connections and caches. setup_hook waits for
+# it at most WARMUP_BUDGET_SECONDS, then lets it finish in the background; 0 turns it off
+WARMUP_BUDGET_SECONDS = float(os.getenv('WARMUP_BUDGET_SECONDS', '15'))
 
 # API endpoints
 SUPABASE_API_URL = f"{SUPABASE_URL}/rest/v1"
 
 # Validate configuration
-def validate_config():
+def validate_config(require_discord=True):
     required_vars = [
-        ('DISCORD_BOT_TOKEN', DISCORD_BOT_TOKEN),
         ('SUPABASE_URL', SUPABASE_URL),
         ('SUPABASE_KEY', SUPABASE_KEY)
     ]
+    # The admin CLI works without a Discord connection
+    if require_discord:
+        required_vars.insert(0, ('DISCORD_BOT_TOKEN', DISCORD_BOT_TOKEN))
     
     missing_vars = [var[0] for var in required_vars if not var[1]]
     
     if missing_vars:
         raise ValueError(f"Missing required environment variables: {', '.join(missing_vars)}")
 
-# Validate configuration on import
-validate_config() 
\ No newline at end of file
+    if PLEX_FRIENDS_PARSER not in ('thread', 'process'):
+        raise ValueError(f"PLEX_FRIENDS_PARSER must be 'thread' or 'process', not '{PLEX_FRIENDS_PARSER}'")
@@ -0,0 +1,79 @@
+# Fills in discord_user_id for subscriptions that only recorded a Discord username
+import logging
+import time
+from database.db import db
+
+logger = logging.getLogger(__name__)
+
+class BackfillResult:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.rows_scanned = 0
+        self.rows_missing = 0
+        self.rows_updated = 0
+        # discord_username -> resolved user ID
+        self.resolved = {}
+        self.unresolved = []
+        self.duration = None
+
+    def summary(self):
+        action = "would be updated" if self.dry_run else "updated"
+        return (
+            f"Scanned {self.rows_scanned} subscriptions, {self.rows_missing} without a Discord user ID. "
+            f"Resolved {len(self.resolved)} of {len(self.resolved) + len(self.unresolved)} usernames, "
+            f"{self.rows_updated} rows {action}."
+        )
+
+def guild_member_resolver(guilds):
+    """
+    Resolve stored usernames (str(member) at the time of the invite, "name" or
+    "name#1234") to user IDs by searching the members of the given guilds.
+    """
+    async def resolve(discord_username):
+        name = discord_username.split('#')[0]
+        for guild in guilds:
+            member = guild.get_member_named(discord_username)
+            if member is None:
+                # Searching by prefix works without the privileged members intent
+                candidates = await guild.query_members(query=name, limit=100)
+                member = next((m for m in candidates if discord_username in (str(m), m.name)), None)
+            if member is not None:
+                return member.id
+        return None
+    return resolve
+
+async def backfill_discord_user_ids(resolve, page_size=1000, dry_run=False):
+    """
+    Stream the subscriptions without a discord_user_id and store the ID that
+    resolve(discord_username) returns for them. Every distinct username is resolved
+    once and written with a single UPDATE, however many rows share it.
+    """
+    start = time.perf_counter()
+    result = BackfillResult(dry_run)
+    pending = {}
+    async for rows in db.iter_subscription_pages(page_size, "id,discord_username,discord_user_id"):
+        result.rows_scanned += len(rows)
+        for row in rows:
+            if row.get('discord_user_id') or not row.get('discord_username'):
+                continue
+            result.rows_missing += 1
+            pending[row['discord_username']] = pending.get(row['discord_username'], 0) + 1
+
+    for discord_username, count in pending.items():
+        try:
+            user_id = await resolve(discord_username)
+        except Exception as e:
+            logger.warning("Could not resolve Discord user %s: %s", discord_username, e)
+            user_id = None
+        if user_id is None:
+            result.unresolved.append(discord_username)
+            continue
+        result.resolved[discord_username] = user_id
+        if dry_run:
+            result.rows_updated += count
+        else:
+            result.rows_updated += await db.set_discord_user_id(discord_username, user_id)
+
+    result.duration = time.perf_counter() - start
+    logger.info("Discord user ID backfill finished in %.2fs: %s", result.duration, result.summary())
+    return result
@@ -1,22 +1,66 @@
 # Supabase connection and table creation logic
+import asyncio
 import logging
-from datetime import datetime
-from supabase import create_client, Client
-import httpx
+import threading
+import time
+from datetime import datetime, date
 from config import (
     SUPABASE_URL, 
     SUPABASE_KEY, 
     SUBSCRIPTIONS_TABLE, 
     PLEX_SERVERS_TABLE,
-    SUPABASE_API_URL
+    REMINDER_LOG_TABLE,
+    SUPABASE_API_URL,
+    STATS_CACHE_SECONDS,
+    SUBSCRIPTION_CACHE_SECONDS,
+    SERVER_CACHE_SECONDS
 )
 from utils.date_utils import calculate_end_date
+from utils.metrics import time_methods, DB_LATENCY
+from utils.tracing import span
+from utils.singleflight import single_flight
+from utils.cache import TTLCache, cached
 
 logger = logging.getLogger(__name__)
 
+stats_cache = TTLCache('subscription_stats', STATS_CACHE_SECONDS)
+# Lookups by key; writes made here drop the affected entries right away, writes made
+# elsewhere are picked up through database.listener, or once the entries expire
+subscription_cache = TTLCache('subscriptions', SUBSCRIPTION_CACHE_SECONDS)
+server_cache = TTLCache('plex_servers', SERVER_CACHE_SECONDS)
+
+# Columns subscriptions are cached by
+SUBSCRIPTION_CACHE_KEYS = ('plex_username', 'discord_username', 'discord_user_id')
+
+def invalidate_subscriptions(rows=None):
+    """
+    Drop the cached lookups of changed subscriptions, given rows with (some of) their
+    SUBSCRIPTION_CACHE_KEYS. With rows=None every cached subscription lookup is dropped.
+    """
+    stats_cache.invalidate()
+    if rows is None:
+        subscription_cache.invalidate()
+        return
+    for row in rows:
+        for column in SUBSCRIPTION_CACHE_KEYS:
+            if row.get(column) is not None:
+                subscription_cache.invalidate((column, row[column]))
+
+def invalidate_plex_servers(rows=None):
+    """Drop the cached lookups of changed Plex servers, or of all of them with rows=None"""
+    server_cache.invalidate(('all',))
+    if rows is None:
+        server_cache.invalidate()
+        return
+    for row in rows:
+        server_cache.invalidate(('server_name', row.get('server_name')))
+
+@time_methods(DB_LATENCY, span_prefix='db')
 class Database:
     def __init__(self):
-        self.supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+        # The Supabase client is created on first use (or by connect()) to keep imports cheap
+        self._supabase = None
+        self._connect_lock = threading.Lock()
         self.headers = {
             'apikey': SUPABASE_KEY,
             'Authorization': f'Bearer {SUPABASE_KEY}',
@@ -24,8 +68,29 @@ class Database:
             'Prefer': 'return=minimal'
         }
 
+    def connect(self):
+        """Create the Supabase client if it does not exist yet"""
+        if self._supabase is None:
+            # setup_hook connects from a worker thread, so guard against a second client
+            with self._connect_lock:
+                if self._supabase is None:
+                    from supabase import create_client
+                    self._supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+                    logger.debug("Created Supabase client")
+        return self._supabase
+
+    @property
+    def supabase(self):
+        return self.connect()
+
+    async def _execute(self, query):
+        # Reads run in a worker thread so identical concurrent reads actually overlap
+        # and can be coalesced, instead of blocking the event loop one after another
+        return await asyncio.to_thread(query.execute)
+
     async def execute_raw_query(self, query: str):
         """Execute a raw SQL query using Supabase REST API"""
+        import httpx
         try:
             async with httpx.AsyncClient() as client:
                 response = await client.post(
@@ -34,94 +99,202 @@ class Database:
                     json={"sql": query}
                 )
                 response.raise_for_status()
-                logger.debug(f"SQL query executed successfully: {query[:100]}...")
+                logger.debug("SQL query executed successfully: %.100s...", query)
                 return response.json()
         except Exception as e:
             logger.error(f"Error executing SQL query: {str(e)}", exc_info=True)
             raise
 
     # Subscription Methods
+    def _prepare_subscription(self, subscription_data):
+        """Normalize the start date to YYYY-MM-DD and fill in the end date"""
+        # Convert date from DD-MM-YYYY to YYYY-MM-DD format for database storage
+        start_date_str = subscription_data['start_date']
+        try:
+            # Try to parse as DD-MM-YYYY first
+            start_date = datetime.strptime(start_date_str, '%d-%m-%Y')
+            # Convert to YYYY-MM-DD for database storage
+            subscription_data['start_date'] = start_date.strftime('%Y-%m-%d')
+        except ValueError:
+            # If that fails, assume it's already in YYYY-MM-DD format
+            start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
+        
+        # Calculate end date based on start date and duration
+        end_date = calculate_end_date(start_date, subscription_data['duration'])
+        subscription_data['end_date'] = end_date.strftime('%Y-%m-%d')
+        return subscription_data
+
     async def add_subscription(self, subscription_data):
         """Add a new subscription"""
         try:
-            # Convert date from DD-MM-YYYY to YYYY-MM-DD format for database storage
-            start_date_str = subscription_data['start_date']
-            try:
-                # Try to parse as DD-MM-YYYY first
-                start_date = datetime.strptime(start_date_str, '%d-%m-%Y')
-                # Convert to YYYY-MM-DD for database storage
-                subscription_data['start_date'] = start_date.strftime('%Y-%m-%d')
-            except ValueError:
-                # If that fails, assume it's already in YYYY-MM-DD format
-                start_date = datetime.strptime(start_date_str, '%Y-%m-%d')
-            
-            # Calculate end date based on start date and duration
-            end_date = calculate_end_date(start_date, subscription_data['duration'])
-            subscription_data['end_date'] = end_date.strftime('%Y-%m-%d')
-
+            self._prepare_subscription(subscription_data)
             result = self.supabase.table(SUBSCRIPTIONS_TABLE).insert(subscription_data).execute()
-            logger.info(f"Added new subscription for user: {subscription_data.get('plex_username')}")
+            invalidate_subscriptions([subscription_data])
+            logger.info("Added new subscription for user: %s", subscription_data.get('plex_username'))
             return result.data[0]
         except Exception as e:
             logger.error(f"Error adding subscription: {str(e)}", exc_info=True)
             raise
+
+    async def add_subscriptions(self, subscriptions):
+        """Add several subscriptions with a single insert"""
+        if not subscriptions:
+            return []
+        try:
+            rows = [self._prepare_subscription(subscription_data) for subscription_data in subscriptions]
+            result = self.supabase.table(SUBSCRIPTIONS_TABLE).insert(rows).execute()
+            invalidate_subscriptions(rows)
+            logger.info("Added %d subscriptions in one batch", len(rows))
+            return result.data
+        except Exception as e:
+            logger.error("Error adding subscriptions: %s", e, exc_info=True)
+            raise
     
+    @cached(subscription_cache, lambda plex_username: ('plex_username', plex_username))
     async def get_subscription(self, plex_username):
         """Get subscription details for a user"""
         try:
-            result = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+            query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
                 .select("*")\
-                .eq("plex_username", plex_username)\
-                .execute()
+                .eq("plex_username", plex_username)
+            result = await self._execute(query)
             return result.data
         except Exception as e:
             logger.error(f"Error fetching subscription: {str(e)}", exc_info=True)
             raise
+
+    async def get_subscriptions_for_users(self, identifiers, chunk_size=100):
+        """Get subscriptions matching any of the given Plex usernames or emails"""
+        try:
+            identifiers = list(dict.fromkeys(identifiers))
+            rows = {}
+            # Chunk the IN lists so the request URL stays within PostgREST's limits
+            for i in range(0, len(identifiers), chunk_size):
+                chunk = identifiers[i:i + chunk_size]
+                for column in ("plex_username", "email"):
+                    query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+                        .select("*")\
+                        .in_(column, chunk)
+                    result = await self._execute(query)
+                    for row in result.data:
+                        rows[row['id']] = row
+            return list(rows.values())
+        except Exception as e:
+            logger.error("Error fetching subscriptions for users: %s", e, exc_info=True)
+            raise
+
+    @single_flight('db')
     async def get_all_subscriptions(self):
         """Get all subscriptions"""
         try:
-            result = self.supabase.table(SUBSCRIPTIONS_TABLE)\
-                .select("*")\
-                .execute()
+            query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+                .select("*")
+            result = await self._execute(query)
             return result.data
         except Exception as e:
             logger.error(f"Error fetching all subscriptions: {str(e)}", exc_info=True)
             raise
+
+    async def iter_subscriptions(self, page_size=1000, columns="*"):
+        """Yield every subscription, fetched a page at a time in id order"""
+        async for rows in self.iter_subscription_pages(page_size, columns):
+            for row in rows:
+                yield row
+
+    async def iter_subscription_pages(self, page_size=1000, columns="*"):
+        """
+        Yield every subscription as lists of at most page_size rows, in id order.
+        Pages continue after the last id seen instead of using an offset, so late pages
+        cost the database as little as early ones.
+        """
+        last_id = None
+        while True:
+            query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+                .select(columns)\
+                .order("id")\
+                .limit(page_size)
+            if last_id is not None:
+                query = query.gt("id", last_id)
+            start = time.perf_counter()
+            try:
+                with span('db.iter_subscriptions'):
+                    rows = (await self._execute(query)).data
+            except Exception as e:
+                logger.error("Error streaming subscriptions: %s", e, exc_info=True)
+                raise
+            finally:
+                DB_LATENCY.observe(time.perf_counter() - start, method='iter_subscriptions')
+            if rows:
+                yield rows
+            if len(rows) < page_size:
+                return
+            last_id = rows[-1]['id']
+
+    @cached(server_cache, lambda server_name: ('server_name', server_name))
     async def get_plex_server(self, server_name):
         """Get Plex server details"""
         try:
-            result = self.supabase.table(PLEX_SERVERS_TABLE)\
+            query = self.supabase.table(PLEX_SERVERS_TABLE)\
                 .select("*")\
-                .eq("server_name", server_name)\
-                .execute()
+                .eq("server_name", server_name)
+            result = await self._execute(query)
             return result.data[0] if result.data else None
         except Exception as e:
             logger.error(f"Error fetching Plex server: {str(e)}", exc_info=True)
             raise
 
+    @cached(server_cache, lambda: ('all',))
     async def get_all_plex_servers(self):
         """Get all Plex server details"""
         try:
-            result = self.supabase.table(PLEX_SERVERS_TABLE)\
-                .select("*")\
-                .execute()
+            query = self.supabase.table(PLEX_SERVERS_TABLE)\
+                .select("*")
+            result = await self._execute(query)
             return result.data
         except Exception as e:
             logger.error(f"Error fetching all Plex servers: {str(e)}", exc_info=True)
             raise
 
+    @cached(subscription_cache, lambda discord_username: ('discord_username', discord_username))
     async def get_subscription_by_discord(self, discord_username):
         """Get subscription details by Discord username"""
         try:
-            result = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+            query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
                 .select("*")\
-                .eq("discord_username", discord_username)\
-                .execute()
+                .eq("discord_username", discord_username)
+            result = await self._execute(query)
             return result.data
         except Exception as e:
             logger.error(f"Error fetching subscription by Discord username: {str(e)}", exc_info=True)
             raise
 
+    @cached(subscription_cache, lambda discord_user_id: ('discord_user_id', discord_user_id))
+    async def get_subscription_by_discord_id(self, discord_user_id):
+        """Get subscription details by Discord user ID, which survives renames"""
+        try:
+            query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+                .select("*")\
+                .eq("discord_user_id", discord_user_id)
+            result = await self._execute(query)
+            return result.data
+        except Exception as e:
+            logger.error("Error fetching subscription by Discord user ID: %s", e, exc_info=True)
+            raise
+
+    async def set_discord_user_id(self, discord_username, discord_user_id):
+        """Store the Discord user ID on the subscriptions of discord_username that don't have one yet"""
+        try:
+            result = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+                .update({'discord_user_id': discord_user_id})\
+                .eq("discord_username", discord_username)\
+                .is_("discord_user_id", "null")\
+                .execute()
+            invalidate_subscriptions(result.data + [{'discord_username': discord_username}])
+            return len(result.data)
+        except Exception as e:
+            logger.error("Error storing Discord user ID: %s", e, exc_info=True)
+            raise
+
     async def remove_subscription(self, plex_username):
         """Remove a subscription for a user"""
         try:
@@ -129,11 +302,101 @@ class Database:
                 .delete()\
                 .eq("plex_username", plex_username)\
                 .execute()
+            invalidate_subscriptions((result.data or []) + [{'plex_username': plex_username}])
             logger.info(f"Removed subscription for user: {plex_username}")
             return result.data
         except Exception as e:
             logger.error(f"Error removing subscription: {str(e)}", exc_info=True)
             raise
 
+    def _filter_by_status(self, query, status):
+        """Restrict a subscriptions query to 'all', 'active' or 'expired' rows"""
+        today = date.today().isoformat()
+        if status == 'active':
+            return query.gte("end_date", today)
+        if status == 'expired':
+            return query.lt("end_date", today)
+        if status != 'all':
+            raise ValueError(f"Invalid status filter: {status}")
+        return query
+
+    async def extend_subscriptions(self, server_name, days, status='all', dry_run=False):
+        """
+        Move end_date by the given number of days for every matching subscription on a server.
+        Runs as one set-based UPDATE in the database. With dry_run the rows are only counted.
+        Returns the number of affected rows.
+        """
+        try:
+            result = await self._execute(self.supabase.rpc('extend_subscriptions', {
+                'p_server_name': server_name,
+                'p_days': days,
+                'p_status': status,
+                'p_dry_run': dry_run
+            }))
+            if not dry_run:
+                invalidate_subscriptions()
+                logger.info("Extended %d subscriptions on %s by %+d days", result.data, server_name, days)
+            return result.data
+        except Exception as e:
+            logger.error("Error extending subscriptions: %s", e, exc_info=True)
+            raise
+
+    async def get_subscription_stats(self, expiring_days=7):
+        """
+        Subscriber counts per server, subscriptions expiring within expiring_days and the
+        duration and payment method mix, aggregated in the database by subscription_stats().
+        Results are cached for STATS_CACHE_SECONDS.
+        """
+        return await stats_cache.get(expiring_days, self._fetch_subscription_stats, expiring_days)
+
+    async def _fetch_subscription_stats(self, expiring_days):
+        try:
+            query = self.supabase.rpc('subscription_stats', {'p_expiring_days': expiring_days})
+            return (await self._execute(query)).data
+        except Exception as e:
+            logger.error("Error fetching subscription stats: %s", e, exc_info=True)
+            raise
+
+    async def get_due_reminders(self, days):
+        """
+        Subscriptions with a Discord user ID that are due for an expiry reminder at one
+        of the given points (days before end_date) and don't have it logged yet, ordered
+        by Discord user. One indexed query, see due_reminders() in schema.sql.
+        """
+        try:
+            query = self.supabase.rpc('due_reminders', {'p_days': sorted(days)})
+            return (await self._execute(query)).data
+        except Exception as e:
+            logger.error("Error fetching due reminders: %s", e, exc_info=True)
+            raise
+
+    async def log_reminders(self, entries):
+        """Record sent reminders so they are not sent again; entries already logged are skipped"""
+        if not entries:
+            return
+        try:
+            query = self.supabase.table(REMINDER_LOG_TABLE)\
+                .upsert(entries, on_conflict="subscription_id,end_date,days_before", ignore_duplicates=True)
+            await self._execute(query)
+        except Exception as e:
+            logger.error("Error logging reminders: %s", e, exc_info=True)
+            raise
+
+    @single_flight('db')
+    async def get_subscriptions_by_server(self, server_name, status='all', limit=None):
+        """Get subscriptions on a server, optionally filtered by status and limited in size"""
+        try:
+            query = self.supabase.table(SUBSCRIPTIONS_TABLE)\
+                .select("*")\
+                .eq("server_name", server_name)\
+                .order("end_date")
+            query = self._filter_by_status(query, status)
+            if limit is not None:
+                query = query.limit(limit)
+            return (await self._execute(query)).data
+        except Exception as e:
+            logger.error("Error fetching subscriptions by server: %s", e, exc_info=True)
+            raise
+
 # Create a singleton instance
 db = Database()
\ No newline at end of file
@@ -0,0 +1,123 @@
+# Streams the subscriptions table into compressed CSV, JSONL or Parquet files
+import asyncio
+import csv
+import gzip
+import io
+import json
+import logging
+import time
+from datetime import date
+from database.db import db
+
+logger = logging.getLogger(__name__)
+
+EXPORT_COLUMNS = [
+    'id', 'plex_username', 'discord_username', 'discord_user_id', 'email', 'server_name',
+    'duration', 'payment_method', 'payment_id', 'start_date', 'end_date', 'created_at', 'updated_at'
+]
+
+# Stored as dates in Parquet, everything else is kept as text
+DATE_COLUMNS = ('start_date', 'end_date')
+
+class _TextExport:
+    """Gzip-compressed text written straight through to the target file"""
+
+    def __init__(self, fileobj, columns):
+        self.columns = columns
+        # Level 6 compresses about as well as the default of 9 in half the time
+        self._gzip = gzip.GzipFile(fileobj=fileobj, mode='wb', compresslevel=6)
+        self._text = io.TextIOWrapper(self._gzip, encoding='utf-8', newline='')
+
+    def close(self):
+        # Closing the gzip stream writes its trailer but leaves fileobj open
+        self._text.close()
+
+class CsvExport(_TextExport):
+    extension = 'csv.gz'
+
+    def __init__(self, fileobj, columns):
+        super().__init__(fileobj, columns)
+        self._writer = csv.DictWriter(self._text, columns, extrasaction='ignore')
+        self._writer.writeheader()
+
+    def write_page(self, rows):
+        self._writer.writerows(rows)
+
+class JsonlExport(_TextExport):
+    extension = 'jsonl.gz'
+
+    def write_page(self, rows):
+        self._text.write(''.join(
+            json.dumps({column: row.get(column) for column in self.columns}, ensure_ascii=False, default=str) + '\n'
+            for row in rows
+        ))
+
+class ParquetExport:
+    extension = 'parquet'
+
+    def __init__(self, fileobj, columns):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            raise ValueError("Parquet export needs the optional pyarrow package (pip install pyarrow)")
+        self._pa = pyarrow
+        self.columns = columns
+        self._schema = pyarrow.schema([
+            (column, pyarrow.date32() if column in DATE_COLUMNS else pyarrow.string())
+            for column in columns
+        ])
+        # Every page becomes one row group, so only one page is held in memory
+        self._writer = pyarrow.parquet.ParquetWriter(fileobj, self._schema, compression='zstd')
+
+    def write_page(self, rows):
+        pa = self._pa
+        arrays = []
+        for field in self._schema:
+            values = [row.get(field.name) for row in rows]
+            if field.name in DATE_COLUMNS:
+                arrays.append(pa.array(values, pa.string()).cast(pa.date32()))
+            else:
+                arrays.append(pa.array([None if value is None else str(value) for value in values], pa.string()))
+        self._writer.write_table(pa.Table.from_arrays(arrays, schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+
+EXPORT_FORMATS = {
+    'csv': CsvExport,
+    'jsonl': JsonlExport,
+    'parquet': ParquetExport
+}
+
+def export_filename(fmt, day=None):
+    return f"subscriptions-{(day or date.today()).isoformat()}.{EXPORT_FORMATS[fmt].extension}"
+
+async def export_subscriptions(fileobj, fmt='csv', page_size=1000, columns=None, progress=None):
+    """
+    Write every subscription to the binary file fileobj as fmt ('csv' or 'jsonl',
+    gzip-compressed, or 'parquet'). Rows are fetched and written a page at a time,
+    so memory use depends on page_size and not on the size of the table.
+    progress, if given, is awaited with the number of rows written after each page.
+    Returns the number of rows written.
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"Unknown export format '{fmt}', expected one of {', '.join(EXPORT_FORMATS)}")
+    columns = columns or EXPORT_COLUMNS
+    start = time.perf_counter()
+    export = EXPORT_FORMATS[fmt](fileobj, columns)
+    rows_written = 0
+    try:
+        async for rows in db.iter_subscription_pages(page_size, ','.join(columns)):
+            # Serialising and compressing a page is CPU work, keep it off the event loop
+            await asyncio.to_thread(export.write_page, rows)
+            rows_written += len(rows)
+            if progress is not None:
+                await progress(rows_written)
+    finally:
+        await asyncio.to_thread(export.close)
+    logger.info(
+        "Exported %d subscriptions as %s in %.2fs",
+        rows_written, fmt, time.perf_counter() - start
+    )
+    return rows_written
@@ -0,0 +1,127 @@
+# Keeps cached database reads in sync with changes made by other bot instances or the CLI
+#
+# The triggers in schema.sql send a NOTIFY on the cache_invalidation channel for every
+# statement that changes subscriptions or plex_servers. This listens on that channel over
+# a direct Postgres connection and drops the affected cache entries.
+#
+# To watch the notifications of a database, e.g. a local Postgres with schema.sql loaded:
+#     DATABASE_URL=postgresql://postgres@localhost/postgres python -m database.listener
+import asyncio
+import json
+import logging
+from database.db import invalidate_subscriptions, invalidate_plex_servers
+from utils.metrics import CACHE_INVALIDATIONS
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = 'cache_invalidation'
+
+# How often the connection is checked, and the longest wait between reconnects, in seconds
+KEEPALIVE_INTERVAL = 30
+MAX_RECONNECT_DELAY = 60
+
+INVALIDATORS = {
+    'subscriptions': invalidate_subscriptions,
+    'plex_servers': invalidate_plex_servers
+}
+
+def invalidate_all():
+    for invalidate in INVALIDATORS.values():
+        invalidate()
+
+def handle_notification(payload):
+    """Apply one cache_invalidation payload; returns the table it was about"""
+    message = json.loads(payload)
+    table = message.get('table')
+    invalidate = INVALIDATORS.get(table)
+    if invalidate is None:
+        logger.warning("Ignoring cache invalidation for unknown table %s", table)
+        return table
+    invalidate(None if message.get('all') else message.get('keys') or [])
+    CACHE_INVALIDATIONS.inc(table=table)
+    return table
+
+class ChangeListener:
+    """
+    LISTENs for cache_invalidation notifications and reconnects when the connection
+    drops. Notifications sent while it was disconnected are lost, so every cache is
+    flushed whenever the connection is lost and again once it is back.
+    """
+
+    def __init__(self, dsn):
+        self.dsn = dsn
+        self.connected = False
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    def _on_notification(self, connection, pid, channel, payload):
+        try:
+            table = handle_notification(payload)
+            logger.debug("Invalidated cached %s after a change notification: %s", table, payload)
+        except Exception as e:
+            # An unreadable payload may hide any change, so drop everything
+            logger.error("Bad cache invalidation payload %r: %s", payload, e)
+            invalidate_all()
+
+    async def _run(self):
+        import asyncpg
+
+        delay = 1
+        while True:
+            try:
+                connection = await asyncpg.connect(self.dsn)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Could not connect the change listener, retrying in %ss: %s", delay, e)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RECONNECT_DELAY)
+                continue
+
+            delay = 1
+            try:
+                await connection.add_listener(CHANNEL, self._on_notification)
+                invalidate_all()
+                self.connected = True
+                logger.info("Listening for database changes on %s", CHANNEL)
+                while True:
+                    await asyncio.sleep(KEEPALIVE_INTERVAL)
+                    await connection.fetchval('SELECT 1', timeout=10)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning("Change listener connection lost: %s", e)
+            finally:
+                if self.connected:
+                    self.connected = False
+                    invalidate_all()
+                try:
+                    await asyncio.wait_for(connection.close(), 5)
+                except BaseException:
+                    connection.terminate()
+
+async def _watch(dsn):
+    logging.basicConfig(level=logging.DEBUG, format='%(asctime)s %(name)s %(message)s')
+    listener = ChangeListener(dsn)
+    await listener.start()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await listener.stop()
+
+if __name__ == '__main__':
+    from config import DATABASE_URL
+    if not DATABASE_URL:
+        raise SystemExit("Set DATABASE_URL to the Postgres connection string")
+    try:
+        asyncio.run(_watch(DATABASE_URL))
+    except KeyboardInterrupt:
+        pass
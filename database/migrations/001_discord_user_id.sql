@@ -0,0 +1,13 @@
+-- Adds the Discord user ID to subscriptions created before it was stored.
+-- Safe to run more than once. New installs get the column from schema.sql.
+
+ALTER TABLE subscriptions ADD COLUMN IF NOT EXISTS discord_user_id BIGINT;
+
+CREATE INDEX IF NOT EXISTS idx_subscriptions_discord_user_id ON subscriptions(discord_user_id);
+
+-- Rows that stored a mention or a bare ID instead of a username can be filled in here;
+-- the rest are resolved against the Discord guilds by the bot's backfill_discord_ids command
+UPDATE subscriptions
+SET discord_user_id = regexp_replace(discord_username, '[^0-9]', '', 'g')::BIGINT
+WHERE discord_user_id IS NULL
+  AND discord_username ~ '^(<@!?[0-9]+>|[0-9]{15,20})$';
@@ -0,0 +1,41 @@
+-- Adds the subscription_stats function used by /stats. Safe to run more than once.
+
+-- Aggregated subscription numbers for /stats, so the table is never shipped to the bot.
+-- "Active" means end_date today or later; "expiring" means ending within p_expiring_days.
+CREATE OR REPLACE FUNCTION subscription_stats(p_expiring_days INTEGER DEFAULT 7)
+RETURNS JSON AS $$
+    SELECT json_build_object(
+        'servers', COALESCE((
+            SELECT json_agg(per_server ORDER BY per_server.server_name)
+            FROM (
+                SELECT server_name,
+                       COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE end_date >= CURRENT_DATE) AS active,
+                       COUNT(*) FILTER (WHERE end_date < CURRENT_DATE) AS expired,
+                       COUNT(*) FILTER (WHERE end_date >= CURRENT_DATE
+                                          AND end_date <= CURRENT_DATE + p_expiring_days) AS expiring
+                FROM subscriptions
+                GROUP BY server_name
+            ) per_server
+        ), '[]'::json),
+        'durations', COALESCE((
+            SELECT json_object_agg(duration, count)
+            FROM (
+                SELECT duration, COUNT(*) AS count
+                FROM subscriptions
+                WHERE end_date >= CURRENT_DATE
+                GROUP BY duration
+            ) per_duration
+        ), '{}'::json),
+        'payment_methods', COALESCE((
+            SELECT json_object_agg(payment_method, count)
+            FROM (
+                SELECT COALESCE(payment_method, 'unknown') AS payment_method, COUNT(*) AS count
+                FROM subscriptions
+                WHERE end_date >= CURRENT_DATE
+                GROUP BY 1
+            ) per_payment_method
+        ), '{}'::json),
+        'expiring_days', p_expiring_days
+    );
+$$ LANGUAGE sql STABLE;
@@ -0,0 +1,50 @@
+-- Adds the reminder_log table and due_reminders function used for expiry reminder DMs.
+-- Safe to run more than once.
+
+-- Expiry reminders that were already sent (or could not be delivered), so restarts
+-- and later runs don't repeat them. end_date is part of the key: a renewed
+-- subscription gets its reminders again.
+CREATE TABLE IF NOT EXISTS reminder_log (
+    subscription_id UUID NOT NULL REFERENCES subscriptions(id) ON DELETE CASCADE,
+    end_date DATE NOT NULL,
+    days_before INTEGER NOT NULL,
+    discord_user_id BIGINT NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    sent_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subscription_id, end_date, days_before)
+);
+
+-- Only subscriptions with a Discord user ID can be reminded
+CREATE INDEX IF NOT EXISTS idx_subscriptions_reminder_end_date
+    ON subscriptions(end_date) WHERE discord_user_id IS NOT NULL;
+
+-- Reminders that are due and not logged yet. p_days are the reminder points in days
+-- before end_date, e.g. '{7,2,0}'. A subscription is due for the closest point at or
+-- above its remaining days, so a reminder missed while the bot was offline goes out late
+-- instead of not at all.
+CREATE OR REPLACE FUNCTION due_reminders(p_days INTEGER[])
+RETURNS TABLE (
+    subscription_id UUID,
+    discord_user_id BIGINT,
+    plex_username VARCHAR,
+    server_name VARCHAR,
+    end_date DATE,
+    days_before INTEGER
+) AS $$
+    SELECT due.id, due.discord_user_id, due.plex_username, due.server_name, due.end_date, due.days_before
+    FROM (
+        SELECT s.id, s.discord_user_id, s.plex_username, s.server_name, s.end_date,
+               (SELECT MIN(d) FROM unnest(p_days) AS d WHERE d >= s.end_date - CURRENT_DATE) AS days_before
+        FROM subscriptions s
+        WHERE s.discord_user_id IS NOT NULL
+          AND s.end_date >= CURRENT_DATE
+          AND s.end_date <= CURRENT_DATE + (SELECT MAX(d) FROM unnest(p_days) AS d)
+    ) due
+    WHERE NOT EXISTS (
+        SELECT 1 FROM reminder_log r
+        WHERE r.subscription_id = due.id
+          AND r.end_date = due.end_date
+          AND r.days_before = due.days_before
+    )
+    ORDER BY due.discord_user_id, due.end_date;
+$$ LANGUAGE sql STABLE;
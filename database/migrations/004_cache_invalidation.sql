@@ -0,0 +1,124 @@
+-- Adds the cache_invalidation notifications the bot's change listener subscribes to.
+-- Safe to run more than once.
+
+-- Change notifications for the bot's in-process caches. Every statement that changes
+-- subscriptions or plex_servers sends one NOTIFY on the cache_invalidation channel with
+-- the lookup keys of the changed rows, e.g.
+--   {"table": "subscriptions", "keys": [{"plex_username": "john", ...}]}
+-- NOTIFY payloads must stay under 8000 bytes, so statements that change many rows
+-- send {"table": ..., "all": true} instead. Notifications are only delivered on commit.
+CREATE OR REPLACE FUNCTION notify_cache_invalidation(p_table TEXT, p_keys JSONB)
+RETURNS VOID AS $$
+DECLARE
+    payload TEXT;
+BEGIN
+    payload := json_build_object('table', p_table, 'keys', COALESCE(p_keys, '[]'::jsonb))::text;
+    IF octet_length(payload) > 7500 THEN
+        payload := json_build_object('table', p_table, 'all', true)::text;
+    END IF;
+    PERFORM pg_notify('cache_invalidation', payload);
+END;
+$$ LANGUAGE plpgsql;
+
+-- old_rows and new_rows are the transition tables of the statement-level triggers below
+CREATE OR REPLACE FUNCTION notify_subscriptions_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_keys JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object(
+                   'plex_username', plex_username,
+                   'discord_username', discord_username,
+                   'discord_user_id', discord_user_id))
+        INTO changed_keys FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object(
+                   'plex_username', plex_username,
+                   'discord_username', discord_username,
+                   'discord_user_id', discord_user_id))
+        INTO changed_keys FROM old_rows;
+    ELSE
+        SELECT jsonb_agg(DISTINCT jsonb_build_object(
+                   'plex_username', plex_username,
+                   'discord_username', discord_username,
+                   'discord_user_id', discord_user_id))
+        INTO changed_keys
+        FROM (
+            SELECT plex_username, discord_username, discord_user_id FROM old_rows
+            UNION ALL
+            SELECT plex_username, discord_username, discord_user_id FROM new_rows
+        ) changed;
+    END IF;
+    PERFORM notify_cache_invalidation('subscriptions', changed_keys);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_plex_servers_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_keys JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object('server_name', server_name))
+        INTO changed_keys FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object('server_name', server_name))
+        INTO changed_keys FROM old_rows;
+    ELSE
+        SELECT jsonb_agg(DISTINCT jsonb_build_object('server_name', server_name))
+        INTO changed_keys
+        FROM (
+            SELECT server_name FROM old_rows
+            UNION ALL
+            SELECT server_name FROM new_rows
+        ) changed;
+    END IF;
+    PERFORM notify_cache_invalidation('plex_servers', changed_keys);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS subscriptions_notify_insert ON subscriptions;
+CREATE TRIGGER subscriptions_notify_insert
+    AFTER INSERT ON subscriptions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_subscriptions_changed();
+
+DROP TRIGGER IF EXISTS subscriptions_notify_update ON subscriptions;
+CREATE TRIGGER subscriptions_notify_update
+    AFTER UPDATE ON subscriptions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_subscriptions_changed();
+
+DROP TRIGGER IF EXISTS subscriptions_notify_delete ON subscriptions;
+CREATE TRIGGER subscriptions_notify_delete
+    AFTER DELETE ON subscriptions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_subscriptions_changed();
+
+DROP TRIGGER IF EXISTS plex_servers_notify_insert ON plex_servers;
+CREATE TRIGGER plex_servers_notify_insert
+    AFTER INSERT ON plex_servers
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_plex_servers_changed();
+
+DROP TRIGGER IF EXISTS plex_servers_notify_update ON plex_servers;
+CREATE TRIGGER plex_servers_notify_update
+    AFTER UPDATE ON plex_servers
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_plex_servers_changed();
+
+DROP TRIGGER IF EXISTS plex_servers_notify_delete ON plex_servers;
+CREATE TRIGGER plex_servers_notify_delete
+    AFTER DELETE ON plex_servers
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_plex_servers_changed();
@@ -0,0 +1,39 @@
+-- Adds the extend_subscriptions function used by /renew_bulk. Safe to run more than once.
+
+-- Shift end_date for every matching subscription on a server in a single UPDATE.
+-- p_status is 'all', 'active' (end_date today or later) or 'expired' (end_date before today).
+-- With p_dry_run the matching rows are only counted. Returns the number of rows affected.
+CREATE OR REPLACE FUNCTION extend_subscriptions(
+    p_server_name VARCHAR,
+    p_days INTEGER,
+    p_status VARCHAR DEFAULT 'all',
+    p_dry_run BOOLEAN DEFAULT FALSE
+)
+RETURNS INTEGER AS $$
+DECLARE
+    affected INTEGER;
+BEGIN
+    IF p_status NOT IN ('all', 'active', 'expired') THEN
+        RAISE EXCEPTION 'Invalid status filter: %', p_status;
+    END IF;
+
+    IF p_dry_run THEN
+        SELECT COUNT(*) INTO affected
+        FROM subscriptions
+        WHERE server_name = p_server_name
+          AND (p_status = 'all'
+               OR (p_status = 'active' AND end_date >= CURRENT_DATE)
+               OR (p_status = 'expired' AND end_date < CURRENT_DATE));
+    ELSE
+        UPDATE subscriptions
+        SET end_date = end_date + p_days
+        WHERE server_name = p_server_name
+          AND (p_status = 'all'
+               OR (p_status = 'active' AND end_date >= CURRENT_DATE)
+               OR (p_status = 'expired' AND end_date < CURRENT_DATE));
+        GET DIAGNOSTICS affected = ROW_COUNT;
+    END IF;
+
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
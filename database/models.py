@@ -15,6 +15,7 @@ class Subscription:
     payment_id: str
     start_date: date
     end_date: Optional[date]
+    discord_user_id: Optional[int] = None
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
 
@@ -31,6 +32,7 @@ class Subscription:
             payment_id=data.get('payment_id'),
             start_date=datetime.strptime(data.get('start_date'), '%Y-%m-%d').date(),
             end_date=datetime.strptime(data.get('end_date'), '%Y-%m-%d').date() if data.get('end_date') else None,
+            discord_user_id=int(data['discord_user_id']) if data.get('discord_user_id') else None,
             created_at=datetime.fromisoformat(data.get('created_at')) if data.get('created_at') else None,
             updated_at=datetime.fromisoformat(data.get('updated_at')) if data.get('updated_at') else None
         )
@@ -16,6 +16,7 @@ CREATE TABLE IF NOT EXISTS subscriptions (
     id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
     plex_username VARCHAR(255) NOT NULL,
     discord_username VARCHAR(255),
+    discord_user_id BIGINT,
     email VARCHAR(255),
     server_name VARCHAR(255) NOT NULL,
     duration VARCHAR(50) NOT NULL,
@@ -31,6 +32,7 @@ CREATE TABLE IF NOT EXISTS subscriptions (
 -- Create indexes for faster lookups
 CREATE INDEX IF NOT EXISTS idx_subscriptions_plex_username ON subscriptions(plex_username);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_discord_username ON subscriptions(discord_username);
+CREATE INDEX IF NOT EXISTS idx_subscriptions_discord_user_id ON subscriptions(discord_user_id);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_email ON subscriptions(email);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_start_date ON subscriptions(start_date);
 CREATE INDEX IF NOT EXISTS idx_subscriptions_end_date ON subscriptions(end_date);
@@ -53,4 +55,252 @@ CREATE TRIGGER update_plex_servers_updated_at
 CREATE TRIGGER update_subscriptions_updated_at
     BEFORE UPDATE ON subscriptions
     FOR EACH ROW
-    EXECUTE FUNCTION update_updated_at_column();
\ No newline at end of file
+    EXECUTE FUNCTION update_updated_at_column();
+
+-- Shift end_date for every matching subscription on a server in a single UPDATE.
+-- p_status is 'all', 'active' (end_date today or later) or 'expired' (end_date before today).
+-- With p_dry_run the matching rows are only counted. Returns the number of rows affected.
+CREATE OR REPLACE FUNCTION extend_subscriptions(
+    p_server_name VARCHAR,
+    p_days INTEGER,
+    p_status VARCHAR DEFAULT 'all',
+    p_dry_run BOOLEAN DEFAULT FALSE
+)
+RETURNS INTEGER AS $$
+DECLARE
+    affected INTEGER;
+BEGIN
+    IF p_status NOT IN ('all', 'active', 'expired') THEN
+        RAISE EXCEPTION 'Invalid status filter: %', p_status;
+    END IF;
+
+    IF p_dry_run THEN
+        SELECT COUNT(*) INTO affected
+        FROM subscriptions
+        WHERE server_name = p_server_name
+          AND (p_status = 'all'
+               OR (p_status = 'active' AND end_date >= CURRENT_DATE)
+               OR (p_status = 'expired' AND end_date < CURRENT_DATE));
+    ELSE
+        UPDATE subscriptions
+        SET end_date = end_date + p_days
+        WHERE server_name = p_server_name
+          AND (p_status = 'all'
+               OR (p_status = 'active' AND end_date >= CURRENT_DATE)
+               OR (p_status = 'expired' AND end_date < CURRENT_DATE));
+        GET DIAGNOSTICS affected = ROW_COUNT;
+    END IF;
+
+    RETURN affected;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Aggregated subscription numbers for /stats, so the table is never shipped to the bot.
+-- "Active" means end_date today or later; "expiring" means ending within p_expiring_days.
+CREATE OR REPLACE FUNCTION subscription_stats(p_expiring_days INTEGER DEFAULT 7)
+RETURNS JSON AS $$
+    SELECT json_build_object(
+        'servers', COALESCE((
+            SELECT json_agg(per_server ORDER BY per_server.server_name)
+            FROM (
+                SELECT server_name,
+                       COUNT(*) AS total,
+                       COUNT(*) FILTER (WHERE end_date >= CURRENT_DATE) AS active,
+                       COUNT(*) FILTER (WHERE end_date < CURRENT_DATE) AS expired,
+                       COUNT(*) FILTER (WHERE end_date >= CURRENT_DATE
+                                          AND end_date <= CURRENT_DATE + p_expiring_days) AS expiring
+                FROM subscriptions
+                GROUP BY server_name
+            ) per_server
+        ), '[]'::json),
+        'durations', COALESCE((
+            SELECT json_object_agg(duration, count)
+            FROM (
+                SELECT duration, COUNT(*) AS count
+                FROM subscriptions
+                WHERE end_date >= CURRENT_DATE
+                GROUP BY duration
+            ) per_duration
+        ), '{}'::json),
+        'payment_methods', COALESCE((
+            SELECT json_object_agg(payment_method, count)
+            FROM (
+                SELECT COALESCE(payment_method, 'unknown') AS payment_method, COUNT(*) AS count
+                FROM subscriptions
+                WHERE end_date >= CURRENT_DATE
+                GROUP BY 1
+            ) per_payment_method
+        ), '{}'::json),
+        'expiring_days', p_expiring_days
+    );
+$$ LANGUAGE sql STABLE;
+
+-- Expiry reminders that were already sent (or could not be delivered), so restarts
+-- and later runs don't repeat them. end_date is part of the key: a renewed
+-- subscription gets its reminders again.
+CREATE TABLE IF NOT EXISTS reminder_log (
+    subscription_id UUID NOT NULL REFERENCES subscriptions(id) ON DELETE CASCADE,
+    end_date DATE NOT NULL,
+    days_before INTEGER NOT NULL,
+    discord_user_id BIGINT NOT NULL,
+    status VARCHAR(20) NOT NULL,
+    sent_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    PRIMARY KEY (subscription_id, end_date, days_before)
+);
+
+-- Only subscriptions with a Discord user ID can be reminded
+CREATE INDEX IF NOT EXISTS idx_subscriptions_reminder_end_date
+    ON subscriptions(end_date) WHERE discord_user_id IS NOT NULL;
+
+-- Reminders that are due and not logged yet. p_days are the reminder points in days
+-- before end_date, e.g. '{7,2,0}'. A subscription is due for the closest point at or
+-- above its remaining days, so a reminder missed while the bot was offline goes out late
+-- instead of not at all.
+CREATE OR REPLACE FUNCTION due_reminders(p_days INTEGER[])
+RETURNS TABLE (
+    subscription_id UUID,
+    discord_user_id BIGINT,
+    plex_username VARCHAR,
+    server_name VARCHAR,
+    end_date DATE,
+    days_before INTEGER
+) AS $$
+    SELECT due.id, due.discord_user_id, due.plex_username, due.server_name, due.end_date, due.days_before
+    FROM (
+        SELECT s.id, s.discord_user_id, s.plex_username, s.server_name, s.end_date,
+               (SELECT MIN(d) FROM unnest(p_days) AS d WHERE d >= s.end_date - CURRENT_DATE) AS days_before
+        FROM subscriptions s
+        WHERE s.discord_user_id IS NOT NULL
+          AND s.end_date >= CURRENT_DATE
+          AND s.end_date <= CURRENT_DATE + (SELECT MAX(d) FROM unnest(p_days) AS d)
+    ) due
+    WHERE NOT EXISTS (
+        SELECT 1 FROM reminder_log r
+        WHERE r.subscription_id = due.id
+          AND r.end_date = due.end_date
+          AND r.days_before = due.days_before
+    )
+    ORDER BY due.discord_user_id, due.end_date;
+$$ LANGUAGE sql STABLE;
+
+-- Change notifications for the bot's in-process caches. Every statement that changes
+-- subscriptions or plex_servers sends one NOTIFY on the cache_invalidation channel with
+-- the lookup keys of the changed rows, e.g.
+--   {"table": "subscriptions", "keys": [{"plex_username": "john", ...}]}
+-- NOTIFY payloads must stay under 8000 bytes, so statements that change many rows
+-- send {"table": ..., "all": true} instead. Notifications are only delivered on commit.
+CREATE OR REPLACE FUNCTION notify_cache_invalidation(p_table TEXT, p_keys JSONB)
+RETURNS VOID AS $$
+DECLARE
+    payload TEXT;
+BEGIN
+    payload := json_build_object('table', p_table, 'keys', COALESCE(p_keys, '[]'::jsonb))::text;
+    IF octet_length(payload) > 7500 THEN
+        payload := json_build_object('table', p_table, 'all', true)::text;
+    END IF;
+    PERFORM pg_notify('cache_invalidation', payload);
+END;
+$$ LANGUAGE plpgsql;
+
+-- old_rows and new_rows are the transition tables of the statement-level triggers below
+CREATE OR REPLACE FUNCTION notify_subscriptions_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_keys JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object(
+                   'plex_username', plex_username,
+                   'discord_username', discord_username,
+                   'discord_user_id', discord_user_id))
+        INTO changed_keys FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object(
+                   'plex_username', plex_username,
+                   'discord_username', discord_username,
+                   'discord_user_id', discord_user_id))
+        INTO changed_keys FROM old_rows;
+    ELSE
+        SELECT jsonb_agg(DISTINCT jsonb_build_object(
+                   'plex_username', plex_username,
+                   'discord_username', discord_username,
+                   'discord_user_id', discord_user_id))
+        INTO changed_keys
+        FROM (
+            SELECT plex_username, discord_username, discord_user_id FROM old_rows
+            UNION ALL
+            SELECT plex_username, discord_username, discord_user_id FROM new_rows
+        ) changed;
+    END IF;
+    PERFORM notify_cache_invalidation('subscriptions', changed_keys);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION notify_plex_servers_changed()
+RETURNS TRIGGER AS $$
+DECLARE
+    changed_keys JSONB;
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object('server_name', server_name))
+        INTO changed_keys FROM new_rows;
+    ELSIF TG_OP = 'DELETE' THEN
+        SELECT jsonb_agg(DISTINCT jsonb_build_object('server_name', server_name))
+        INTO changed_keys FROM old_rows;
+    ELSE
+        SELECT jsonb_agg(DISTINCT jsonb_build_object('server_name', server_name))
+        INTO changed_keys
+        FROM (
+            SELECT server_name FROM old_rows
+            UNION ALL
+            SELECT server_name FROM new_rows
+        ) changed;
+    END IF;
+    PERFORM notify_cache_invalidation('plex_servers', changed_keys);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Transition tables need one trigger per event
+DROP TRIGGER IF EXISTS subscriptions_notify_insert ON subscriptions;
+CREATE TRIGGER subscriptions_notify_insert
+    AFTER INSERT ON subscriptions
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_subscriptions_changed();
+
+DROP TRIGGER IF EXISTS subscriptions_notify_update ON subscriptions;
+CREATE TRIGGER subscriptions_notify_update
+    AFTER UPDATE ON subscriptions
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_subscriptions_changed();
+
+DROP TRIGGER IF EXISTS subscriptions_notify_delete ON subscriptions;
+CREATE TRIGGER subscriptions_notify_delete
+    AFTER DELETE ON subscriptions
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_subscriptions_changed();
+
+DROP TRIGGER IF EXISTS plex_servers_notify_insert ON plex_servers;
+CREATE TRIGGER plex_servers_notify_insert
+    AFTER INSERT ON plex_servers
+    REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_plex_servers_changed();
+
+DROP TRIGGER IF EXISTS plex_servers_notify_update ON plex_servers;
+CREATE TRIGGER plex_servers_notify_update
+    AFTER UPDATE ON plex_servers
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_plex_servers_changed();
+
+DROP TRIGGER IF EXISTS plex_servers_notify_delete ON plex_servers;
+CREATE TRIGGER plex_servers_notify_delete
+    AFTER DELETE ON plex_servers
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT
+    EXECUTE FUNCTION notify_plex_servers_changed();
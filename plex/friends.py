@@ -0,0 +1,87 @@
+# Plex friends lists as compact tuples, optionally parsed in a process pool
+import atexit
+import concurrent.futures
+import logging
+import multiprocessing
+import threading
+import xml.etree.ElementTree as ElementTree
+from collections import namedtuple
+from config import PLEX_FRIENDS_PARSER, PLEX_PARSER_PROCESSES
+
+logger = logging.getLogger(__name__)
+
+# What the bot needs of a friend; server_names are the servers shared with them
+Friend = namedtuple('Friend', ['username', 'email', 'server_names'])
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def from_users(users):
+    """Friend tuples from plexapi MyPlexUser objects"""
+    friends = []
+    for user in users:
+        try:
+            server_names = tuple(server.name for server in user.servers)
+        except Exception as e:
+            logger.warning("Could not read shared servers for %s: %s", user.username, e)
+            server_names = ()
+        friends.append(Friend(user.username, user.email, server_names))
+    return friends
+
+def parse_users_xml(data):
+    """
+    Friend tuples from the XML of plex.tv's users list, read the way plexapi's
+    MyPlexUser reads it. Runs in the worker processes, so it only needs the standard library.
+    """
+    return [
+        Friend(
+            elem.attrib.get('username', ''),
+            elem.attrib.get('email'),
+            tuple(server.attrib.get('name') for server in elem.iter('Server'))
+        )
+        for elem in ElementTree.fromstring(data).iter('User')
+    ]
+
+def _users_xml(account):
+    """The request account.users() makes, returning the XML unparsed"""
+    from plexapi.exceptions import Unauthorized
+    from plexapi.myplex import MyPlexUser
+    response = account._session.get(MyPlexUser.key, headers=account._headers(), timeout=account._timeout)
+    if response.status_code == 401:
+        raise Unauthorized(f"(401) unauthorized; {response.url}")
+    response.raise_for_status()
+    return response.content
+
+def _process_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # Spawned, not forked: the bot process has threads that may hold locks
+            _pool = concurrent.futures.ProcessPoolExecutor(
+                max_workers=PLEX_PARSER_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            atexit.register(shutdown)
+    return _pool
+
+def shutdown():
+    """Stop the worker processes, if they were started"""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=False, cancel_futures=True)
+            _pool = None
+
+def fetch_friends(account, parser=None):
+    """
+    The account's friends as Friend tuples. With the 'process' parser (PLEX_FRIENDS_PARSER)
+    the XML is downloaded here and parsed in a worker process, so thousands of friends
+    don't hold the GIL while commands are being handled. Blocks, call it from a worker thread.
+    """
+    parser = parser or PLEX_FRIENDS_PARSER
+    if parser == 'process':
+        data = _users_xml(account)
+        return _process_pool().submit(parse_users_xml, data).result()
+    if parser != 'thread':
+        raise ValueError(f"Invalid friends list parser: {parser}")
+    return from_users(account.users())
@@ -0,0 +1,160 @@
+# Background health checks for the registered Plex servers, with adaptive timeouts
+import asyncio
+import collections
+import logging
+import math
+import time
+from config import (
+    PLEX_HEALTH_WINDOW,
+    PLEX_HEALTH_FAILURE_THRESHOLD,
+    PLEX_HEALTH_PROBE_TIMEOUT,
+    PLEX_TIMEOUT_MIN,
+    PLEX_TIMEOUT_MAX,
+    PLEX_TIMEOUT_MULTIPLIER
+)
+from database.db import db
+from utils.metrics import PLEX_PROBE_LATENCY, PLEX_SERVER_UP, PLEX_SERVER_TIMEOUT
+
+logger = logging.getLogger(__name__)
+
+class ServerDegradedError(Exception):
+    """Raised instead of connecting to a server that keeps failing its health checks"""
+
+def _key(plex_url):
+    return plex_url.strip().rstrip('/')
+
+class ServerHealth:
+    """Rolling probe latencies and failure count of one server"""
+
+    def __init__(self, server_name, plex_url, window=PLEX_HEALTH_WINDOW):
+        self.server_name = server_name
+        self.plex_url = plex_url
+        self.latencies = collections.deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_checked = None
+
+    @property
+    def degraded(self):
+        return self.consecutive_failures >= PLEX_HEALTH_FAILURE_THRESHOLD
+
+    def percentile(self, fraction):
+        """Nearest-rank percentile of the recent latencies in seconds, None without samples"""
+        if not self.latencies:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[max(1, math.ceil(fraction * len(ordered))) - 1]
+
+    @property
+    def timeout(self):
+        """
+        Timeout for calls to this server: a multiple of its p99 latency, within
+        PLEX_TIMEOUT_MIN..PLEX_TIMEOUT_MAX. Unprobed servers get the maximum.
+        """
+        p99 = self.percentile(0.99)
+        if p99 is None:
+            return PLEX_TIMEOUT_MAX
+        return min(PLEX_TIMEOUT_MAX, max(PLEX_TIMEOUT_MIN, p99 * PLEX_TIMEOUT_MULTIPLIER))
+
+    def record_success(self, latency):
+        if self.degraded:
+            logger.info("Plex server %s is reachable again", self.server_name)
+        self.latencies.append(latency)
+        self.consecutive_failures = 0
+        self.last_error = None
+        self.last_checked = time.time()
+
+    def record_failure(self, error):
+        self.consecutive_failures += 1
+        self.last_error = str(error) or error.__class__.__name__
+        self.last_checked = time.time()
+        if self.consecutive_failures == PLEX_HEALTH_FAILURE_THRESHOLD:
+            logger.warning(
+                "Plex server %s marked as degraded after %d failed health checks: %s",
+                self.server_name, self.consecutive_failures, self.last_error
+            )
+
+class HealthMonitor:
+    """
+    Probes every server in plex_servers on an interval. Servers that failed
+    PLEX_HEALTH_FAILURE_THRESHOLD probes in a row are degraded: plex_manager fails
+    calls to them immediately instead of waiting for a connection timeout, until
+    a probe succeeds again.
+    """
+
+    def __init__(self):
+        self.servers = {}
+        self._task = None
+
+    async def start(self, interval):
+        self._task = asyncio.create_task(self._run(interval))
+        logger.info("Started Plex health checks every %ss", interval)
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, interval):
+        while True:
+            try:
+                await self.probe_all()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Error probing Plex servers: %s", e, exc_info=True)
+            await asyncio.sleep(interval)
+
+    async def probe_all(self):
+        """Probe every registered server once, concurrently"""
+        import httpx
+
+        servers = await db.get_all_plex_servers()
+        known = {_key(server['plex_url']) for server in servers}
+        # Forget servers that were removed from the table
+        for key in [key for key in self.servers if key not in known]:
+            del self.servers[key]
+        async with httpx.AsyncClient() as client:
+            await asyncio.gather(*(self._probe(client, server) for server in servers))
+
+    async def _probe(self, client, server):
+        key = _key(server['plex_url'])
+        health = self.servers.get(key)
+        if health is None:
+            health = self.servers[key] = ServerHealth(server['server_name'], key)
+        start = time.perf_counter()
+        try:
+            # /identity is the lightest endpoint a Plex Media Server serves
+            response = await client.get(
+                f"{key}/identity",
+                headers={'X-Plex-Token': server['plex_token'], 'Accept': 'application/json'},
+                timeout=PLEX_HEALTH_PROBE_TIMEOUT
+            )
+            response.raise_for_status()
+        except Exception as e:
+            health.record_failure(e)
+            logger.debug("Health check of %s failed: %s", health.server_name, e)
+        else:
+            latency = time.perf_counter() - start
+            health.record_success(latency)
+            PLEX_PROBE_LATENCY.observe(latency, server=health.server_name)
+        PLEX_SERVER_UP.set(0 if health.degraded else 1, server=health.server_name)
+        PLEX_SERVER_TIMEOUT.set(health.timeout, server=health.server_name)
+
+    def timeout_for(self, plex_url):
+        """Adaptive timeout for a server, or None (plexapi's default) if it was never probed"""
+        health = self.servers.get(_key(plex_url))
+        return health.timeout if health is not None else None
+
+    def check(self, plex_url):
+        """Raise ServerDegradedError if the server is degraded"""
+        health = self.servers.get(_key(plex_url))
+        if health is not None and health.degraded:
+            raise ServerDegradedError(
+                f"Plex server {health.server_name} is unreachable "
+                f"({health.consecutive_failures} failed health checks, last error: {health.last_error})"
+            )
+
+# Create a singleton instance; probing starts from the bot's setup_hook
+health_monitor = HealthMonitor()
@@ -0,0 +1,150 @@
+# Imports the users Plex servers are shared with into the subscriptions table
+import asyncio
+import logging
+import time
+from datetime import datetime
+from database.db import db
+from plex.plex_manager import get_all_users_from_server
+
+logger = logging.getLogger(__name__)
+
+class ServerImport:
+    """What the import found on one server"""
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.imported = 0
+        self.skipped = 0
+        self.no_access = 0
+        self.error = None
+        self.duration = None
+
+    def to_dict(self):
+        return {
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'no_access': self.no_access,
+            'error': self.error,
+            'duration_seconds': round(self.duration or 0, 3)
+        }
+
+class ImportResult:
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.servers = {}
+        self.duration = None
+
+    @property
+    def imported(self):
+        return sum(server.imported for server in self.servers.values())
+
+    @property
+    def skipped(self):
+        return sum(server.skipped for server in self.servers.values())
+
+    @property
+    def no_access(self):
+        return sum(server.no_access for server in self.servers.values())
+
+    @property
+    def errors(self):
+        return [
+            f"Error processing server {server.server_name}: {server.error}"
+            for server in self.servers.values() if server.error
+        ]
+
+    def to_dict(self):
+        return {
+            'dry_run': self.dry_run,
+            'imported': self.imported,
+            'skipped': self.skipped,
+            'no_access': self.no_access,
+            'errors': self.errors,
+            'duration_seconds': round(self.duration or 0, 3),
+            'servers': {name: server.to_dict() for name, server in self.servers.items()}
+        }
+
+def _new_subscriptions(server_name, users, existing, start_date):
+    """Rows for the shared users that have no subscription on server_name yet"""
+    by_identifier = {}
+    for subscription in existing:
+        for identifier in (subscription.get('plex_username'), subscription.get('email')):
+            if identifier:
+                by_identifier.setdefault(identifier.lower(), []).append(subscription)
+
+    rows, skipped = [], 0
+    for user in users:
+        subscriptions = [
+            subscription
+            for identifier in (user['username'], user['email']) if identifier
+            for subscription in by_identifier.get(identifier.lower(), [])
+        ]
+        if any(subscription['server_name'] == server_name for subscription in subscriptions):
+            skipped += 1
+            logger.debug("Skipped existing user: %s (%s) on server: %s", user['username'], user['email'], server_name)
+            continue
+        row = {
+            'plex_username': user['username'],
+            'email': user['email'],
+            'server_name': server_name,
+            'duration': '1_month',
+            'start_date': start_date
+        }
+        # Plex doesn't know the Discord user; carry it over from the
+        # user's subscriptions on other servers when there are any
+        known = next((subscription for subscription in subscriptions if subscription.get('discord_user_id')), None)
+        if known:
+            row['discord_user_id'] = known['discord_user_id']
+            row['discord_username'] = known.get('discord_username')
+        rows.append(row)
+    return rows, skipped
+
+async def import_users(concurrency=3, dry_run=False, progress=None):
+    """
+    Add a one-month subscription for every user a Plex server's libraries are shared
+    with who has no subscription on that server yet. Servers are imported concurrently,
+    at most concurrency at a time; each one costs a friends list fetch, one batched
+    lookup of the existing subscriptions and one insert. With dry_run nothing is saved.
+    progress, if given, is awaited with each ServerImport as soon as it is finished.
+    """
+    start = time.perf_counter()
+    result = ImportResult(dry_run)
+    servers = await db.get_all_plex_servers()
+    if not servers:
+        raise ValueError("No Plex servers found in database")
+    start_date = datetime.now().strftime('%Y-%m-%d')
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def import_server(server):
+        server_result = result.servers[server['server_name']] = ServerImport(server['server_name'])
+        server_start = time.perf_counter()
+        async with semaphore:
+            try:
+                users = await asyncio.to_thread(get_all_users_from_server, server['plex_url'], server['plex_token'])
+                shared = [user for user in users if user.get('library_access', False)]
+                server_result.no_access = len(users) - len(shared)
+
+                # One lookup for every shared user instead of two queries per user
+                existing = await db.get_subscriptions_for_users([
+                    identifier for user in shared for identifier in (user['username'], user['email']) if identifier
+                ])
+                rows, server_result.skipped = _new_subscriptions(server['server_name'], shared, existing, start_date)
+                if rows and not dry_run:
+                    await db.add_subscriptions(rows)
+                server_result.imported = len(rows)
+            except Exception as e:
+                server_result.error = str(e)
+                logger.error("Error importing users from %s: %s", server['server_name'], e, exc_info=True)
+        server_result.duration = time.perf_counter() - server_start
+        if progress is not None:
+            await progress(server_result)
+
+    await asyncio.gather(*(import_server(server) for server in servers))
+
+    result.duration = time.perf_counter() - start
+    logger.info(
+        "Import %s in %.2fs: %d imported, %d skipped, %d without access, %d errors",
+        "checked" if dry_run else "finished", result.duration,
+        result.imported, result.skipped, result.no_access, len(result.errors)
+    )
+    return result
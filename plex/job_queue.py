@@ -0,0 +1,253 @@
+# Durable local job queue for Plex invite/remove operations
+import asyncio
+import json
+import logging
+import random
+import sqlite3
+import threading
+import time
+from config import JOB_QUEUE_PATH, JOB_QUEUE_MAX_ATTEMPTS
+from utils.tracing import start_trace, finish_trace
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+# Finished jobs are kept this long (in seconds) before they are purged
+FINISHED_JOB_RETENTION = 7 * 24 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    idempotency_key TEXT,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_run_at REAL NOT NULL,
+    last_error TEXT,
+    result TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+-- Only one unfinished job may exist per idempotency key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_jobs_active_key
+    ON jobs(idempotency_key) WHERE status IN ('pending', 'running');
+CREATE INDEX IF NOT EXISTS idx_jobs_status_next_run ON jobs(status, next_run_at);
+"""
+
+class PermanentJobError(Exception):
+    """Raised by a job handler when retrying cannot succeed"""
+
+class JobQueue:
+    """
+    SQLite-backed queue processed by a pool of asyncio workers.
+
+    Handlers are registered per job kind and receive the job dict. Raising
+    PermanentJobError fails the job immediately, any other exception is retried
+    with exponential backoff until max_attempts is reached. Once a job is done or
+    has failed for good, its on_complete callback is called with the final job.
+    """
+
+    def __init__(self, path, max_attempts=5, base_delay=2.0, max_delay=300.0, poll_interval=1.0):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.poll_interval = poll_interval
+        self._conn = None
+        self._lock = threading.Lock()
+        self._handlers = {}
+        self._workers = []
+        self._wakeup = None
+
+    def _connection(self):
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.executescript(SCHEMA)
+            self._conn = conn
+        return self._conn
+
+    def _row_to_job(self, row):
+        return {
+            'id': row['id'],
+            'kind': row['kind'],
+            'idempotency_key': row['idempotency_key'],
+            'payload': json.loads(row['payload']),
+            'status': row['status'],
+            'attempts': row['attempts'],
+            'last_error': row['last_error'],
+            'result': json.loads(row['result']) if row['result'] else None
+        }
+
+    def register(self, kind, handler, on_complete=None):
+        """Register the coroutine that processes jobs of this kind"""
+        self._handlers[kind] = (handler, on_complete)
+
+    # Blocking SQLite operations, always run in a worker thread
+    def _enqueue_sync(self, kind, payload, idempotency_key):
+        with self._lock:
+            conn = self._connection()
+            if idempotency_key is not None:
+                row = conn.execute(
+                    "SELECT * FROM jobs WHERE idempotency_key = ? AND status IN (?, ?)",
+                    (idempotency_key, PENDING, RUNNING)
+                ).fetchone()
+                if row is not None:
+                    return self._row_to_job(row), False
+            now = time.time()
+            cursor = conn.execute(
+                "INSERT INTO jobs (kind, idempotency_key, payload, next_run_at, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (kind, idempotency_key, json.dumps(payload), now, now, now)
+            )
+            row = conn.execute("SELECT * FROM jobs WHERE id = ?", (cursor.lastrowid,)).fetchone()
+            return self._row_to_job(row), True
+
+    def _claim_sync(self):
+        kinds = list(self._handlers)
+        if not kinds:
+            return None
+        with self._lock:
+            conn = self._connection()
+            placeholders = ', '.join('?' for _ in kinds)
+            row = conn.execute(
+                f"SELECT * FROM jobs WHERE status = ? AND next_run_at <= ? AND kind IN ({placeholders}) "
+                "ORDER BY next_run_at, id LIMIT 1",
+                (PENDING, time.time(), *kinds)
+            ).fetchone()
+            if row is None:
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = ?, attempts = attempts + 1, updated_at = ? WHERE id = ?",
+                (RUNNING, time.time(), row['id'])
+            )
+            job = self._row_to_job(row)
+            job['status'] = RUNNING
+            job['attempts'] += 1
+            return job
+
+    def _update_sync(self, job_id, **fields):
+        fields['updated_at'] = time.time()
+        assignments = ', '.join(f"{column} = ?" for column in fields)
+        with self._lock:
+            self._connection().execute(
+                f"UPDATE jobs SET {assignments} WHERE id = ?",
+                (*fields.values(), job_id)
+            )
+
+    def _recover_sync(self):
+        """Requeue jobs left running by a crash and purge old finished jobs"""
+        with self._lock:
+            conn = self._connection()
+            recovered = conn.execute(
+                "UPDATE jobs SET status = ?, next_run_at = ? WHERE status = ?",
+                (PENDING, time.time(), RUNNING)
+            ).rowcount
+            conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?",
+                (DONE, FAILED, time.time() - FINISHED_JOB_RETENTION)
+            )
+            return recovered
+
+    async def enqueue(self, kind, payload, idempotency_key=None):
+        """
+        Persist a new job and wake a worker.
+        Returns (job, created); created is False when an unfinished job with the
+        same idempotency key already exists, in which case that job is returned.
+        """
+        job, created = await asyncio.to_thread(self._enqueue_sync, kind, payload, idempotency_key)
+        if created and self._wakeup is not None:
+            self._wakeup.set()
+        return job, created
+
+    async def checkpoint(self, job_id, payload):
+        """Save a handler's progress so a retry can skip steps that already succeeded"""
+        await asyncio.to_thread(self._update_sync, job_id, payload=json.dumps(payload))
+
+    async def start(self, workers):
+        """Recover interrupted jobs and start the worker pool"""
+        if self._workers:
+            return
+        recovered = await asyncio.to_thread(self._recover_sync)
+        if recovered:
+            logger.info("Requeued %d interrupted jobs", recovered)
+        self._wakeup = asyncio.Event()
+        self._workers = [asyncio.create_task(self._worker(i)) for i in range(workers)]
+        logger.info("Started job queue with %d workers", workers)
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        if self._conn is not None:
+            with self._lock:
+                self._conn.close()
+                self._conn = None
+
+    def _backoff(self, attempts):
+        delay = min(self.max_delay, self.base_delay * (2 ** (attempts - 1)))
+        # Jitter keeps retries from many jobs from hitting plex.tv at the same moment
+        return delay * random.uniform(0.5, 1.5)
+
+    async def _worker(self, number):
+        while True:
+            try:
+                job = await asyncio.to_thread(self._claim_sync)
+                if job is None:
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error("Job worker %s error: %s", number, e, exc_info=True)
+                await asyncio.sleep(self.poll_interval)
+
+    async def _run(self, job):
+        trace = start_trace(f"job:{job['kind']}#{job['id']}")
+        try:
+            await self._run_job(job)
+        finally:
+            finish_trace(trace)
+
+    async def _run_job(self, job):
+        handler, on_complete = self._handlers[job['kind']]
+        try:
+            result = await handler(job)
+        except Exception as e:
+            error = str(e) or e.__class__.__name__
+            if isinstance(e, PermanentJobError) or job['attempts'] >= self.max_attempts:
+                logger.error("Job %s (%s) failed after %d attempts: %s", job['id'], job['kind'], job['attempts'], error)
+                await asyncio.to_thread(self._update_sync, job['id'], status=FAILED, last_error=error)
+                job.update(status=FAILED, last_error=error)
+            else:
+                delay = self._backoff(job['attempts'])
+                logger.warning("Job %s (%s) attempt %d failed, retrying in %.1fs: %s", job['id'], job['kind'], job['attempts'], delay, error)
+                await asyncio.to_thread(
+                    self._update_sync, job['id'],
+                    status=PENDING, last_error=error, next_run_at=time.time() + delay
+                )
+                return
+        else:
+            await asyncio.to_thread(self._update_sync, job['id'], status=DONE, result=json.dumps(result))
+            job.update(status=DONE, result=result)
+
+        if on_complete is not None:
+            try:
+                await on_complete(job)
+            except Exception as e:
+                logger.error("Error in completion callback for job %s: %s", job['id'], e, exc_info=True)
+
+# Create a singleton instance; the SQLite file is opened on first use
+job_queue = JobQueue(JOB_QUEUE_PATH, max_attempts=JOB_QUEUE_MAX_ATTEMPTS)
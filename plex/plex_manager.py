@@ -1,47 +1,101 @@
 # Functions to manage Plex user invitations and removals
-from plexapi.server import PlexServer
-from plexapi.myplex import MyPlexAccount
 import logging
+from urllib.parse import urlparse
+from utils.metrics import timed, PLEX_LATENCY
+from utils.cache import TTLCache
+from plex.health import health_monitor
+from plex.friends import fetch_friends
+from config import PLEX_CONNECTION_CACHE_SECONDS, PLEX_FRIENDS_CACHE_SECONDS
 
 logger = logging.getLogger(__name__)
 
+def _server_label(plex_url, *args, **kwargs):
+    """Label Plex metrics with the server's host so slow servers stand out"""
+    return {'server': urlparse(plex_url.strip()).netloc or plex_url.strip()}
+
+# plexapi is slow to import, so it is only pulled in once a Plex call is made
+def _connect_account(plex_token):
+    from plexapi.myplex import MyPlexAccount
+    return MyPlexAccount(token=plex_token)
+
+def _connect_server(plex_url, plex_token):
+    from plexapi.server import PlexServer
+    # Timeouts follow the server's measured latency once the health monitor has probed it
+    return PlexServer(plex_url.strip(), plex_token, timeout=health_monitor.timeout_for(plex_url))
+
+# Account and server connections and library sections rarely change and are reused
+# for PLEX_CONNECTION_CACHE_SECONDS. Friends lists are kept for PLEX_FRIENDS_CACHE_SECONDS
+# and dropped whenever the bot invites or removes a friend. Concurrent worker threads
+# asking for the same entry share one request.
+_connections = TTLCache('plex_connections', PLEX_CONNECTION_CACHE_SECONDS)
+_friends = TTLCache('plex_friends', PLEX_FRIENDS_CACHE_SECONDS)
+
+def _account(plex_token):
+    return _connections.get_sync(('account', plex_token), _connect_account, plex_token)
+
+def _server(plex_url, plex_token):
+    # Servers failing their health checks are skipped instead of waiting for a timeout
+    health_monitor.check(plex_url)
+    plex = _connections.get_sync(('server', plex_url.strip(), plex_token), _connect_server, plex_url, plex_token)
+    timeout = health_monitor.timeout_for(plex_url)
+    if timeout is not None:
+        # Cached connections follow the adaptive timeout as it changes
+        plex._timeout = timeout
+    return plex
+
+def _sections(plex_url, plex_token):
+    plex = _server(plex_url, plex_token)
+    return _connections.get_sync(('sections', plex_url.strip(), plex_token), plex.library.sections)
+
+def _account_key(account):
+    return getattr(account, '_token', None) or id(account)
+
+def _account_users(account, fresh=False):
+    """The account's friends as Friend tuples, cached per account token"""
+    if fresh:
+        _friends.invalidate(_account_key(account))
+    return _friends.get_sync(_account_key(account), fetch_friends, account)
+
+def _friends_changed(account):
+    _friends.invalidate(_account_key(account))
+
+def clear_caches():
+    """Forget all cached Plex connections, sections and friends lists"""
+    _connections.invalidate()
+    _friends.invalidate()
+
+def is_permanent_error(error):
+    """Return True for Plex errors that retrying cannot fix, such as bad input or credentials"""
+    from plexapi.exceptions import BadRequest, NotFound, Unauthorized
+    return isinstance(error, (BadRequest, NotFound, Unauthorized))
+
+@timed(PLEX_LATENCY, span_name='plex.get_all_users_from_server', label_fn=_server_label, function='get_all_users_from_server')
 def get_all_users_from_server(plex_url, plex_token):
     try:
         # Connect to Plex server
-        plex_url = plex_url.strip()
-        account = MyPlexAccount(token=plex_token)
-        plex = PlexServer(plex_url, plex_token)
+        account = _account(plex_token)
+        plex = _server(plex_url, plex_token)
         
         # Get all users
-        users = account.users()
+        users = _account_users(account)
         
         # Format user data with library access information
         user_list = []
         for user in users:
-            # Check if user has any libraries shared with them
-            has_library_access = False
-            try:
-                # Get user's shared libraries
-                shared_servers = user.servers
-                for server in shared_servers:
-                    if server.name == plex.friendlyName:
-                        has_library_access = True
-                        break
-            except Exception as e:
-                logger.warning(f"Could not check library access for {user.username}: {str(e)}")
-                
             user_list.append({
                 'username': user.username,
                 'email': user.email,
-                'library_access': has_library_access
+                # Whether any libraries of this server are shared with the user
+                'library_access': plex.friendlyName in user.server_names
             })
         
-        logger.info(f"Successfully retrieved {len(user_list)} users from Plex server")
+        logger.info("Successfully retrieved %d users from Plex server", len(user_list))
         return user_list
     except Exception as e:
         logger.error(f"Error getting users from Plex: {str(e)}", exc_info=True)
         raise
 
+@timed(PLEX_LATENCY, span_name='plex.get_user_details', function='get_user_details', server='plex.tv')
 def get_user_details(plex_token, identifier):
     """
     Get both username and email for a user when either one is provided.
@@ -50,10 +104,10 @@ def get_user_details(plex_token, identifier):
     """
     try:
         # Connect to account using token
-        account = MyPlexAccount(token=plex_token)
+        account = _account(plex_token)
         
         # Get all users
-        users = account.users()
+        users = _account_users(account)
         
         # Check if identifier is an email (contains @)
         is_email = '@' in identifier
@@ -72,64 +126,127 @@ def get_user_details(plex_token, identifier):
         logger.error(f"Error getting user details: {str(e)}", exc_info=True)
         return (identifier, None)
 
+@timed(PLEX_LATENCY, span_name='plex.connect_to_plex', label_fn=_server_label, function='connect_to_plex')
+def connect_to_plex(plex_url, plex_token):
+    """
+    Open an account and server connection that can be reused for several invitations.
+    Returns a tuple of (account, plex, sections).
+    """
+    account = _account(plex_token)
+    plex = _server(plex_url, plex_token)
+    return (account, plex, _sections(plex_url, plex_token))
+
+@timed(PLEX_LATENCY, span_name='plex.warm_up', label_fn=_server_label, function='warm_up')
+def warm_up(plex_url, plex_token):
+    """Sign in to the account and server and fill the friends list and library section caches"""
+    _account_users(_account(plex_token))
+    _sections(plex_url, plex_token)
+
+@timed(PLEX_LATENCY, span_name='plex.get_friends_snapshot', function='get_friends_snapshot', server='plex.tv')
+def get_friends_snapshot(account):
+    """
+    Fetch the account's friends list once and index it by lowercase username and email.
+    Returns a dict mapping each key to a (username, email) tuple.
+    """
+    friends = {}
+    for user in _account_users(account):
+        details = (user.username, user.email)
+        if user.username:
+            friends[user.username.lower()] = details
+        if user.email:
+            friends[user.email.lower()] = details
+    return friends
+
+@timed(PLEX_LATENCY, span_name='plex.invite_user_with_session', function='invite_user_with_session', server='plex.tv')
+def invite_user_with_session(account, plex, sections, friends, identifier):
+    """
+    Invite a user with a connection from connect_to_plex() and a snapshot from
+    get_friends_snapshot(), so batches don't reconnect or refetch the friends list.
+    """
+    existing = friends.get(identifier.lower())
+    if existing:
+        username, email = existing
+        logger.warning("User %s is already a member of the Plex server", username)
+        return {'invited': False, 'username': username, 'email': email}
+
+    account.inviteFriend(
+        user=identifier,
+        server=plex,
+        sections=sections,  # Share all libraries
+        allowSync=True,
+        allowCameraUpload=False,
+        allowChannels=True
+    )
+    _friends_changed(account)
+    logger.info("Successfully invited user %s to Plex server", identifier)
+    return {'invited': True, 'username': identifier, 'email': identifier if '@' in identifier else None}
+
+@timed(PLEX_LATENCY, span_name='plex.invite_user_to_plex', label_fn=_server_label, function='invite_user_to_plex')
 def invite_user_to_plex(plex_url, plex_token, identifier):
     try:
-        # Connect to Plex server - strip any whitespace from URL
-        plex_url = plex_url.strip()
-        plex = PlexServer(plex_url, plex_token)
-        # Get account associated with the token
-        account = MyPlexAccount(token=plex_token)
-        
-        # Get complete user details (username and email)
-        username, email = get_user_details(plex_token, identifier)
-        
-        # Check if user is already invited/exists
-        existing_users = [user.username.lower() for user in account.users()]
-        if username.lower() in existing_users:
-            logger.warning(f"User {username} is already a member of the Plex server")
-            # Return user details even if already invited
-            return {'invited': False, 'username': username, 'email': email}
-            
-        # Send invitation
-        account.inviteFriend(
-            user=identifier,  # Use original identifier for invitation
-            server=plex,
-            sections=plex.library.sections(),  # Share all libraries
-            allowSync=True,
-            allowCameraUpload=False,
-            allowChannels=True
-        )
-        logger.info(f"Successfully invited user {username} to Plex server")
-        return {'invited': True, 'username': username, 'email': email}
+        account, plex, sections = connect_to_plex(plex_url, plex_token)
+        friends = get_friends_snapshot(account)
+        return invite_user_with_session(account, plex, sections, friends, identifier)
     except Exception as e:
         logger.error(f"Error inviting user to Plex: {str(e)}", exc_info=True)
         raise
 
+@timed(PLEX_LATENCY, span_name='plex.remove_user_from_plex', label_fn=_server_label, function='remove_user_from_plex')
 def remove_user_from_plex(plex_url, plex_token, identifier):
     try:
         # Connect directly to account using token
-        account = MyPlexAccount(token=plex_token)
+        account = _account(plex_token)
         
         # Clean the URL by removing any whitespace
-        plex_url = plex_url.strip()
-        plex = PlexServer(plex_url, plex_token)
+        plex = _server(plex_url, plex_token)
         
+        # Revoking access must not miss friends who joined since the list was cached, so
+        # fetch it live; get_user_details below then reads the list fetched here
+        users = _account_users(account, fresh=True)
+
         # Get complete user details (username and email)
         username, email = get_user_details(plex_token, identifier)
         
-        # Get list of users
-        users = account.users()
         # Case-insensitive username comparison
         user_to_remove = next((user for user in users if user.username.lower() == username.lower()), None)
         
         if user_to_remove:
             # Remove user from server
             account.removeFriend(user_to_remove.username)
-            logger.info(f"Successfully removed user {username} from Plex server")
+            _friends_changed(account)
+            logger.info("Successfully removed user %s from Plex server", username)
             return True
         else:
             logger.warning(f"User {identifier} not found on Plex server")
             return False
     except Exception as e:
         logger.error(f"Error removing user from Plex: {str(e)}", exc_info=True)
-        raise
\ No newline at end of file
+        raise
+
+@timed(PLEX_LATENCY, span_name='plex.get_server_name', label_fn=_server_label, function='get_server_name')
+def get_server_name(plex_url, plex_token):
+    """Return the server's friendly name, which is what friends' shares are listed under"""
+    return _server(plex_url, plex_token).friendlyName
+
+@timed(PLEX_LATENCY, span_name='plex.get_shared_users', function='get_shared_users', server='plex.tv')
+def get_shared_users(plex_token):
+    """
+    Fetch the account's friends list once and group it by the servers shared with each friend.
+    Returns a dict mapping server friendly name to a list of (username, email) tuples.
+    """
+    shares = {}
+    # Reconciliation compares against the live list, not a cached one
+    for user in _account_users(_account(plex_token), fresh=True):
+        for server_name in user.server_names:
+            shares.setdefault(server_name, []).append((user.username, user.email))
+    return shares
+
+@timed(PLEX_LATENCY, span_name='plex.unshare_user_with_session', function='unshare_user_with_session', server='plex.tv')
+def unshare_user_with_session(account, plex, username):
+    """
+    Stop sharing one server with a friend, using a connection from connect_to_plex().
+    The friend keeps their shares on other servers of the same account.
+    """
+    account.updateFriend(username, plex, removeSections=True)
+    _friends_changed(account)
+    logger.info("Stopped sharing %s with %s", plex.friendlyName, username)
@@ -0,0 +1,206 @@
+# Compares the subscriptions table with the Plex friends lists and repairs drift
+import asyncio
+import csv
+import io
+import logging
+import time
+from datetime import date
+from database.db import db
+from plex.plex_manager import get_server_name, get_shared_users, connect_to_plex, unshare_user_with_session
+from utils.date_utils import get_end_date
+
+logger = logging.getLogger(__name__)
+
+# Only the columns the comparison needs are streamed from the database
+SUBSCRIPTION_COLUMNS = "id,plex_username,email,server_name,start_date,duration,end_date"
+
+class ServerDiff:
+    """Differences between the database and Plex for one server"""
+
+    def __init__(self, server_name):
+        self.server_name = server_name
+        self.in_sync = 0
+        # (username, email, end_date) of expired subscriptions that are still shared
+        self.expired_shared = []
+        # (username, email) of friends the server is shared with but who have no subscription
+        self.untracked = []
+        # (username, email, end_date) of active subscriptions the server isn't shared with
+        self.missing_on_plex = []
+        self.removed = []
+        self.remove_failed = []
+        self.error = None
+
+    @property
+    def drift(self):
+        return len(self.expired_shared) + len(self.untracked) + len(self.missing_on_plex)
+
+class ReconcileReport:
+    def __init__(self):
+        self.servers = {}
+        self.rows_scanned = 0
+        self.unknown_server_rows = 0
+        self.duration = None
+        self.applied = False
+
+    @property
+    def drift(self):
+        return sum(diff.drift for diff in self.servers.values())
+
+    @property
+    def expired_shared(self):
+        return sum(len(diff.expired_shared) for diff in self.servers.values())
+
+    def to_dict(self):
+        """Counts per server, for JSON summaries"""
+        servers = {}
+        for diff in self.servers.values():
+            servers[diff.server_name] = {
+                'in_sync': diff.in_sync,
+                'expired_shared': len(diff.expired_shared),
+                'untracked': len(diff.untracked),
+                'missing_on_plex': len(diff.missing_on_plex),
+                'removed': len(diff.removed),
+                'remove_failed': len(diff.remove_failed),
+                'error': diff.error
+            }
+        return {
+            'rows_scanned': self.rows_scanned,
+            'unknown_server_rows': self.unknown_server_rows,
+            'drift': self.drift,
+            'applied': self.applied,
+            'duration_seconds': round(self.duration or 0, 3),
+            'servers': servers
+        }
+
+    def to_csv(self):
+        """Every difference as a CSV row, for attaching to the report"""
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['server', 'issue', 'plex_username', 'email', 'end_date'])
+        for diff in self.servers.values():
+            removed = set(diff.removed)
+            for username, email, end_date in diff.expired_shared:
+                issue = 'expired_removed' if username in removed else 'expired_still_shared'
+                writer.writerow([diff.server_name, issue, username, email or '', end_date])
+            for username, email in diff.untracked:
+                writer.writerow([diff.server_name, 'shared_without_subscription', username, email or '', ''])
+            for username, email, end_date in diff.missing_on_plex:
+                writer.writerow([diff.server_name, 'active_not_shared', username, email or '', end_date])
+        return output.getvalue()
+
+def _end_date(row):
+    # Stored end dates are ISO strings, which compare correctly as text
+    return row.get('end_date') or get_end_date(row).strftime('%Y-%m-%d')
+
+async def reconcile(page_size=1000):
+    """
+    Build a ReconcileReport without changing anything. Friends lists are fetched
+    once per Plex account, concurrently, while subscriptions are streamed from the
+    database page by page; no per-user requests are made on either side.
+    """
+    start = time.perf_counter()
+    report = ReconcileReport()
+    servers = await db.get_all_plex_servers()
+    tokens = list(dict.fromkeys(server['plex_token'] for server in servers))
+
+    names, shares = await asyncio.gather(
+        asyncio.gather(*(asyncio.to_thread(get_server_name, server['plex_url'], server['plex_token'])
+                         for server in servers), return_exceptions=True),
+        asyncio.gather(*(asyncio.to_thread(get_shared_users, token) for token in tokens), return_exceptions=True)
+    )
+    shares_by_token = dict(zip(tokens, shares))
+
+    # Per server: the shared users, a lookup from lowercase username/email to their
+    # position, and the latest end date of the subscriptions matched to each of them
+    plex_side = {}
+    for server, friendly_name in zip(servers, names):
+        diff = report.servers[server['server_name']] = ServerDiff(server['server_name'])
+        token_shares = shares_by_token[server['plex_token']]
+        for result in (friendly_name, token_shares):
+            if isinstance(result, Exception):
+                diff.error = str(result)
+                logger.error("Could not read Plex shares for %s: %s", server['server_name'], result)
+        if diff.error:
+            continue
+        users = token_shares.get(friendly_name, [])
+        index = {}
+        for position, (username, email) in enumerate(users):
+            for key in (username, email):
+                if key:
+                    index[key.lower()] = position
+        plex_side[server['server_name']] = (users, index, {})
+
+    unmatched = {}
+    async for row in db.iter_subscriptions(page_size, SUBSCRIPTION_COLUMNS):
+        report.rows_scanned += 1
+        side = plex_side.get(row['server_name'])
+        if side is None:
+            if row['server_name'] not in report.servers:
+                report.unknown_server_rows += 1
+            continue
+        users, index, matched = side
+        username = (row.get('plex_username') or '').lower()
+        email = (row.get('email') or '').lower()
+        position = index.get(username) if username in index else index.get(email)
+        end_date = _end_date(row)
+        if position is not None:
+            # Renewals can leave several rows per user, the latest end date wins
+            if end_date > matched.get(position, ''):
+                matched[position] = end_date
+        else:
+            key = (row['server_name'], username or email)
+            if key not in unmatched or end_date > unmatched[key][2]:
+                unmatched[key] = (row.get('plex_username'), row.get('email'), end_date)
+
+    today = date.today().isoformat()
+    for server_name, (users, index, matched) in plex_side.items():
+        diff = report.servers[server_name]
+        for position, (username, email) in enumerate(users):
+            end_date = matched.get(position)
+            if end_date is None:
+                diff.untracked.append((username, email))
+            elif end_date < today:
+                diff.expired_shared.append((username, email, end_date))
+            else:
+                diff.in_sync += 1
+    for (server_name, _), (username, email, end_date) in unmatched.items():
+        # Expired rows that aren't shared any more are just history
+        if end_date >= today:
+            report.servers[server_name].missing_on_plex.append((username, email, end_date))
+
+    report.duration = time.perf_counter() - start
+    logger.info(
+        "Reconciled %d subscriptions against %d servers in %.2fs, %d differences",
+        report.rows_scanned, len(plex_side), report.duration, report.drift
+    )
+    return report
+
+async def apply_report(report, concurrency=5):
+    """Stop sharing servers with the users whose subscription has expired"""
+    servers = {server['server_name']: server for server in await db.get_all_plex_servers()}
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def unshare(session, diff, username):
+        async with semaphore:
+            try:
+                await asyncio.to_thread(unshare_user_with_session, session[0], session[1], username)
+                diff.removed.append(username)
+            except Exception as e:
+                diff.remove_failed.append(username)
+                logger.error("Could not stop sharing %s with %s: %s", diff.server_name, username, e)
+
+    async def apply_server(diff):
+        server = servers.get(diff.server_name)
+        if server is None or not diff.expired_shared:
+            return
+        try:
+            session = await asyncio.to_thread(connect_to_plex, server['plex_url'], server['plex_token'])
+        except Exception as e:
+            diff.remove_failed.extend(username for username, _, _ in diff.expired_shared)
+            logger.error("Could not connect to %s: %s", diff.server_name, e, exc_info=True)
+            return
+        await asyncio.gather(*(unshare(session, diff, username) for username, _, _ in diff.expired_shared))
+
+    await asyncio.gather(*(apply_server(diff) for diff in report.servers.values()))
+    report.applied = True
+    return report
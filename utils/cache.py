@@ -0,0 +1,89 @@
+# Short-lived caches for expensive reads
+import functools
+import time
+from utils.metrics import CACHE_REQUESTS
+from utils.singleflight import SingleFlight
+
+class TTLCache:
+    """
+    Results of calls kept for ttl seconds per key. Concurrent misses for
+    the same key share one call. Cached values are shared, treat them as read-only.
+    """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self._entries = {}
+        # Bumped by invalidate(), so loads that started before it don't store stale values
+        self._generation = 0
+        # Expired entries are swept out whenever the cache grows past this size
+        self._sweep_at = 1024
+        self._flight = SingleFlight(f"cache.{name}")
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            CACHE_REQUESTS.inc(cache=self.name, result='hit')
+            return True, entry[1]
+        CACHE_REQUESTS.inc(cache=self.name, result='stale' if entry is not None else 'miss')
+        return False, None
+
+    def _store(self, key, generation, value):
+        if self.ttl <= 0 or generation != self._generation:
+            return
+        now = time.monotonic()
+        self._entries[key] = (now, value)
+        if len(self._entries) > self._sweep_at:
+            self._entries = {k: entry for k, entry in self._entries.items() if now - entry[0] < self.ttl}
+            self._sweep_at = max(1024, 2 * len(self._entries))
+
+    async def get(self, key, func, *args, **kwargs):
+        """Cached result of await func(*args, **kwargs)"""
+        found, value = self._lookup(key)
+        if found:
+            return value
+        return await self._flight.do(key, self._load, key, func, *args, **kwargs)
+
+    async def _load(self, key, func, *args, **kwargs):
+        generation = self._generation
+        value = await func(*args, **kwargs)
+        self._store(key, generation, value)
+        return value
+
+    def get_sync(self, key, func, *args, **kwargs):
+        """Blocking variant of get() for code running in worker threads"""
+        found, value = self._lookup(key)
+        if found:
+            return value
+        return self._flight.do_sync(key, self._load_sync, key, func, *args, **kwargs)
+
+    def _load_sync(self, key, func, *args, **kwargs):
+        generation = self._generation
+        value = func(*args, **kwargs)
+        self._store(key, generation, value)
+        return value
+
+    def age(self, key):
+        """Seconds since the value for key was loaded, None if it isn't cached"""
+        entry = self._entries.get(key)
+        return time.monotonic() - entry[0] if entry is not None else None
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None"""
+        self._generation += 1
+        if key is None:
+            self._entries.clear()
+        else:
+            self._entries.pop(key, None)
+
+def cached(cache, key):
+    """
+    Decorator for coroutine methods: results are kept in cache under key(*args).
+    Concurrent misses for the same key share one call.
+    """
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args):
+            return await cache.get(key(*args), func, self, *args)
+        return wrapper
+    return decorator
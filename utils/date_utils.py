@@ -1,18 +1,46 @@
 # Helper functions for date calculations (e.g., end date)
+import re
 from datetime import datetime, timedelta
+from functools import lru_cache
 
-def calculate_end_date(start_date, duration):
-    # Convert duration string to days
-    duration_map = {
-        '2_days': 2,
-        '1_month': 30,
-        '3_months': 90,
-        '6_months': 180,
-        '12_months': 365
-    }
-    
-    days = duration_map.get(duration)
-    if days is None:
+# Durations are written as <count>_<unit>, e.g. 2_days, 1_month or 2_years
+DURATION_PATTERN = re.compile(r'^(\d+)_(day|week|month|year)s?$')
+
+# A month counts as 30 days and a year as 365, as they always have
+UNIT_DAYS = {
+    'day': 1,
+    'week': 7,
+    'month': 30,
+    'year': 365
+}
+
+@lru_cache(maxsize=None)
+def duration_to_days(duration):
+    match = DURATION_PATTERN.match(duration or '')
+    if not match:
         raise ValueError(f"Invalid duration format: {duration}")
-        
-    return start_date + timedelta(days=days)
\ No newline at end of file
+    count, unit = int(match.group(1)), match.group(2)
+    # Whole years of months are priced as years, so 12_months stays 365 days
+    if unit == 'month' and count and count % 12 == 0:
+        return count // 12 * UNIT_DAYS['year']
+    return count * UNIT_DAYS[unit]
+
+def calculate_end_date(start_date, duration):
+    return start_date + timedelta(days=duration_to_days(duration))
+
+def parse_date(date_str):
+    """Parse a date stored as either DD-MM-YYYY or YYYY-MM-DD"""
+    try:
+        return datetime.strptime(date_str, '%d-%m-%Y')
+    except ValueError:
+        return datetime.strptime(date_str, '%Y-%m-%d')
+
+def get_end_date(subscription):
+    """
+    Return the subscription's end date as a datetime.
+    Uses the stored end_date, which bulk renewals may have moved, and falls back
+    to start_date + duration for rows without one.
+    """
+    if subscription.get('end_date'):
+        return parse_date(subscription['end_date'])
+    return calculate_end_date(parse_date(subscription['start_date']), subscription['duration'])
@@ -0,0 +1,104 @@
+# Columnar expiry classification for large sets of subscriptions
+from datetime import datetime
+from utils.date_utils import parse_date, duration_to_days
+
+# Urgency buckets by days remaining, as shown by /due_subscription
+EXPIRED = 'expired'
+CRITICAL = 'critical'
+WARNING = 'warning'
+NOTICE = 'notice'
+ACTIVE = 'active'
+
+# Upper bound (inclusive) of days remaining for each bucket
+CRITICAL_DAYS = 2
+WARNING_DAYS = 7
+NOTICE_DAYS = 30
+
+STATUS_EMOJI = {
+    EXPIRED: "🔴",
+    CRITICAL: "🔴",
+    WARNING: "🟡",
+    NOTICE: "🟢",
+    ACTIVE: "🟢"
+}
+
+def _np():
+    # numpy is only pulled in once a command needs it, to keep startup fast
+    import numpy
+    return numpy
+
+def _iso(value):
+    # DD-MM-YYYY is rearranged by slicing, which is far cheaper than strptime
+    if value and value[2:3] == '-':
+        return f"{value[6:10]}-{value[3:5]}-{value[0:2]}"
+    return value or 'NaT'
+
+def _to_datetime64(np, values):
+    """Date strings (YYYY-MM-DD or DD-MM-YYYY) to datetime64[D]"""
+    try:
+        return np.array(values, dtype='datetime64[D]')
+    except ValueError:
+        pass
+    try:
+        return np.array([_iso(value) for value in values], dtype='datetime64[D]')
+    except ValueError:
+        # Anything else goes through the same parser as get_end_date, so errors match
+        return np.array([parse_date(value).strftime('%Y-%m-%d') for value in values], dtype='datetime64[D]')
+
+class ExpiryTable:
+    """
+    End dates, days remaining and urgency buckets of a list of subscription rows,
+    computed column-wise in one pass. Row i of every column belongs to
+    subscriptions[i].
+    """
+
+    def __init__(self, subscriptions, now=None):
+        np = _np()
+        self.subscriptions = subscriptions
+        self.end_dates = self._end_dates(np, subscriptions)
+
+        # Same floor semantics as (end_date - datetime.now()).days: a subscription
+        # ending at midnight tonight has 0 days left, one that ended today has -1
+        now = np.datetime64(now or datetime.now(), 'us')
+        self.days_remaining = (self.end_dates.astype('datetime64[us]') - now) // np.timedelta64(1, 'D')
+
+        days = self.days_remaining
+        self.buckets = np.select(
+            [days < 0, days <= CRITICAL_DAYS, days <= WARNING_DAYS, days <= NOTICE_DAYS],
+            [EXPIRED, CRITICAL, WARNING, NOTICE],
+            default=ACTIVE
+        )
+
+    @staticmethod
+    def _end_dates(np, subscriptions):
+        # Stored end dates are used as is; rows without one fall back to start_date + duration
+        end_dates = _to_datetime64(np, [sub.get('end_date') or 'NaT' for sub in subscriptions])
+        missing = np.flatnonzero(np.isnat(end_dates))
+        if missing.size:
+            rows = [subscriptions[i] for i in missing]
+            starts = _to_datetime64(np, [row['start_date'] for row in rows])
+            offsets = np.array([duration_to_days(row['duration']) for row in rows], dtype='timedelta64[D]')
+            end_dates[missing] = starts + offsets
+        return end_dates
+
+    def __len__(self):
+        return len(self.subscriptions)
+
+    def indices(self, *buckets):
+        """Row indices in the given buckets, soonest end date first"""
+        np = _np()
+        selected = np.flatnonzero(np.isin(self.buckets, buckets))
+        return selected[np.argsort(self.days_remaining[selected], kind='stable')]
+
+    def counts(self):
+        """Number of rows per bucket"""
+        np = _np()
+        names, counts = np.unique(self.buckets, return_counts=True)
+        return {str(name): int(count) for name, count in zip(names, counts)}
+
+    def end_date(self, i):
+        return self.end_dates[i].item()
+
+    def row(self, i):
+        """(subscription, days remaining, end date, bucket) of row i"""
+        return self.subscriptions[i], int(self.days_remaining[i]), self.end_date(i), str(self.buckets[i])
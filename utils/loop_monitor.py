@@ -0,0 +1,94 @@
+# Watchdog that detects event-loop stalls and names the blocking call
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+from utils.metrics import EVENT_LOOP_STALLS
+
+logger = logging.getLogger(__name__)
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def _is_project_frame(filename):
+    filename = os.path.abspath(filename)
+    return filename.startswith(PROJECT_ROOT) and 'site-packages' not in filename
+
+class LoopStallDetector:
+    """
+    A heartbeat task on the loop and a watchdog thread beside it. When the heartbeat
+    falls behind by more than the threshold, the watchdog captures the loop thread's
+    stack so the log shows exactly which call was blocking.
+    """
+
+    def __init__(self, threshold, report_interval=60.0):
+        self.threshold = threshold
+        # Beat often enough that a stall is noticed shortly after it crosses the threshold
+        self.interval = max(threshold / 4, 0.01)
+        self.report_interval = report_interval
+        self._last_beat = time.monotonic()
+        self._loop_ident = None
+        self._heartbeat_task = None
+        self._thread = None
+        self._stop = threading.Event()
+        self._last_report = {}
+        self._suppressed = {}
+
+    async def start(self):
+        self._loop_ident = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat_task = asyncio.create_task(self._heartbeat())
+        self._thread = threading.Thread(target=self._watch, name='loop-stall-watchdog', daemon=True)
+        self._thread.start()
+        logger.info("Loop stall detector running with a %.0fms threshold", self.threshold * 1000)
+
+    async def stop(self):
+        self._stop.set()
+        if self._heartbeat_task is not None:
+            self._heartbeat_task.cancel()
+
+    async def _heartbeat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported_beat = None
+        while not self._stop.wait(self.interval):
+            last_beat = self._last_beat
+            blocked_for = time.monotonic() - last_beat - self.interval
+            # Report each stall once, identified by the heartbeat it interrupted
+            if blocked_for > self.threshold and last_beat != reported_beat:
+                reported_beat = last_beat
+                frame = sys._current_frames().get(self._loop_ident)
+                if frame is not None:
+                    self._report(frame, blocked_for)
+
+    def _report(self, frame, blocked_for):
+        stack = traceback.extract_stack(frame)
+        innermost = stack[-1]
+        project_frames = [entry for entry in stack if _is_project_frame(entry.filename)]
+        culprit = project_frames[-1] if project_frames else innermost
+        filename = culprit.filename
+        if _is_project_frame(filename):
+            filename = os.path.relpath(filename, PROJECT_ROOT)
+        location = f"{filename}:{culprit.lineno}"
+        EVENT_LOOP_STALLS.inc(location=location)
+
+        # Rate-limit per location so one slow call can't flood the log
+        now = time.monotonic()
+        if now - self._last_report.get(location, float('-inf')) < self.report_interval:
+            self._suppressed[location] = self._suppressed.get(location, 0) + 1
+            return
+        self._last_report[location] = now
+        suppressed = self._suppressed.pop(location, 0)
+
+        suppressed_text = f" ({suppressed} similar stalls not logged)" if suppressed else ''
+        logger.warning(
+            "Event loop blocked for at least %.0fms in %s at %s%s; innermost call: %s (%s:%d)\n%s",
+            blocked_for * 1000, culprit.name, location, suppressed_text,
+            innermost.name, innermost.filename, innermost.lineno, ''.join(traceback.format_list(stack[-15:]))
+        )
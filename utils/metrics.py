@@ -0,0 +1,288 @@
+# Prometheus-style metrics and the embedded /metrics HTTP endpoint
+import asyncio
+import bisect
+import datetime
+import functools
+import inspect
+import logging
+import threading
+import time
+from contextlib import nullcontext
+from utils.tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Stands in for a span when a timed function isn't traced
+_NO_SPAN = nullcontext()
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+_registry = []
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    pairs = ','.join(f'{name}="{_escape(value)}"' for name, value in labels)
+    return '{' + pairs + '}'
+
+class _Metric:
+    metric_type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple((name, labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_format_labels(key)} {value}"]
+
+class Counter(_Metric):
+    metric_type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+class Gauge(_Metric):
+    metric_type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+class Histogram(_Metric):
+    metric_type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # One counter per bucket plus +Inf, then sum and count
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+            state[2] += 1
+
+    def _render_sample(self, key, state):
+        counts, total, count = state
+        lines = []
+        cumulative = 0
+        for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += bucket_count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            lines.append(f"{self.name}_bucket{_format_labels(key + (('le', le),))} {cumulative}")
+        lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+        lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+def render():
+    """Render every registered metric in the Prometheus text format"""
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+# Metrics collected by the bot
+COMMAND_LATENCY = Histogram(
+    'discord_command_duration_seconds',
+    'Time from interaction creation until the command handler finished',
+    ['command']
+)
+COMMAND_ACK_LATENCY = Histogram(
+    'discord_command_ack_seconds',
+    'Time from interaction creation until the interaction was deferred',
+    ['command']
+)
+DB_LATENCY = Histogram(
+    'db_query_duration_seconds',
+    'Latency of Database methods',
+    ['method']
+)
+PLEX_LATENCY = Histogram(
+    'plex_call_duration_seconds',
+    'Latency of plex_manager functions per server',
+    ['function', 'server']
+)
+PLEX_PROBE_LATENCY = Histogram(
+    'plex_health_probe_seconds',
+    'Latency of successful Plex server health checks',
+    ['server']
+)
+PLEX_SERVER_UP = Gauge(
+    'plex_server_up',
+    'Whether a Plex server passes its health checks (0 while it is degraded)',
+    ['server']
+)
+PLEX_SERVER_TIMEOUT = Gauge(
+    'plex_server_timeout_seconds',
+    'Adaptive timeout used for calls to a Plex server',
+    ['server']
+)
+CACHE_REQUESTS = Counter(
+    'cache_requests_total',
+    'Cache lookups by cache and result (hit, stale or miss)',
+    ['cache', 'result']
+)
+CACHE_INVALIDATIONS = Counter(
+    'cache_invalidations_total',
+    'Change notifications received from Postgres, by table',
+    ['table']
+)
+SINGLEFLIGHT_CALLS = Counter(
+    'singleflight_calls_total',
+    'Coalesced calls by group and result (executed, or coalesced into one already in flight)',
+    ['group', 'result']
+)
+REMINDERS_SENT = Counter(
+    'reminders_total',
+    'Expiry reminder DMs by result (sent, undeliverable or error)',
+    ['result']
+)
+EVENT_LOOP_LAG = Histogram(
+    'event_loop_lag_seconds',
+    'How late the event loop woke up a sleeping task',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+)
+EVENT_LOOP_STALLS = Counter(
+    'event_loop_stalls_total',
+    'Event loop stalls longer than the threshold, by the project code that was blocking',
+    ['location']
+)
+
+def timed(histogram, label_fn=None, span_name=None, **labels):
+    """
+    Decorator that observes the run time of a sync or async function and, with
+    span_name, records each call as a span of the current trace. Static labels are
+    passed as keyword arguments, label_fn can derive more labels from the call arguments.
+    """
+    def decorator(func):
+        def labels_for(args, kwargs):
+            values = dict(labels)
+            if label_fn is not None:
+                values.update(label_fn(*args, **kwargs))
+            return values
+
+        def call_span():
+            return span(span_name) if span_name is not None else _NO_SPAN
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    with call_span():
+                        return await func(*args, **kwargs)
+                finally:
+                    histogram.observe(time.perf_counter() - start, **labels_for(args, kwargs))
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                with call_span():
+                    return func(*args, **kwargs)
+            finally:
+                histogram.observe(time.perf_counter() - start, **labels_for(args, kwargs))
+        return wrapper
+    return decorator
+
+def time_methods(histogram, span_prefix=None):
+    """
+    Class decorator that times every public coroutine method, labelled by method name,
+    and with span_prefix records each call as a "<span_prefix>.<method>" span
+    """
+    def decorator(cls):
+        for name, member in list(vars(cls).items()):
+            if not name.startswith('_') and inspect.iscoroutinefunction(member):
+                span_name = f"{span_prefix}.{name}" if span_prefix else None
+                setattr(cls, name, timed(histogram, span_name=span_name, method=name)(member))
+        return cls
+    return decorator
+
+def _command_name(interaction):
+    command = interaction.command
+    return command.qualified_name if command is not None else 'unknown'
+
+def _interaction_age(interaction):
+    # created_at is timezone-aware UTC, like discord.utils.utcnow()
+    return (datetime.datetime.now(datetime.timezone.utc) - interaction.created_at).total_seconds()
+
+async def timed_defer(interaction, **kwargs):
+    """Defer an interaction and record how long it took to acknowledge"""
+    await interaction.response.defer(**kwargs)
+    COMMAND_ACK_LATENCY.observe(_interaction_age(interaction), command=_command_name(interaction))
+
+def observe_command(interaction, command):
+    """Record the total latency of a finished application command"""
+    COMMAND_LATENCY.observe(_interaction_age(interaction), command=command.qualified_name)
+
+async def monitor_event_loop_lag(interval=0.5):
+    """Measure how late the loop resumes a sleeping task, which shows blocking calls"""
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        EVENT_LOOP_LAG.observe(max(0.0, loop.time() - start - interval))
+
+async def _handle_request(reader, writer):
+    try:
+        request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+        # Drain the headers; the endpoint doesn't need them
+        while True:
+            line = await asyncio.wait_for(reader.readline(), timeout=5)
+            if line in (b'\r\n', b'\n', b''):
+                break
+
+        parts = request_line.decode('latin-1').split()
+        if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] == '/metrics':
+            status, body = '200 OK', render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        else:
+            status, body, content_type = '404 Not Found', b'Not Found\n', 'text/plain'
+
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: {content_type}\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode('latin-1') + body
+        )
+        await writer.drain()
+    except (asyncio.TimeoutError, ConnectionError):
+        pass
+    except Exception as e:
+        logger.error("Error serving metrics: %s", e, exc_info=True)
+    finally:
+        writer.close()
+
+async def start_metrics_server(host, port):
+    """Serve GET /metrics on host:port and return the asyncio server"""
+    server = await asyncio.start_server(_handle_request, host, port)
+    logger.info("Metrics endpoint listening on http://%s:%s/metrics", host, port)
+    return server
@@ -0,0 +1,147 @@
+# Sampling profiler for the running bot (event loop and executor threads)
+import collections
+import os
+import sys
+import threading
+import time
+
+# Innermost frames that mean a thread is waiting rather than working
+IDLE_FRAMES = {
+    ('selectors.py', 'select'),
+    ('threading.py', 'wait'),
+    ('threading.py', '_wait_for_tstate_lock'),
+    ('queue.py', 'get'),
+    ('thread.py', '_worker'),
+}
+
+def _thread_cpu_time(ident):
+    """CPU seconds used by a thread, or None where the platform can't tell"""
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError, ValueError):
+        return None
+
+class ProfileResult:
+    def __init__(self, duration, interval, samples, thread_samples, idle_samples, self_counts,
+                 cumulative_counts, collapsed, thread_cpu, process_cpu, thread_names):
+        self.duration = duration
+        self.interval = interval
+        self.samples = samples
+        self.thread_samples = thread_samples
+        self.idle_samples = idle_samples
+        self.self_counts = self_counts
+        self.cumulative_counts = cumulative_counts
+        self.collapsed = collapsed
+        self.thread_cpu = thread_cpu
+        self.process_cpu = process_cpu
+        self.thread_names = thread_names
+
+    def format_report(self, limit=40):
+        """Human-readable stats sorted by self and cumulative samples"""
+        lines = [
+            f"Wall time: {self.duration:.1f}s, process CPU: {self.process_cpu:.2f}s, "
+            f"{self.samples} sampling rounds every {self.interval * 1000:.0f}ms",
+            "",
+            "Threads (samples / active samples / CPU seconds):"
+        ]
+        for ident, count in sorted(self.thread_samples.items(), key=lambda item: -item[1]):
+            cpu = self.thread_cpu.get(ident)
+            cpu_text = f"{cpu:.2f}s" if cpu is not None else "n/a"
+            active = count - self.idle_samples.get(ident, 0)
+            lines.append(f"  {self.thread_names.get(ident, ident)}: {count} / {active} / {cpu_text}")
+
+        active_total = sum(self.self_counts.values()) or 1
+        for title, counts in (("Top functions by self time (active samples):", self.self_counts),
+                              ("Top functions by cumulative time (active samples):", self.cumulative_counts)):
+            lines.extend(["", title, f"  {'samples':>8} {'%':>6}  function"])
+            for function, count in counts.most_common(limit):
+                lines.append(f"  {count:>8} {count * 100 / active_total:>5.1f}%  {function}")
+        return '\n'.join(lines) + '\n'
+
+    def format_collapsed(self):
+        """Collapsed stacks, one 'frame;frame;frame count' line each, for flamegraph tools"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.collapsed.most_common())
+
+class SamplingProfiler:
+    """Samples the Python stacks of every thread at a fixed interval"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    def run(self, duration, loop_ident=None):
+        """
+        Sample for duration seconds; blocks, so run it in a worker thread.
+        loop_ident marks the event loop's thread in the report.
+        """
+        own_ident = threading.get_ident()
+
+        def current_thread_names():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            if loop_ident in names:
+                names[loop_ident] += ' (event loop)'
+            return names
+
+        thread_names = current_thread_names()
+        cpu_start = {ident: _thread_cpu_time(ident) for ident in thread_names}
+        process_cpu_start = time.process_time()
+
+        samples = 0
+        thread_samples = collections.Counter()
+        idle_samples = collections.Counter()
+        self_counts = collections.Counter()
+        cumulative_counts = collections.Counter()
+        collapsed = collections.Counter()
+
+        start = time.perf_counter()
+        deadline = start + duration
+        while time.perf_counter() < deadline:
+            samples += 1
+            for ident, frame in sys._current_frames().items():
+                if ident == own_ident:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append((os.path.basename(code.co_filename), code.co_name, code.co_filename, frame.f_lineno))
+                    frame = frame.f_back
+                stack.reverse()
+                if not stack:
+                    continue
+
+                thread_samples[ident] += 1
+                if ident not in thread_names:
+                    thread_names = current_thread_names()
+                name = thread_names.get(ident, str(ident))
+                collapsed[';'.join([name] + [f"{entry[0]}:{entry[1]}" for entry in stack])] += 1
+
+                innermost = stack[-1]
+                if (innermost[0], innermost[1]) in IDLE_FRAMES:
+                    idle_samples[ident] += 1
+                    continue
+
+                labels = [f"{entry[1]} ({entry[2]}:{entry[3]})" for entry in stack]
+                self_counts[labels[-1]] += 1
+                # Count each function once per stack so recursion doesn't inflate it
+                for label in set(f"{entry[1]} ({entry[2]})" for entry in stack):
+                    cumulative_counts[label] += 1
+            time.sleep(self.interval)
+
+        elapsed = time.perf_counter() - start
+        thread_cpu = {}
+        for ident in thread_samples:
+            before, after = cpu_start.get(ident), _thread_cpu_time(ident)
+            thread_cpu[ident] = after - before if before is not None and after is not None else None
+
+        return ProfileResult(
+            duration=elapsed,
+            interval=self.interval,
+            samples=samples,
+            thread_samples=thread_samples,
+            idle_samples=idle_samples,
+            self_counts=self_counts,
+            cumulative_counts=cumulative_counts,
+            collapsed=collapsed,
+            thread_cpu=thread_cpu,
+            process_cpu=time.process_time() - process_cpu_start,
+            thread_names=thread_names
+        )
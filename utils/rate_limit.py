@@ -0,0 +1,35 @@
+# Token bucket for pacing outgoing requests below an API's rate limits
+import asyncio
+import time
+
+class TokenBucket:
+    """
+    Lets through rate acquisitions per second on average, with bursts of up to
+    capacity. Waiters are served in the order they arrived.
+    """
+
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self, tokens=1):
+        """Wait until tokens are available and take them"""
+        async with self._lock:
+            self._refill()
+            while self._tokens < tokens:
+                await asyncio.sleep((tokens - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= tokens
+
+    def pause(self, seconds):
+        """Let nothing through for the next seconds, e.g. after a 429's Retry-After"""
+        self._refill()
+        self._tokens = min(self._tokens, 0) - seconds * self.rate
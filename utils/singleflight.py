@@ -0,0 +1,79 @@
+# Coalesces identical in-flight calls so concurrent callers share one result
+import asyncio
+import concurrent.futures
+import functools
+import threading
+from utils.metrics import SINGLEFLIGHT_CALLS
+
+class SingleFlight:
+    """
+    While a call for a key is running, further calls for the same key wait for it
+    and get its result (or exception) instead of starting their own. Nothing is
+    cached: once the call finishes, the next caller starts a fresh one.
+
+    Results are shared between the callers, so they must be treated as read-only.
+    """
+
+    def __init__(self, group):
+        self.group = group
+        # key -> asyncio.Future, per event loop
+        self._tasks = {}
+        # key -> concurrent.futures.Future, for callers in worker threads
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    async def do(self, key, func, *args, **kwargs):
+        """Await func(*args, **kwargs), or the identical call already in flight"""
+        loop_key = (id(asyncio.get_running_loop()), key)
+        task = self._tasks.get(loop_key)
+        if task is None:
+            SINGLEFLIGHT_CALLS.inc(group=self.group, result='executed')
+            task = self._tasks[loop_key] = asyncio.ensure_future(func(*args, **kwargs))
+            task.add_done_callback(lambda _: self._tasks.pop(loop_key, None))
+        else:
+            SINGLEFLIGHT_CALLS.inc(group=self.group, result='coalesced')
+        # A cancelled caller must not cancel the call the others are waiting for
+        return await asyncio.shield(task)
+
+    def do_sync(self, key, func, *args, **kwargs):
+        """Blocking variant for code running in worker threads"""
+        with self._lock:
+            future = self._futures.get(key)
+            leader = future is None
+            if leader:
+                future = self._futures[key] = concurrent.futures.Future()
+        if not leader:
+            SINGLEFLIGHT_CALLS.inc(group=self.group, result='coalesced')
+            return future.result()
+
+        SINGLEFLIGHT_CALLS.inc(group=self.group, result='executed')
+        try:
+            result = func(*args, **kwargs)
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._futures[key]
+
+def single_flight(group):
+    """
+    Decorator for coroutine methods: concurrent calls with equal arguments share
+    one execution. Calls with unhashable arguments are run on their own.
+    """
+    flight = SingleFlight(group)
+
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(self, *args, **kwargs):
+            key = (func.__name__, args, tuple(sorted(kwargs.items())))
+            try:
+                hash(key)
+            except TypeError:
+                return await func(self, *args, **kwargs)
+            return await flight.do((id(self),) + key, func, self, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,122 @@
+# Lightweight request tracing built on contextvars
+import contextvars
+import itertools
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from config import TRACE_SLOW_THRESHOLD_MS, TRACE_EXPORT_FILE
+
+logger = logging.getLogger(__name__)
+
+# Both variables are copied into asyncio.to_thread calls, so spans from worker threads still land in the trace
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+_span_ids = itertools.count(1)
+_export_lock = threading.Lock()
+
+class Trace:
+    """Timing breakdown of one interaction or job"""
+
+    def __init__(self, name):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.name = name
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = None
+        self.spans = []
+        self._lock = threading.Lock()
+
+    def add_span(self, span):
+        with self._lock:
+            self.spans.append(span)
+
+    def to_dict(self):
+        return {
+            'trace_id': self.trace_id,
+            'name': self.name,
+            'started_at': self.started_at,
+            'duration_ms': round(self.duration * 1000, 2) if self.duration is not None else None,
+            'spans': sorted(self.spans, key=lambda span: span['offset_ms'])
+        }
+
+    def format_breakdown(self):
+        """Render the spans as an indented timeline"""
+        spans = sorted(self.spans, key=lambda span: span['offset_ms'])
+        depths = {}
+        lines = [f"Trace {self.trace_id} {self.name} took {self.duration * 1000:.1f}ms"]
+        for span in spans:
+            depth = depths.get(span['parent_id'], 0) + 1 if span['parent_id'] else 1
+            depths[span['id']] = depth
+            error = f" [{span['error']}]" if span['error'] else ''
+            lines.append(
+                f"{'  ' * depth}+{span['offset_ms']:.1f}ms {span['name']} {span['duration_ms']:.1f}ms{error}"
+            )
+        return '\n'.join(lines)
+
+def current_trace():
+    return _current_trace.get()
+
+def start_trace(name):
+    """Start a new trace in the current context and return it"""
+    trace = Trace(name)
+    trace.context_token = _current_trace.set(trace)
+    return trace
+
+def finish_trace(trace=None):
+    """Close a trace and export it if it was slower than TRACE_SLOW_THRESHOLD_MS"""
+    trace = trace or _current_trace.get()
+    if trace is None or trace.duration is not None:
+        return None
+    trace.duration = time.perf_counter() - trace.start
+    try:
+        _current_trace.reset(trace.context_token)
+    except ValueError:
+        # Finished from a different context (e.g. a dispatched event), nothing to reset
+        pass
+    if trace.duration * 1000 >= TRACE_SLOW_THRESHOLD_MS:
+        _export(trace)
+    return trace
+
+def _export(trace):
+    logger.warning("Slow %s", trace.format_breakdown())
+    if not TRACE_EXPORT_FILE:
+        return
+    try:
+        with _export_lock, open(TRACE_EXPORT_FILE, 'a') as f:
+            f.write(json.dumps(trace.to_dict()) + '\n')
+    except OSError as e:
+        logger.error("Could not write trace to %s: %s", TRACE_EXPORT_FILE, e)
+
+@contextmanager
+def span(name):
+    """Record a timed span in the current trace; does nothing outside a trace"""
+    trace = _current_trace.get()
+    if trace is None:
+        yield None
+        return
+
+    parent = _current_span.get()
+    start = time.perf_counter()
+    record = {
+        'id': next(_span_ids),
+        'parent_id': parent['id'] if parent else None,
+        'name': name,
+        'thread': threading.current_thread().name,
+        'offset_ms': round((start - trace.start) * 1000, 2),
+        'duration_ms': None,
+        'error': None
+    }
+    token = _current_span.set(record)
+    try:
+        yield record
+    except BaseException as e:
+        record['error'] = e.__class__.__name__
+        raise
+    finally:
+        record['duration_ms'] = round((time.perf_counter() - start) * 1000, 2)
+        _current_span.reset(token)
+        trace.add_span(record)